@@ -0,0 +1,270 @@
+"""Offline benchmarks for the word card cache
+
+Usage:
+    python benchmarks.py cards [--cards cards.jsonl] [--count 500]
+    python benchmarks.py responses [--corpus responses.jsonl] [--count 500]
+    python benchmarks.py quality [--cards cards.jsonl] [--count 500]
+    python benchmarks.py snapshot [--cards cards.jsonl] [--entries 30000]
+    python benchmarks.py concordance [--cards cards.jsonl] [--entries 30000]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import streamlit_app as app
+
+def load_cards(path, count):
+    """Read cards from a JSONL file, or synthesize fixture cards for every vocabulary word"""
+    if path:
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()][:count]
+
+    index = app.VocabularyIndex()
+    index.refresh(app.vocabulary_path())
+    cards = []
+    for word_id, locations in index.word_locations.items():
+        for section, subsection in sorted(locations):
+            cards.append(app.make_fixture_card(index.words[word_id], section, subsection))
+            if len(cards) >= count:
+                return cards
+    return cards
+
+def timed(func, repeat):
+    """Return the average seconds per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def compressed_size(codec, cards):
+    return sum(len(blob) for card in cards for blob in codec.encode(card).values())
+
+def benchmark_cards(cards, projected_entries):
+    """Compare raw and compressed card storage and codec throughput"""
+    half = len(cards) // 2 or 1
+    training, held_out = cards[:half], cards[half:] or cards
+    raw_bytes = sum(len(json.dumps(card, ensure_ascii=False).encode('utf-8')) for card in held_out)
+
+    plain = app.CardCodec(b'')
+    trained = app.CardCodec(app.train_card_dictionary(training))
+    plain_bytes = compressed_size(plain, held_out)
+    trained_bytes = compressed_size(trained, held_out)
+
+    encoded = [trained.encode(card) for card in held_out]
+    encode_seconds = timed(lambda: [trained.encode(card) for card in held_out], 3)
+    decode_seconds = timed(lambda: [app.CompressedCard(trained, blobs).to_dict() for blobs in encoded], 3)
+    core_seconds = timed(lambda: [app.CompressedCard(trained, blobs)['russian_word'] for blobs in encoded], 3)
+
+    per_card_raw = raw_bytes / len(held_out)
+    per_card_trained = trained_bytes / len(held_out)
+    print(f"codec: {trained.kind}, dictionary {len(trained.dictionary)} bytes, "
+          f"trained on {len(training)} cards, measured on {len(held_out)}")
+    print(f"raw JSON:             {raw_bytes:>10} bytes ({per_card_raw:.0f} per card)")
+    print(f"compressed, no dict:  {plain_bytes:>10} bytes ({raw_bytes / plain_bytes:.2f}x)")
+    print(f"compressed, dict:     {trained_bytes:>10} bytes ({raw_bytes / trained_bytes:.2f}x)")
+    print(f"encode: {len(held_out) / encode_seconds:,.0f} cards/s")
+    print(f"decode all groups: {len(held_out) / decode_seconds:,.0f} cards/s")
+    print(f"decode core field only: {len(held_out) / core_seconds:,.0f} cards/s")
+    print(f"projected for {projected_entries:,} cards: {projected_entries * per_card_raw / 2**20:.1f} MB raw, "
+          f"{projected_entries * per_card_trained / 2**20:.1f} MB compressed")
+
+def legacy_extract(response_text):
+    """The line-based extraction the app used before extract_json_object"""
+    response_text = response_text.strip()
+    if response_text.startswith('```'):
+        lines = response_text.split('\n')
+        json_lines = []
+        in_json = False
+        for line in lines:
+            if line.strip().startswith('{') or in_json:
+                in_json = True
+                json_lines.append(line)
+                if line.strip().endswith('}') and line.count('}') >= line.count('{'):
+                    break
+        response_text = '\n'.join(json_lines)
+
+    start_idx = response_text.find('{')
+    end_idx = response_text.rfind('}') + 1
+    if start_idx == -1 or end_idx == 0:
+        raise ValueError("No valid JSON found in response")
+    content = json.loads(response_text[start_idx:end_idx])
+    if not all(key in content for key in app.REQUIRED_CARD_KEYS):
+        raise ValueError("Missing required keys in response")
+    return content
+
+def synthesize_responses(count, seed=0):
+    """Fixture cards wrapped the ways model output tends to arrive"""
+    rng = random.Random(seed)
+    wrappers = {
+        'bare': lambda text: text,
+        'fenced': lambda text: f"```json\n{text}\n```",
+        'prefixed': lambda text: f"Here is the JSON for the word {{as requested}}:\n\n{text}",
+        'commentary': lambda text: f"```json\n{text}\n```\n\nNote: cases use {{nominative}} forms.",
+        'nested fence': lambda text: f"```\n```json\n{text}\n```\n```",
+        'braces in strings': lambda text: text.replace('"beginner"', '"beginner {easy} }"'),
+        'truncated': lambda text: text[:len(text) - rng.randint(20, 200)],
+    }
+    responses = []
+    for number in range(count):
+        card = app.make_fixture_card(f"word {number}", 'Core Subjects', 'Anatomy')
+        text = json.dumps(card, ensure_ascii=False, indent=rng.choice([None, 2, 4]))
+        kind = rng.choice(list(wrappers))
+        responses.append((kind, wrappers[kind](text)))
+    return responses
+
+def load_responses(path, count):
+    with open(path, encoding='utf-8') as f:
+        return [('recorded', json.loads(line)['text']) for line in f if line.strip()][:count]
+
+def benchmark_responses(responses):
+    """Compare success rate and throughput of the response extractors"""
+    total_bytes = sum(len(text.encode('utf-8')) for _, text in responses)
+    kinds = sorted({kind for kind, _ in responses})
+    print(f"{len(responses)} responses, {total_bytes / 1024:.0f} KB")
+    for name, extract in [('legacy', legacy_extract), ('extract_json_object', app.parse_card_response)]:
+        successes = {kind: [0, 0] for kind in kinds}
+        start = time.perf_counter()
+        for kind, text in responses:
+            successes[kind][1] += 1
+            try:
+                extract(text)
+                successes[kind][0] += 1
+            except ValueError:
+                pass
+        seconds = time.perf_counter() - start
+        ok = sum(passed for passed, _ in successes.values())
+        print(f"\n{name}: {ok / len(responses):.1%} parsed, {len(responses) / seconds:,.0f} responses/s, "
+              f"{total_bytes / seconds / 2**20:.1f} MB/s")
+        for kind in kinds:
+            passed, seen = successes[kind]
+            print(f"  {kind:<18} {passed}/{seen}")
+
+def break_card(card, rng):
+    """A copy of a card with one of the defects the quality checks look for"""
+    card = json.loads(json.dumps(card, ensure_ascii=False))
+    defect = rng.choice(['latin', 'stress', 'cases', 'empty', 'gender'])
+    if defect == 'latin':
+        card['russian_word'] = f"{card['english_word']} ({card['english_word']})"
+    elif defect == 'stress':
+        card['pronunciation_stress'] = app.strip_stress(card['pronunciation_stress']).replace('ё', 'е')
+    elif defect == 'cases':
+        card['cases'] = {case: 'not applicable' for case in app.CASE_NAMES}
+    elif defect == 'empty':
+        card['answer'] = ''
+    else:
+        card['gender'] = 'not applicable'
+    return card
+
+def benchmark_quality(cards):
+    """Time the card quality checks on good cards and on cards with a defect each"""
+    rng = random.Random(0)
+    broken = [break_card(card, rng) for card in cards]
+    for name, batch in [('good cards', cards), ('broken cards', broken)]:
+        seconds = timed(lambda: [app.check_card_quality(card) for card in batch], 5)
+        rejected = sum(bool(app.check_card_quality(card)) for card in batch)
+        print(f"{name:<13} {seconds / len(batch) * 1e6:>7.1f} µs per card, {rejected}/{len(batch)} rejected")
+
+def snapshot_cards(cards, entries):
+    """Spread sample cards over vocabulary keys until there are `entries` of them"""
+    index = app.VocabularyIndex()
+    index.refresh(app.vocabulary_path())
+    keys = [(index.words[word_id], section, subsection)
+            for word_id, locations in index.word_locations.items() for section, subsection in sorted(locations)]
+    spread = []
+    for number in range(entries):
+        word, section, subsection = keys[number % len(keys)]
+        if number >= len(keys):
+            word = f"{word} {number // len(keys)}"
+        card = {**cards[number % len(cards)], 'english_word': word, 'section': section, 'subsection': subsection}
+        spread.append((app.make_card_key(word, section, subsection), card))
+    return spread
+
+def benchmark_snapshot(cards, entries):
+    """Compare booting from a snapshot with filling a cold cache, and time snapshot lookups"""
+    items = snapshot_cards(cards, entries)
+    lookups = [card_key for card_key, _ in random.Random(0).sample(items, min(2000, len(items)))]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cards.snapshot')
+        start = time.perf_counter()
+        header = app.write_card_snapshot(path, items)
+        build_seconds = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        load_seconds = timed(lambda: app.CardSnapshot(path), 20)
+        cache = app.CardCache(app.CARD_CACHE_MAX_ENTRIES, app.CARD_CACHE_MAX_BYTES, app.default_card_codec(),
+                              app.CardSnapshot(path))
+        lookup_seconds = timed(lambda: [cache.get(card_key)['russian_word'] for card_key in lookups], 3)
+        miss_seconds = timed(lambda: [cache.get(f"{card_key}?") for card_key in lookups], 3)
+
+        cold = app.CardCache(app.CARD_CACHE_MAX_ENTRIES, app.CARD_CACHE_MAX_BYTES, app.default_card_codec())
+        start = time.perf_counter()
+        for card_key, card in items:
+            cold.put(card_key, card)
+        fill_seconds = time.perf_counter() - start
+
+    print(f"{header['cards']} cards from {len(cards)} distinct samples, {header['codec']}")
+    print(f"build:  {build_seconds:.2f}s, {size / 2**20:.1f} MB ({size / header['cards']:.0f} bytes per card)")
+    print(f"load:   {load_seconds * 1000:.2f} ms (memory-mapped, index not parsed)")
+    print(f"lookup: {len(lookups) / lookup_seconds:,.0f} cards/s with one field decoded, "
+          f"misses {len(lookups) / miss_seconds:,.0f}/s")
+    print(f"filling a cold cache with the same cards instead: {fill_seconds:.2f}s")
+
+def benchmark_concordance(cards, entries):
+    """Time indexing example sentences and answering typical concordance queries"""
+    items = snapshot_cards(cards, entries)
+    cache = app.get_card_cache()
+    for card_key, card in items:
+        cache.put(card_key, card)
+    # The app's index is filled from the cache through its listener
+    start = time.perf_counter()
+    concordance = app.get_concordance()
+    index_seconds = time.perf_counter() - start
+    print(f"{len(concordance):,} sentences from {len(items):,} cards indexed in {index_seconds:.2f}s, "
+          f"{len(concordance.tokens):,} distinct tokens")
+    words = [card['lemma'] for card in cards if card.get('lemma')]
+    for query in ['genitive', 'negation', words[0], f"{words[-1]} nominative"]:
+        tokens, tags = app.parse_concordance_query(query)
+        seconds = timed(lambda: app.find_example_sentences(tokens, tags), 20)
+        found = len(app.find_example_sentences(tokens, tags))
+        print(f"  {query!r:<28} {seconds * 1000:>6.2f} ms, {found} sentences")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    cards_parser = subparsers.add_parser('cards', help='card compression ratio and codec throughput')
+    cards_parser.add_argument('--cards', help='JSONL file of real cards (default: fixture cards)')
+    cards_parser.add_argument('--count', type=int, default=500)
+    cards_parser.add_argument('--project', type=int, default=31000, help='entry count to project memory for')
+    responses_parser = subparsers.add_parser('responses', help='JSON extraction success rate and throughput')
+    responses_parser.add_argument('--corpus', help='JSONL of recorded responses (RESPONSE_CORPUS_PATH); default: synthetic')
+    responses_parser.add_argument('--count', type=int, default=500)
+    quality_parser = subparsers.add_parser('quality', help='card quality check speed and catch rate')
+    quality_parser.add_argument('--cards', help='JSONL file of real cards (default: fixture cards)')
+    quality_parser.add_argument('--count', type=int, default=500)
+    snapshot_parser = subparsers.add_parser('snapshot', help='warm cache snapshot build, load and lookup times')
+    snapshot_parser.add_argument('--cards', help='JSONL file of real cards (default: fixture cards)')
+    snapshot_parser.add_argument('--count', type=int, default=500, help='distinct sample cards')
+    snapshot_parser.add_argument('--entries', type=int, default=30000, help='cards in the snapshot')
+    concordance_parser = subparsers.add_parser('concordance', help='example sentence index build and query times')
+    concordance_parser.add_argument('--cards', help='JSONL file of real cards (default: fixture cards)')
+    concordance_parser.add_argument('--count', type=int, default=500, help='distinct sample cards')
+    concordance_parser.add_argument('--entries', type=int, default=30000, help='cards to index')
+    args = parser.parse_args()
+
+    if args.benchmark == 'cards':
+        benchmark_cards(load_cards(args.cards, args.count), args.project)
+    elif args.benchmark == 'responses':
+        responses = load_responses(args.corpus, args.count) if args.corpus else synthesize_responses(args.count)
+        benchmark_responses(responses)
+    elif args.benchmark == 'quality':
+        benchmark_quality(load_cards(args.cards, args.count))
+    elif args.benchmark == 'snapshot':
+        benchmark_snapshot(load_cards(args.cards, args.count), args.entries)
+    elif args.benchmark == 'concordance':
+        benchmark_concordance(load_cards(args.cards, args.count), args.entries)
+
+if __name__ == '__main__':
+    main()
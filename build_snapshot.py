@@ -0,0 +1,92 @@
+"""Build a warm card cache snapshot that servers map into memory at boot
+
+Usage:
+    python build_snapshot.py [--cards cards.jsonl ...] [--responses responses.jsonl ...]
+                             [--base cards.snapshot] [--output cards.snapshot]
+    python build_snapshot.py --info cards.snapshot
+
+Cards come from an existing snapshot, JSONL files of cards, and recorded model
+responses (RESPONSE_CORPUS_PATH), which are parsed and checked the way the app
+does before caching; later sources win for the same word. The app loads the
+snapshot at CARD_SNAPSHOT_PATH when it starts, and can save its own cache to
+it from the admin panel.
+"""
+import argparse
+import json
+import sys
+import time
+
+import streamlit_app as app
+
+def read_cards(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                card = json.loads(line)
+                yield app.make_card_key(card['english_word'], card['section'], card['subsection']), card
+
+def read_responses(path, rejected):
+    """Cards from recorded responses that parse and pass the quality checks"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            try:
+                content = app.parse_card_response(record['text'])
+                if app.LOCAL_MORPHOLOGY:
+                    app.apply_local_morphology(content)
+            except ValueError:
+                rejected.append(record['english_word'])
+                continue
+            if app.check_card_quality(content):
+                rejected.append(record['english_word'])
+                continue
+            card_key = app.make_card_key(record['english_word'], record['section'], record['subsection'])
+            yield card_key, {'english_word': record['english_word'], 'section': record['section'],
+                             'subsection': record['subsection'], **content}
+
+def show_info(path):
+    snapshot = app.CardSnapshot(path, verify=True)
+    header = snapshot.header
+    print(f"{path}: format {header['format']}, {header['cards']} cards, {snapshot.size() / 2**20:.1f} MB, "
+          f"{header['codec']} with a {header['dictionary_bytes']} byte dictionary")
+    print(f"built {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['created_at']))}, checksum ok")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base', help='existing snapshot to start from')
+    parser.add_argument('--cards', action='append', default=[], help='JSONL file of cards')
+    parser.add_argument('--responses', action='append', default=[], help='JSONL of recorded model responses')
+    parser.add_argument('--output', default=app.CARD_SNAPSHOT_PATH)
+    parser.add_argument('--info', metavar='SNAPSHOT', help='describe and verify a snapshot instead')
+    args = parser.parse_args()
+
+    if args.info:
+        show_info(args.info)
+        return
+    if not (args.base or args.cards or args.responses):
+        parser.error('give at least one of --base, --cards or --responses')
+
+    cards = {}
+    if args.base:
+        snapshot = app.CardSnapshot(args.base, verify=True)
+        cards.update((card_key, app.CompressedCard(snapshot.codec, snapshot.get_blobs(card_key)).to_dict())
+                     for card_key in snapshot.keys())
+    for path in args.cards:
+        cards.update(read_cards(path))
+    rejected = []
+    for path in args.responses:
+        cards.update(read_responses(path, rejected))
+    if rejected:
+        print(f"skipped {len(rejected)} responses that failed parsing or quality checks")
+    if not cards:
+        sys.exit('no cards to write')
+
+    start = time.perf_counter()
+    header = app.write_card_snapshot(args.output, cards.items())
+    print(f"wrote {header['cards']} cards to {args.output} in {time.perf_counter() - start:.1f}s")
+    show_info(args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Compile db.json into the validated vocabulary artifact the app serves
+
+Usage:
+    python compile_vocabulary.py [--source db.json] [--output vocabulary.json] [--check]
+
+Words are normalized and deduplicated within each subsection, subsections
+nested by mistake are moved up, empty ones are dropped, and near-identical
+subsections or missing names are reported. Errors leave the artifact unwritten.
+"""
+import argparse
+import json
+import os
+import sys
+
+import streamlit_app as app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default=app.VOCABULARY_SOURCE_PATH)
+    parser.add_argument('--output', default=app.VOCABULARY_PATH)
+    parser.add_argument('--check', action='store_true', help='report only; fail if the artifact is out of date')
+    args = parser.parse_args()
+
+    with open(args.source, 'rb') as f:
+        raw = f.read()
+    artifact, issues = app.compile_vocabulary(json.loads(raw), app.vocabulary_checksum(raw))
+
+    for level, message in issues:
+        print(f"{level:>7}: {message}")
+    removed = artifact['source_entry_count'] - artifact['word_count']
+    print(f"{artifact['subsection_count']} subsections, {artifact['word_count']} words "
+          f"({removed} duplicate entries removed from {artifact['source_entry_count']})")
+
+    if any(level == 'error' for level, _ in issues):
+        sys.exit('not written: fix the errors above')
+    app.validate_vocabulary_artifact(artifact)
+
+    if args.check:
+        try:
+            with open(args.output, encoding='utf-8') as f:
+                current = json.load(f)
+        except FileNotFoundError:
+            current = None
+        if current != artifact:
+            sys.exit(f"{args.output} is out of date; run compile_vocabulary.py")
+        print(f"{args.output} is up to date")
+        return
+
+    temporary_path = f"{args.output}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        json.dump(artifact, f, ensure_ascii=False, separators=(',', ':'))
+        f.write('\n')
+    # Replace in one step so the running app never reads a half-written file
+    os.replace(temporary_path, args.output)
+    print(f"wrote {args.output}")
+
+if __name__ == '__main__':
+    main()
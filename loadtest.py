@@ -0,0 +1,352 @@
+"""Load-test the app with a classroom of simultaneous sessions against a fake model
+
+Usage:
+    python loadtest.py run [--concurrency 1 10 50 200] [--clicks 5] [--think 2.0]
+                           [--latency-median 1.5] [--latency-sigma 0.6] [--error-rate 0.02]
+    python loadtest.py run --url http://host:8501 [--pid SERVER_PID] ...
+    python loadtest.py serve [--port 8599] [--latency-median 1.5] ...
+
+`run` starts the app on a local port with the fake model (the `serve`
+subcommand) unless --url points at an app that is already running, then
+drives it over Streamlit's websocket protocol the way a browser does: each
+simulated student opens a random subsection and clicks "Get Next Word" a few
+times with think time in between. CPU and RSS are read for the server
+process, so they are only reported when it runs on this machine.
+
+The app's model quota usually dominates tail latency; --requests-per-minute
+shows how the same classroom behaves on a larger one, and --hedge turns on
+hedged model requests to compare their tail against the extra calls.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from websockets.asyncio.client import connect
+
+import streamlit_app as app
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlit_app.py')
+NEXT_WORD_LABEL = 'Get Next Word'
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel with log-normal latency and occasional failures"""
+    latency_median = 1.5
+    latency_sigma = 0.6
+    error_rate = 0.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(random.lognormvariate(math.log(self.latency_median), self.latency_sigma))
+        if random.random() < self.error_rate:
+            raise RuntimeError('503 The model is overloaded (fake)')
+        word = re.search(r'English word: "([^"]*)"', prompt)
+        card = app.make_fixture_card(word.group(1) if word else 'word', 'Load', 'Test')
+        return FakeResponse(f"```json\n{json.dumps(card, ensure_ascii=False, indent=2)}\n```")
+
+def serve(args):
+    """Run the app in this process with the fake model in place of Gemini"""
+    import google.generativeai as genai
+    from streamlit.web import bootstrap
+
+    FakeModel.latency_median = args.latency_median
+    FakeModel.latency_sigma = args.latency_sigma
+    FakeModel.error_rate = args.error_rate
+    genai.GenerativeModel = FakeModel
+    genai.configure = lambda **kwargs: None
+
+    # A throwaway key so the app configures the model instead of going cache-only
+    secrets = tempfile.NamedTemporaryFile('w', suffix='.toml', delete=False)
+    secrets.write('GEMINI_API_KEY = "loadtest"\n')
+    if args.requests_per_minute:
+        secrets.write(f"MODEL_REQUESTS_PER_MINUTE = {args.requests_per_minute}\n")
+    if args.hedge:
+        secrets.write('HEDGE_REQUESTS = true\n')
+    secrets.close()
+    flags = {
+        'server.port': args.port,
+        'server.headless': True,
+        'browser.gatherUsageStats': False,
+        'secrets.files': [secrets.name]
+    }
+    bootstrap.load_config_options(flag_options=flags)
+    bootstrap.run(APP_PATH, False, [], flags)
+
+def start_server(args):
+    """Start `serve` in a child process and wait until it answers health checks"""
+    url = f"http://localhost:{args.port}"
+    try:
+        with urllib.request.urlopen(f"{url}/_stcore/health", timeout=2):
+            sys.exit(f"something is already serving {url}; pass --url to test it or pick another --port")
+    except OSError:
+        pass
+
+    command = [sys.executable, os.path.abspath(__file__), 'serve', '--port', str(args.port),
+               '--latency-median', str(args.latency_median), '--latency-sigma', str(args.latency_sigma),
+               '--error-rate', str(args.error_rate)]
+    if args.requests_per_minute:
+        command += ['--requests-per-minute', str(args.requests_per_minute)]
+    if args.hedge:
+        command.append('--hedge')
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(APP_PATH))
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"server exited with status {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"{url}/_stcore/health", timeout=2):
+                return server, url
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    sys.exit('server did not start within 60 seconds')
+
+class ProcessMonitor:
+    """Samples CPU time and RSS of a local process from /proc"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak_rss = 0.0
+        self.peak_cpu = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def cpu_seconds(self):
+        try:
+            with open(f"/proc/{self.pid}/stat", encoding='ascii') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError):
+            return None
+
+    def rss_mb(self):
+        try:
+            with open(f"/proc/{self.pid}/status", encoding='ascii') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def start(self):
+        self.peak_rss = self.rss_mb() or 0.0
+        self.peak_cpu = 0.0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        last_time, last_cpu = time.monotonic(), self.cpu_seconds()
+        while not self._stop.wait(0.2):
+            self.peak_rss = max(self.peak_rss, self.rss_mb() or 0.0)
+            now, cpu = time.monotonic(), self.cpu_seconds()
+            if now - last_time >= 1.0 and cpu is not None and last_cpu is not None:
+                # Busiest second; one core is 100% and the GIL keeps the app near it
+                self.peak_cpu = max(self.peak_cpu, (cpu - last_cpu) / (now - last_time))
+                last_time, last_cpu = now, cpu
+
+class Session:
+    """One browser tab speaking Streamlit's websocket protocol"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.buttons = {}
+        self.errors = []
+        self.bytes_received = 0
+
+    async def run_script(self, widget_id=None):
+        """Request a script run, optionally triggering a button, and read until it settles"""
+        message = BackMsg()
+        message.rerun_script.query_string = ''
+        message.rerun_script.page_script_hash = ''
+        if widget_id:
+            widget = message.rerun_script.widget_states.widgets.add()
+            widget.id = widget_id
+            widget.trigger_value = True
+        await self.websocket.send(message.SerializeToString())
+
+        self.buttons = {}
+        self.errors = []
+        while True:
+            data = await self.websocket.recv()
+            self.bytes_received += len(data)
+            forward = ForwardMsg()
+            forward.ParseFromString(data)
+            kind = forward.WhichOneof('type')
+            if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type == 'button':
+                    self.buttons.setdefault(element.button.label, element.button.id)
+                elif element_type == 'exception':
+                    self.errors.append(element.exception.message)
+                elif element_type == 'alert' and element.alert.format == Alert.ERROR:
+                    self.errors.append(element.alert.body)
+            elif kind == 'script_finished':
+                if forward.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    # The click handler called st.rerun(); the next run follows
+                    self.buttons = {}
+                    continue
+                if forward.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    self.errors.append('script compile error')
+                return
+
+    def button(self, label_part):
+        return next((widget_id for label, widget_id in self.buttons.items() if label_part in label), None)
+
+async def student(number, level, url, subsections, args, result):
+    """Open a subsection, then ask for words with think time in between"""
+    rng = random.Random(f"{level}|{number}")
+    stream_url = url.replace('http', 'ws', 1).rstrip('/') + '/_stcore/stream'
+    try:
+        async with connect(stream_url, subprotocols=['streamlit'], max_size=None) as websocket:
+            session = Session(websocket)
+            await asyncio.wait_for(session.run_script(), args.timeout)
+            subsection = rng.choice(subsections)
+            widget_id = session.buttons.get(subsection)
+            if widget_id is None:
+                result['errors'].append(f"no button for {subsection}")
+                return
+            await asyncio.wait_for(session.run_script(widget_id), args.timeout)
+
+            for _ in range(args.clicks):
+                await asyncio.sleep(rng.uniform(0, 2 * args.think))
+                widget_id = session.button(NEXT_WORD_LABEL)
+                if widget_id is None:
+                    break
+                start = time.perf_counter()
+                await asyncio.wait_for(session.run_script(widget_id), args.timeout)
+                result['latencies'].append(time.perf_counter() - start)
+                result['errors'].extend(session.errors)
+            result['bytes'] += session.bytes_received
+    except Exception as e:
+        result['errors'].append(f"{type(e).__name__}: {str(e) or 'no reply within the timeout'}")
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+async def run_level(concurrency, url, subsections, args, monitor):
+    """Start the given number of students over the ramp time and summarize what they saw"""
+    result = {'latencies': [], 'errors': [], 'bytes': 0}
+    cpu_before = monitor.cpu_seconds() if monitor else None
+    if monitor:
+        monitor.start()
+    start = time.perf_counter()
+    tasks = []
+    for number in range(concurrency):
+        tasks.append(asyncio.create_task(student(number, concurrency, url, subsections, args, result)))
+        # Students arrive over the first seconds of the lesson, not in one instant
+        await asyncio.sleep(args.ramp / concurrency)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    cpu = None
+    if monitor:
+        monitor.stop()
+        cpu_after = monitor.cpu_seconds()
+        if cpu_before is not None and cpu_after is not None:
+            cpu = (cpu_after - cpu_before) / elapsed
+    latencies = result['latencies']
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'error_rate': len(result['errors']) / max(len(latencies) + len(result['errors']), 1),
+        'kb_per_session': result['bytes'] / 1024 / concurrency,
+        'cpu': cpu,
+        'peak_cpu': monitor.peak_cpu if monitor else None,
+        'rss': monitor.peak_rss if monitor else None,
+        'sample_error': result['errors'][0] if result['errors'] else ''
+    }
+
+def run(args):
+    index = app.VocabularyIndex()
+    index.refresh(app.vocabulary_path())
+    subsections = [subsection for section in index.sections.values() for subsection in section]
+
+    server = None
+    url = args.url
+    pid = args.pid
+    if not url:
+        server, url = start_server(args)
+        pid = server.pid
+    monitor = ProcessMonitor(pid) if pid and os.path.exists(f"/proc/{pid}") else None
+
+    print(f"{'sessions':>8} {'requests':>8} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+          f"{'errors':>7} {'KB/sess':>8} {'CPU':>6} {'peak':>6} {'RSS MB':>7}")
+    try:
+        for concurrency in args.concurrency:
+            row = asyncio.run(run_level(concurrency, url, subsections, args, monitor))
+            cpu = f"{row['cpu']:.0%}" if row['cpu'] is not None else '-'
+            peak_cpu = f"{row['peak_cpu']:.0%}" if row['peak_cpu'] is not None else '-'
+            rss = f"{row['rss']:.0f}" if row['rss'] is not None else '-'
+            print(f"{row['concurrency']:>8} {row['requests']:>8} {row['throughput']:>7.2f} {row['p50']:>7.2f} "
+                  f"{row['p95']:>7.2f} {row['p99']:>7.2f} {row['error_rate']:>7.1%} {row['kb_per_session']:>8.0f} "
+                  f"{cpu:>6} {peak_cpu:>6} {rss:>7}")
+            if row['sample_error']:
+                print(f"{'':>8} e.g. {row['sample_error'][:100]}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    fake_model = argparse.ArgumentParser(add_help=False)
+    fake_model.add_argument('--port', type=int, default=8599)
+    fake_model.add_argument('--latency-median', type=float, default=1.5, help='fake model median latency in seconds')
+    fake_model.add_argument('--latency-sigma', type=float, default=0.6, help='log-normal spread of the fake model latency')
+    fake_model.add_argument('--error-rate', type=float, default=0.02, help='share of fake model calls that fail')
+    fake_model.add_argument('--requests-per-minute', type=float,
+                            help="override the app's model quota (default: the free-tier limit it ships with)")
+    fake_model.add_argument('--hedge', action='store_true', help='enable hedged model requests in the app')
+
+    subparsers.add_parser('serve', parents=[fake_model], help='run the app with the fake model')
+    run_parser = subparsers.add_parser('run', parents=[fake_model], help='drive simulated sessions at rising concurrency')
+    run_parser.add_argument('--url', help='app that is already running (default: start one with the fake model)')
+    run_parser.add_argument('--pid', type=int, help='process id of the --url server, for CPU and RSS')
+    run_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 200])
+    run_parser.add_argument('--clicks', type=int, default=5, help='"Get Next Word" clicks per session')
+    run_parser.add_argument('--think', type=float, default=2.0, help='mean seconds between clicks')
+    run_parser.add_argument('--ramp', type=float, default=10.0, help="seconds over which a level's sessions start")
+    run_parser.add_argument('--timeout', type=float, default=120.0, help='seconds one script run may take')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args)
+    else:
+        run(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Replay a card access log against cache eviction policies
+
+Usage:
+    python simulate_cache.py access.log [--capacities 500 5000 31000] [--ttl-hours 24]
+    python simulate_cache.py --synthetic 20000 [--cohorts 4 --random-share 0.3]
+
+The access log is written by the app when ACCESS_LOG_PATH is set in the
+secrets. Every miss is a model call, so misses per day project API usage.
+"""
+import argparse
+import random
+from collections import OrderedDict, defaultdict
+
+import streamlit_app as app
+
+class LRUCache:
+    name = 'LRU'
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def access(self, key, now):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return True
+        self.entries[key] = None
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return False
+
+class LFUCache:
+    name = 'LFU'
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.buckets = defaultdict(OrderedDict)
+        self.min_count = 0
+
+    def _bump(self, key):
+        count = self.counts[key]
+        del self.buckets[count][key]
+        if not self.buckets[count]:
+            del self.buckets[count]
+            if self.min_count == count:
+                self.min_count += 1
+        self.counts[key] = count + 1
+        self.buckets[count + 1][key] = None
+
+    def access(self, key, now):
+        if key in self.counts:
+            self._bump(key)
+            return True
+        if len(self.counts) >= self.capacity:
+            # Least frequent first, least recent among equals
+            evicted, _ = self.buckets[self.min_count].popitem(last=False)
+            if not self.buckets[self.min_count]:
+                del self.buckets[self.min_count]
+            del self.counts[evicted]
+        self.counts[key] = 1
+        self.buckets[1][key] = None
+        self.min_count = 1
+        return False
+
+class ARCCache:
+    """Adaptive Replacement Cache (Megiddo & Modha)"""
+    name = 'ARC'
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.target = 0
+        self.t1, self.t2, self.b1, self.b2 = OrderedDict(), OrderedDict(), OrderedDict(), OrderedDict()
+
+    def _replace(self, key):
+        if self.t1 and (len(self.t1) > self.target or (key in self.b2 and len(self.t1) == self.target)):
+            evicted, _ = self.t1.popitem(last=False)
+            self.b1[evicted] = None
+        else:
+            evicted, _ = self.t2.popitem(last=False)
+            self.b2[evicted] = None
+
+    def access(self, key, now):
+        if key in self.t1:
+            del self.t1[key]
+            self.t2[key] = None
+            return True
+        if key in self.t2:
+            self.t2.move_to_end(key)
+            return True
+
+        if key in self.b1:
+            self.target = min(self.capacity, self.target + max(len(self.b2) // len(self.b1), 1))
+            self._replace(key)
+            del self.b1[key]
+            self.t2[key] = None
+        elif key in self.b2:
+            self.target = max(0, self.target - max(len(self.b1) // len(self.b2), 1))
+            self._replace(key)
+            del self.b2[key]
+            self.t2[key] = None
+        else:
+            if len(self.t1) + len(self.b1) == self.capacity:
+                if len(self.t1) < self.capacity:
+                    self.b1.popitem(last=False)
+                    self._replace(key)
+                else:
+                    self.t1.popitem(last=False)
+            elif len(self.t1) + len(self.b1) < self.capacity:
+                total = len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2)
+                if total >= self.capacity:
+                    if total == 2 * self.capacity:
+                        self.b2.popitem(last=False)
+                    self._replace(key)
+            self.t1[key] = None
+        return False
+
+class TTLCache:
+    """LRU bounded by capacity whose entries also expire a fixed time after they were generated"""
+    name = 'TTL'
+
+    def __init__(self, capacity, ttl_seconds):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+
+    def access(self, key, now):
+        created = self.entries.get(key)
+        if created is not None and now - created < self.ttl_seconds:
+            self.entries.move_to_end(key)
+            return True
+        self.entries.pop(key, None)
+        self.entries[key] = now
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return False
+
+def read_access_log(path):
+    with open(path, encoding='utf-8') as f:
+        return [app.parse_access_log_line(line) for line in f if line.strip()]
+
+def synthesize_access_log(requests, cohorts, random_share, seed=0):
+    """Simulate students who each open a subsection and take a few words"""
+    rng = random.Random(seed)
+    index = app.VocabularyIndex()
+    index.refresh(app.vocabulary_path())
+    subsections = [(section, subsection) for section, subsection in index.word_counts if index.word_counts[(section, subsection)]]
+    # A few subsections are far more popular than the rest
+    weights = [1 / (rank + 1) for rank in range(len(subsections))]
+
+    events = []
+    timestamp = 0.0
+    while len(events) < requests:
+        section, subsection = rng.choices(subsections, weights)[0]
+        words = index.sections[section][subsection]
+        if rng.random() < random_share:
+            cohort = ''
+            picks = rng.sample(words, min(app.SUBSECTION_WORD_GOAL, len(words)))
+        else:
+            cohort = f"cohort-{rng.randrange(cohorts)}"
+            picks = index.ordered_words(section, subsection, 'cohort', cohort)[:app.SUBSECTION_WORD_GOAL]
+        for word in picks:
+            timestamp += rng.expovariate(requests / 86400)
+            events.append({'timestamp': timestamp, 'cohort': cohort, 'section': section,
+                           'subsection': subsection, 'word': word, 'hit': False, 'latency_ms': 0})
+    return events[:requests]
+
+def simulate(events, policies):
+    """Return {policy name: hits} after replaying every event through each policy"""
+    hits = {}
+    for policy in policies:
+        count = 0
+        for event in events:
+            key = app.make_card_key(event['word'], event['section'], event['subsection'])
+            count += policy.access(key, event['timestamp'])
+        hits[policy.name] = count
+    return hits
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log', nargs='?', help='access log written by the app')
+    parser.add_argument('--synthetic', type=int, metavar='REQUESTS', help='simulate a day of this many requests instead')
+    parser.add_argument('--cohorts', type=int, default=4)
+    parser.add_argument('--random-share', type=float, default=0.3, help='share of students using random word order')
+    parser.add_argument('--capacities', type=int, nargs='+', default=[500, 1000, 5000, 10000, 31000])
+    parser.add_argument('--ttl-hours', type=float, default=24.0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        events = synthesize_access_log(args.synthetic, args.cohorts, args.random_share)
+    elif args.log:
+        events = read_access_log(args.log)
+    else:
+        parser.error('give an access log or --synthetic REQUESTS')
+    if not events:
+        parser.error('no requests to replay')
+
+    events.sort(key=lambda event: event['timestamp'])
+    span_days = max((events[-1]['timestamp'] - events[0]['timestamp']) / 86400, 1 / 24)
+    distinct = len({(event['section'], event['subsection'], event['word']) for event in events})
+    print(f"{len(events)} requests over {span_days:.2f} days, {distinct} distinct cards "
+          f"(best possible hit ratio {1 - distinct / len(events):.1%})")
+    if not args.synthetic:
+        logged_hits = sum(event['hit'] for event in events)
+        print(f"observed hit ratio in production: {logged_hits / len(events):.1%}")
+
+    print(f"{'capacity':>9} {'policy':>6} {'hit ratio':>10} {'API calls/day':>14}")
+    for capacity in args.capacities:
+        policies = [LRUCache(capacity), LFUCache(capacity), ARCCache(capacity),
+                    TTLCache(capacity, args.ttl_hours * 3600)]
+        for name, hits in simulate(events, policies).items():
+            misses = len(events) - hits
+            print(f"{capacity:>9} {name:>6} {hits / len(events):>10.1%} {misses / span_days:>14,.0f}")
+
+if __name__ == '__main__':
+    main()
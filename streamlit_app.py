@@ -1,55 +1,2693 @@
 import streamlit as st
 import google.generativeai as genai
+import abc
+import hashlib
+import heapq
+import io
+import mmap
+import numpy as np
 import json
+import os
 import random
+import re
+import struct
+import sys
+import threading
+import time
+import unicodedata
+import urllib.parse
+import urllib.request
+import weakref
+import zlib
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+def get_secret(name, default=None):
+    """Read an optional setting from st.secrets, tolerating a missing secrets file"""
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        return default
+
+# App configuration
+st.set_page_config(
+    page_title="Russian Learning App",
+    page_icon="🏥",
+    layout="wide"
+)
+
+# Shared card cache and per-session memory limits
+CARD_CACHE_MAX_ENTRIES = 40000
+CARD_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SESSION_MEMORY_BUDGET_BYTES = 64 * 1024
+SESSION_IDLE_TIMEOUT_SECONDS = 30 * 60
+SESSION_SWEEP_INTERVAL_SECONDS = 60
+
+# Session state keys that can be dropped and rebuilt lazily when a session
+# goes over its memory budget or sits idle: the progress tracker's counters
+# are recounted from subsection_progress, and a quiz question's options are
+# drawn again for the same word
+SESSION_EVICTABLE_KEYS = ['progress_tracker', 'quiz_question']
+
+def estimate_size(obj, _seen=None):
+    """Roughly estimate the memory footprint of a nested object in bytes"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += estimate_size(vars(obj), _seen)
+    return size
+
+def make_card_key(english_word, section, subsection):
+    """Build the small key a session keeps instead of the full card"""
+    return f"{section}|{subsection}|{english_word}"
+
+def parse_card_key(card_key):
+    """Split a card key back into (english_word, section, subsection)"""
+    section, subsection, english_word = card_key.split('|', 2)
+    return english_word, section, subsection
+
+# Compressed card storage: cards are split into field groups that are
+# compressed separately against a shared dictionary and decoded on demand
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CARD_COMPRESSION_LEVEL = 6
+CARD_DICTIONARY_SIZE = 16 * 1024
+CARD_DICTIONARY_RETRAIN_AT = [200, 1000, 5000]
+CARD_DICTIONARY_SAMPLE_SIZE = 1000
+CARD_FIELD_GROUPS = {
+    'core': ['english_word', 'section', 'subsection', 'russian_word', 'lemma', 'part_of_speech', 'gender',
+             'animacy', 'aspect', 'pronunciation_stress', 'etymology', 'difficulty_level'],
+    'examples': ['formal_sentence', 'formal_sentence_english', 'formal_pos', 'formal_grammar',
+                 'informal_sentence', 'informal_sentence_english', 'informal_pos', 'informal_grammar',
+                 'question', 'question_english', 'question_pos', 'question_grammar',
+                 'answer', 'answer_english', 'answer_pos', 'answer_grammar'],
+    'grammar': ['cases', 'plural_forms', 'verb_conjugation', 'mood', 'perfective_partner', 'imperfective_partner'],
+    'extras': []
+}
+FIELD_GROUP_OF = {field: group for group, fields in CARD_FIELD_GROUPS.items() for field in fields}
+
+def split_card(card):
+    """Split a card into its field groups; unknown fields go to 'extras'"""
+    groups = {group: {} for group in CARD_FIELD_GROUPS}
+    for field, value in card.items():
+        groups[FIELD_GROUP_OF.get(field, 'extras')][field] = value
+    return {group: fields for group, fields in groups.items() if fields}
+
+def train_card_dictionary(cards, size=CARD_DICTIONARY_SIZE):
+    """Build a shared compression dictionary from sample cards"""
+    samples = [json.dumps(fields, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+               for card in cards for fields in split_card(card).values()]
+    if zstandard is not None and len(samples) >= 100:
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            pass
+    
+    # Raw-content dictionary: the most valuable substrings go last, where
+    # both zlib and zstd can reference them most cheaply
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(re.findall(rb'"[^"]{1,48}": ?|"[^"]{2,48}"|[^\s"{}\[\],:]{4,}', sample)))
+    ranked = sorted((token for token, count in counts.items() if count > 1 or len(samples) < 10),
+                    key=lambda token: counts[token] * len(token))
+    dictionary, total = [], 0
+    for token in reversed(ranked):
+        if total + len(token) > size:
+            break
+        dictionary.append(token)
+        total += len(token)
+    return b''.join(reversed(dictionary))
+
+class CardCodec:
+    """Compresses card field groups with zstd when available, else zlib, using a shared dictionary"""
+    
+    def __init__(self, dictionary, level=CARD_COMPRESSION_LEVEL, kind=None):
+        self.dictionary = dictionary
+        self.level = level
+        self.kind = kind or ('zstd' if zstandard is not None else 'zlib')
+        if self.kind == 'zstd' and zstandard is None:
+            raise ValueError("zstd-compressed cards need the zstandard package")
+        if self.kind == 'zstd':
+            zstd_dictionary = zstandard.ZstdCompressionDict(dictionary)
+            self._compressor = zstandard.ZstdCompressor(level=level, dict_data=zstd_dictionary)
+            self._decompressor = zstandard.ZstdDecompressor(dict_data=zstd_dictionary)
+            self._lock = threading.Lock()
+    
+    def compress(self, data):
+        if self.kind == 'zstd':
+            # zstd contexts are not thread-safe
+            with self._lock:
+                return self._compressor.compress(data)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+    
+    def decompress(self, blob):
+        if self.kind == 'zstd':
+            with self._lock:
+                return self._decompressor.decompress(blob)
+        decompressor = zlib.decompressobj(-15, zdict=self.dictionary)
+        return decompressor.decompress(blob) + decompressor.flush()
+    
+    def encode(self, card):
+        """Compress a card into a dict of field group -> bytes"""
+        return {group: self.compress(json.dumps(fields, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+                for group, fields in split_card(card).items()}
+    
+    def decode_group(self, blob):
+        return json.loads(self.decompress(blob))
+
+class CompressedCard(Mapping):
+    """Read-only card view that decompresses a field group the first time one of its fields is read"""
+    
+    def __init__(self, codec, blobs):
+        self._codec = codec
+        self._blobs = blobs
+        self._decoded = {}
+    
+    def _group(self, group):
+        if group not in self._decoded:
+            blob = self._blobs.get(group)
+            self._decoded[group] = self._codec.decode_group(blob) if blob is not None else {}
+        return self._decoded[group]
+    
+    def __getitem__(self, field):
+        return self._group(FIELD_GROUP_OF.get(field, 'extras'))[field]
+    
+    def __iter__(self):
+        for group in self._blobs:
+            yield from self._group(group)
+    
+    def __len__(self):
+        return sum(len(self._group(group)) for group in self._blobs)
+    
+    def to_dict(self):
+        """Decode every group into a plain dict"""
+        return {field: self[field] for field in self}
+
+def default_card_codec():
+    """Codec with a dictionary seeded from fixture cards, used until real cards are available"""
+    seed_words = ['heart', 'to examine', 'acute', 'blood pressure', 'nurse', 'fracture']
+    seed_cards = [make_fixture_card(word, 'Core Subjects', 'Anatomy') for word in seed_words]
+    return CardCodec(train_card_dictionary(seed_cards))
+
+# Warm cache snapshots: an immutable file of compressed cards that a server
+# maps into memory at boot instead of starting cold; see build_snapshot.py.
+# Layout: magic, header length, JSON header, then (8-byte aligned) the index
+# of (key hash, record offset) sorted by hash, the codec dictionary, the
+# records, each a key followed by its compressed field groups, and the terms
+# each derived card index keeps per card, so a server can fill its indexes
+# at boot without decompressing every card
+CARD_SNAPSHOT_PATH = 'cards.snapshot'
+CARD_SNAPSHOT_MAGIC = b'RLCARDS\x00'
+CARD_SNAPSHOT_FORMAT = 1
+SNAPSHOT_INDEX_DTYPE = np.dtype([('hash', '<u8'), ('offset', '<u8')])
+SNAPSHOT_RECORD = struct.Struct('<HB')
+SNAPSHOT_GROUP = struct.Struct('<BI')
+
+def snapshot_key_hash(card_key):
+    """Stable 64-bit hash of a card key, the same in every process"""
+    return int.from_bytes(hashlib.blake2b(card_key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def _snapshot_sections_start(header_length):
+    return (len(CARD_SNAPSHOT_MAGIC) + 4 + header_length + 7) // 8 * 8
+
+def write_card_snapshot(path, cards):
+    """Write (card key, card) pairs to a snapshot file, replacing it in one step, and return its header"""
+    cards = {card_key: dict(card) for card_key, card in cards}
+    codec = CardCodec(train_card_dictionary(list(cards.values())[-CARD_DICTIONARY_SAMPLE_SIZE:]))
+    groups = list(CARD_FIELD_GROUPS)
+    
+    index_terms = io.BytesIO()
+    index_locations = {}
+    for index_type in CARD_INDEX_TYPES:
+        card_index = index_type()
+        terms = {card_key: card_index.card_entry(card) for card_key, card in cards.items()}
+        blob = zlib.compress(json.dumps(terms, ensure_ascii=False, default=sorted).encode('utf-8'))
+        index_locations[card_index.snapshot_name] = [index_terms.tell(), len(blob)]
+        index_terms.write(blob)
+    
+    records = io.BytesIO()
+    index = np.zeros(len(cards), dtype=SNAPSHOT_INDEX_DTYPE)
+    for position, (card_key, card) in enumerate(cards.items()):
+        key = card_key.encode('utf-8')
+        blobs = codec.encode(card)
+        index[position] = (snapshot_key_hash(card_key), records.tell())
+        records.write(SNAPSHOT_RECORD.pack(len(key), len(blobs)) + key)
+        for group, blob in blobs.items():
+            records.write(SNAPSHOT_GROUP.pack(groups.index(group), len(blob)) + blob)
+    index.sort(order='hash')
+    
+    sections = [index.tobytes(), codec.dictionary, records.getvalue(), index_terms.getvalue()]
+    header = json.dumps({
+        'format': CARD_SNAPSHOT_FORMAT,
+        'created_at': time.time(),
+        'cards': len(cards),
+        'codec': codec.kind,
+        'groups': groups,
+        'index_bytes': len(sections[0]),
+        'dictionary_bytes': len(sections[1]),
+        'records_bytes': len(sections[2]),
+        'index_terms_bytes': len(sections[3]),
+        'index_terms': index_locations,
+        'checksum': zlib.crc32(b''.join(sections))
+    }).encode('utf-8')
+    start = _snapshot_sections_start(len(header))
+    
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as f:
+        f.write(CARD_SNAPSHOT_MAGIC + struct.pack('<I', len(header)) + header)
+        f.write(b'\x00' * (start - f.tell()))
+        for section in sections:
+            f.write(section)
+    # A server that has the old file mapped keeps reading it undisturbed
+    os.replace(temporary_path, path)
+    return json.loads(header)
+
+class CardSnapshot:
+    """Read-only card snapshot mapped into memory; cards are located through the index and decoded on demand"""
+    
+    def __init__(self, path, verify=False):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(CARD_SNAPSHOT_MAGIC)] != CARD_SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a card snapshot")
+        header_start = len(CARD_SNAPSHOT_MAGIC) + 4
+        header_length, = struct.unpack_from('<I', self._map, len(CARD_SNAPSHOT_MAGIC))
+        self.header = json.loads(self._map[header_start:header_start + header_length])
+        if self.header.get('format') != CARD_SNAPSHOT_FORMAT:
+            raise ValueError(f"{path} has snapshot format {self.header.get('format')}, expected {CARD_SNAPSHOT_FORMAT}")
+        
+        index_start = _snapshot_sections_start(header_length)
+        dictionary_start = index_start + self.header['index_bytes']
+        self._records_start = dictionary_start + self.header['dictionary_bytes']
+        self._index_terms_start = self._records_start + self.header['records_bytes']
+        if self._index_terms_start + self.header.get('index_terms_bytes', 0) > len(self._map):
+            raise ValueError(f"{path} is truncated")
+        if verify and zlib.crc32(self._map[index_start:]) != self.header['checksum']:
+            raise ValueError(f"{path} is corrupt")
+        
+        self.codec = CardCodec(bytes(self._map[dictionary_start:self._records_start]), kind=self.header['codec'])
+        self._groups = self.header['groups']
+        # A view of the mapped index; nothing is copied or parsed at load
+        self._index = np.frombuffer(self._map, SNAPSHOT_INDEX_DTYPE, self.header['cards'], index_start)
+        self._hashes = self._index['hash']
+    
+    def __len__(self):
+        return self.header['cards']
+    
+    def _read_key(self, offset):
+        position = self._records_start + offset
+        key_length, group_count = SNAPSHOT_RECORD.unpack_from(self._map, position)
+        position += SNAPSHOT_RECORD.size
+        return self._map[position:position + key_length].decode('utf-8'), position + key_length, group_count
+    
+    def _find(self, card_key):
+        """Position after the key of the card's record, and its group count, or None"""
+        key_hash = np.uint64(snapshot_key_hash(card_key))
+        position = int(np.searchsorted(self._hashes, key_hash))
+        while position < len(self._hashes) and self._hashes[position] == key_hash:
+            key, blobs_start, group_count = self._read_key(int(self._index[position]['offset']))
+            if key == card_key:
+                return blobs_start, group_count
+            position += 1
+        return None
+    
+    def __contains__(self, card_key):
+        return self._find(card_key) is not None
+    
+    def get_blobs(self, card_key):
+        """Compressed field groups of a card, or None if the snapshot doesn't have it"""
+        found = self._find(card_key)
+        if found is None:
+            return None
+        position, group_count = found
+        blobs = {}
+        for _ in range(group_count):
+            group, length = SNAPSHOT_GROUP.unpack_from(self._map, position)
+            position += SNAPSHOT_GROUP.size
+            blobs[self._groups[group]] = self._map[position:position + length]
+            position += length
+        return blobs
+    
+    def keys(self):
+        """Every card key, in index order"""
+        for offset in self._index['offset']:
+            yield self._read_key(int(offset))[0]
+    
+    def index_terms(self, name):
+        """{card key: terms} persisted for a derived card index, or None if the snapshot predates it"""
+        location = self.header.get('index_terms', {}).get(name)
+        if location is None:
+            return None
+        start = self._index_terms_start + location[0]
+        return json.loads(zlib.decompress(self._map[start:start + location[1]]))
+    
+    def size(self):
+        return len(self._map)
+
+class CardCache:
+    """Thread-safe LRU of compressed word cards shared by every session, over an optional read-only snapshot"""
+    
+    def __init__(self, max_entries, max_bytes, codec, snapshot=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.codec = codec
+        self.snapshot = snapshot
+        self.snapshot_error = None
+        # Snapshot cards that were invalidated or replaced, and snapshot cards
+        # the LRU currently holds a newer version of
+        self._hidden = set()
+        self._shadowed = set()
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.raw_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._retrain_thresholds = list(CARD_DICTIONARY_RETRAIN_AT)
+        self._listeners = []
+    
+    def add_listener(self, listener):
+        """Call listener(card_key, card) for every stored card now and later; card is None on removal"""
+        with self._lock:
+            self._listeners.append(listener)
+        for card_key, card in self.cards():
+            listener(card_key, card)
+    
+    def add_index(self, card_index):
+        """Keep a derived card index current, filling it from the snapshot's persisted terms where it has them
+        
+        The index computes a card's terms with card_entry(card) and applies
+        them with set_entry(card_key, terms); on_card_change does both.
+        """
+        with self._lock:
+            self._listeners.append(card_index.on_card_change)
+            entries = list(self._entries.items())
+            skipped = self._hidden | self._shadowed
+        for card_key, (codec, blobs) in entries:
+            card_index.on_card_change(card_key, CompressedCard(codec, blobs))
+        if self.snapshot is None:
+            return
+        terms = self.snapshot.index_terms(card_index.snapshot_name) or {}
+        for card_key in self.snapshot.keys():
+            if card_key in skipped:
+                continue
+            if card_key in terms:
+                card_index.set_entry(card_key, terms[card_key])
+            else:
+                card_index.on_card_change(card_key, CompressedCard(self.snapshot.codec, self.snapshot.get_blobs(card_key)))
+    
+    def cards(self):
+        """Every card currently stored, as (card key, lazily decoded card) pairs"""
+        with self._lock:
+            entries = list(self._entries.items())
+            skipped = self._hidden | self._shadowed
+        for card_key, (codec, blobs) in entries:
+            yield card_key, CompressedCard(codec, blobs)
+        if self.snapshot is not None:
+            for card_key in self.snapshot.keys():
+                if card_key not in skipped:
+                    yield card_key, CompressedCard(self.snapshot.codec, self.snapshot.get_blobs(card_key))
+    
+    def _in_snapshot(self, card_key):
+        return self.snapshot is not None and card_key not in self._hidden and card_key in self.snapshot
+    
+    def _notify(self, changes):
+        for card_key, card in changes:
+            for listener in self._listeners:
+                listener(card_key, card)
+    
+    def __contains__(self, card_key):
+        with self._lock:
+            return card_key in self._entries or self._in_snapshot(card_key)
+    
+    def __len__(self):
+        with self._lock:
+            snapshot_cards = len(self.snapshot) - len(self._hidden) - len(self._shadowed) if self.snapshot else 0
+            return len(self._entries) + snapshot_cards
+    
+    def get(self, card_key):
+        """Return a lazily decoded view of the cached card and mark it as recently used, or None"""
+        with self._lock:
+            entry = self._entries.get(card_key)
+            if entry is None:
+                blobs = self.snapshot.get_blobs(card_key) if self.snapshot and card_key not in self._hidden else None
+                if blobs is None:
+                    self.misses += 1
+                    return None
+                entry = (self.snapshot.codec, blobs)
+            else:
+                self._entries.move_to_end(card_key)
+            self.hits += 1
+            codec, blobs = entry
+        return CompressedCard(codec, blobs)
+    
+    def invalidate(self, card_key):
+        """Drop a card from the cache, returning True if it was present"""
+        with self._lock:
+            present = card_key in self._entries or self._in_snapshot(card_key)
+            if card_key in self._entries:
+                del self._entries[card_key]
+                self._remove_size(card_key)
+            self._forget_snapshot_card(card_key)
+        if present:
+            self._notify([(card_key, None)])
+        return present
+    
+    def _forget_snapshot_card(self, card_key):
+        """Keep a snapshot card from showing through once its replacement leaves the LRU"""
+        self._shadowed.discard(card_key)
+        if self.snapshot is not None and card_key in self.snapshot:
+            self._hidden.add(card_key)
+    
+    def put(self, card_key, card, replaces=None):
+        """Compress and store a card, evicting least recently used cards over the limits
+        
+        With `replaces`, a card returned by get(), the card is only stored if
+        that is still the stored version; returns whether it was stored.
+        """
+        codec = self.codec
+        blobs = codec.encode(card)
+        raw_size = len(json.dumps(dict(card), ensure_ascii=False).encode('utf-8'))
+        changes = [(card_key, card)]
+        with self._lock:
+            if replaces is not None and self._stored_blobs(card_key) != replaces._blobs:
+                return False
+            if card_key in self._entries:
+                self._remove_size(card_key)
+            elif self._in_snapshot(card_key) or card_key in self._hidden:
+                self._hidden.discard(card_key)
+                self._shadowed.add(card_key)
+            self._entries[card_key] = (codec, blobs)
+            self._entries.move_to_end(card_key)
+            self._add_size(card_key, blobs, raw_size)
+            
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes
+            ):
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._remove_size(evicted_key)
+                self._forget_snapshot_card(evicted_key)
+                self.evictions += 1
+                changes.append((evicted_key, None))
+            
+            retrain = bool(self._retrain_thresholds) and len(self._entries) >= self._retrain_thresholds[0]
+            if retrain:
+                self._retrain_thresholds.pop(0)
+        
+        self._notify(changes)
+        if retrain:
+            self.retrain()
+        return True
+    
+    def _stored_blobs(self, card_key):
+        entry = self._entries.get(card_key)
+        if entry is not None:
+            return entry[1]
+        return self.snapshot.get_blobs(card_key) if self._in_snapshot(card_key) else None
+    
+    def retrain(self):
+        """Train a new dictionary on cached cards and re-encode every entry with it"""
+        with self._lock:
+            sample_keys = list(self._entries)[-CARD_DICTIONARY_SAMPLE_SIZE:]
+            samples = [CompressedCard(*self._entries[card_key]).to_dict() for card_key in sample_keys]
+        codec = CardCodec(train_card_dictionary(samples))
+        
+        with self._lock:
+            entries = list(self._entries.items())
+        encoded = {
+            card_key: (entry, codec.encode(CompressedCard(*entry).to_dict()))
+            for card_key, entry in entries
+        }
+        
+        # Swap in only entries nobody replaced while they were being re-encoded
+        with self._lock:
+            self.codec = codec
+            for card_key, (entry, new_blobs) in encoded.items():
+                if self._entries.get(card_key) is not entry:
+                    continue
+                raw_size = self._sizes[card_key][1]
+                self._remove_size(card_key)
+                self._entries[card_key] = (codec, new_blobs)
+                self._add_size(card_key, new_blobs, raw_size)
+    
+    def _add_size(self, card_key, blobs, raw_size):
+        size = sum(len(blob) for blob in blobs.values()) + sys.getsizeof(blobs)
+        self._sizes[card_key] = (size, raw_size)
+        self.total_bytes += size
+        self.raw_bytes += raw_size
+    
+    def _remove_size(self, card_key):
+        size, raw_size = self._sizes.pop(card_key)
+        self.total_bytes -= size
+        self.raw_bytes -= raw_size
+    
+    def stats(self):
+        """Return counters for monitoring the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            snapshot_cards = len(self.snapshot) - len(self._hidden) - len(self._shadowed) if self.snapshot else 0
+            return {
+                'entries': len(self._entries) + snapshot_cards,
+                'snapshot_entries': snapshot_cards,
+                'snapshot_bytes': self.snapshot.size() if self.snapshot else 0,
+                'bytes': self.total_bytes,
+                'raw_bytes': self.raw_bytes,
+                'compression_ratio': self.raw_bytes / self.total_bytes if self.total_bytes else 0.0,
+                'codec': self.codec.kind,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class SessionRegistry:
+    """Tracks live sessions so idle or oversized ones can release memory"""
+    
+    def __init__(self, idle_timeout, sweep_interval):
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        # Idle sessions whose evictable state should go on their next rerun
+        self._release_requested = set()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+    
+    def touch(self, session_id, session_state):
+        """Record activity for a session"""
+        with self._lock:
+            self._sessions[session_id] = [time.time(), weakref.ref(session_state)]
+    
+    def take_release_request(self, session_id):
+        """Whether a sweep asked this session to drop its evictable state, clearing the request"""
+        with self._lock:
+            if session_id in self._release_requested:
+                self._release_requested.discard(session_id)
+                return True
+            return False
+    
+    def sweep(self):
+        """Flag idle sessions to drop their evictable state and forget closed ones
+        
+        Another session's state is never changed from this thread, since its
+        script may be running; the session releases its own keys when it reruns.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+            sessions = list(self._sessions.items())
+        
+        for session_id, (last_seen, state_ref) in sessions:
+            session_state = state_ref()
+            with self._lock:
+                if session_state is None:
+                    self._sessions.pop(session_id, None)
+                    self._release_requested.discard(session_id)
+                elif now - last_seen > self.idle_timeout:
+                    self._release_requested.add(session_id)
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+@st.cache_resource
+def get_card_cache():
+    """Shared in-process card cache used by all sessions, over the deployed snapshot if there is one"""
+    cache = CardCache(CARD_CACHE_MAX_ENTRIES, CARD_CACHE_MAX_BYTES, default_card_codec())
+    path = get_snapshot_path()
+    if os.path.exists(path):
+        # A bad snapshot only costs the warm start
+        try:
+            cache.snapshot = CardSnapshot(path)
+        except (OSError, ValueError, KeyError) as e:
+            cache.snapshot_error = str(e)
+    return cache
+
+def get_snapshot_path():
+    return get_secret("CARD_SNAPSHOT_PATH", CARD_SNAPSHOT_PATH)
+
+@st.cache_resource
+def get_snapshot_writer():
+    """One thread for writing snapshots, kept apart from the model scheduler and its quota"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot-writer')
+
+@st.cache_resource
+def get_session_registry():
+    """Shared registry of active sessions"""
+    return SessionRegistry(SESSION_IDLE_TIMEOUT_SECONDS, SESSION_SWEEP_INTERVAL_SECONDS)
+
+def release_session_memory(session_state):
+    """Remove rebuildable keys from a session state, returning bytes freed"""
+    freed = 0
+    for key in SESSION_EVICTABLE_KEYS:
+        if key in session_state:
+            freed += estimate_size(session_state[key])
+            del session_state[key]
+    return freed
+
+def enforce_session_memory():
+    """Register this session, apply its memory budget and evict idle sessions"""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    
+    registry = get_session_registry()
+    registry.touch(ctx.session_id, ctx.session_state)
+    registry.sweep()
+    if registry.take_release_request(ctx.session_id):
+        release_session_memory(ctx.session_state)
+        return
+    
+    # Evicting only helps when it brings the session under budget; otherwise
+    # the rebuildable state would be dropped and rebuilt on every rerun
+    session_bytes = estimate_size(ctx.session_state.filtered_state)
+    if session_bytes > SESSION_MEMORY_BUDGET_BYTES:
+        evictable_bytes = sum(estimate_size(ctx.session_state[key])
+                              for key in SESSION_EVICTABLE_KEYS if key in ctx.session_state)
+        if session_bytes - evictable_bytes <= SESSION_MEMORY_BUDGET_BYTES:
+            release_session_memory(ctx.session_state)
+
+# Generation scheduling: lanes in priority order with their concurrency caps
+LANE_INTERACTIVE = 'interactive'
+LANE_PREFETCH = 'prefetch'
+LANE_WARMUP = 'warmup'
+SCHEDULER_LANE_CAPS = {
+    LANE_INTERACTIVE: 4,
+    LANE_PREFETCH: 2,
+    LANE_WARMUP: 1
+}
+SCHEDULER_WORKERS = 6
+
+# Shared Gemini quota (MODEL_REQUESTS_PER_MINUTE secret on paid tiers); background
+# lanes may only use requests above the reserve
+MODEL_REQUESTS_PER_MINUTE = 15
+INTERACTIVE_RESERVED_REQUESTS = 3
+
+class RateLimiter:
+    """Token bucket shared by every caller of the model"""
+    
+    def __init__(self, requests_per_minute):
+        self.capacity = float(requests_per_minute)
+        self.refill_per_second = requests_per_minute / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+    
+    def available(self):
+        """Return the number of requests that could start right now"""
+        with self._lock:
+            self._refill()
+            return self._tokens
+    
+    def try_acquire(self, reserve=0):
+        """Take a token only if at least `reserve` tokens would remain afterwards"""
+        with self._lock:
+            self._refill()
+            if self._tokens - 1 >= reserve:
+                self._tokens -= 1
+                return True
+            return False
+    
+    def seconds_until(self, reserve=0):
+        """Seconds until try_acquire(reserve) could succeed"""
+        with self._lock:
+            self._refill()
+            return max(0.0, (reserve + 1 - self._tokens) / self.refill_per_second)
+    
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.refill_per_second
+            time.sleep(wait)
+
+# Consecutive model failures before switching to cache-only mode, and how
+# long to wait before letting a probe request through again
+MODEL_FAILURE_THRESHOLD = 3
+MODEL_COOLDOWN_SECONDS = 60
+MODEL_MAX_ATTEMPTS = 3
+MODEL_RETRY_BACKOFF_SECONDS = 1.0
+
+class ModelUnavailableError(Exception):
+    """Raised when a card has to be generated but the model cannot be used"""
+
+class CircuitBreaker:
+    """Stops calling a failing upstream for a cooldown, then lets a single probe through"""
+    
+    def __init__(self, failure_threshold, cooldown_seconds):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.reason = None
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    def _cooled_down(self):
+        return time.monotonic() - self.opened_at >= self.cooldown_seconds
+    
+    def available(self):
+        """Whether a request could be attempted now, either normally or as a probe"""
+        with self._lock:
+            return self.state == 'closed' or (self._cooled_down() and not self._probing)
+    
+    def allow(self):
+        """Claim permission for one request; after the cooldown only one probe is let through"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self._cooled_down() and not self._probing:
+                self._probing = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.reason = None
+            self._probing = False
+    
+    def record_failure(self, reason, trip=False):
+        """Count a failure; `trip` opens the breaker at once, e.g. on quota exhaustion"""
+        with self._lock:
+            self.failures += 1
+            self.reason = reason
+            if trip or self._probing or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+# Per-click traces: clicks slower than TRACE_SLOW_SECONDS (a secret) are kept
+# in a ring buffer for the admin waterfall and, with TRACE_LOG_PATH set, a JSONL file
+DEFAULT_TRACE_SLOW_SECONDS = 3.0
+TRACE_BUFFER_SIZE = 50
+
+class Trace:
+    """Timed spans of one interaction, recorded from whichever threads did the work"""
+    
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.monotonic()
+        self.duration = None
+        self.spans = []
+        self._lock = threading.Lock()
+    
+    def record(self, name, start, end, depth=0, **attrs):
+        """Add a span from monotonic start and end times"""
+        span = {
+            'name': name,
+            'start': start - self.start,
+            'duration': end - start,
+            'depth': depth,
+            'thread': threading.current_thread().name,
+            **attrs
+        }
+        with self._lock:
+            self.spans.append(span)
+    
+    def finish(self):
+        self.duration = time.monotonic() - self.start
+        return self.duration
+    
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start'])
+        return {'name': self.name, 'started_at': self.started_at, 'duration': self.duration,
+                **self.attrs, 'spans': spans}
+
+@st.cache_resource
+def get_trace_context():
+    """Per-thread current trace, shared across reruns so older worker threads see new traces"""
+    return threading.local()
+
+_trace_context = None
+
+def trace_context():
+    """The shared per-thread trace context, looked up on first use rather than at import"""
+    global _trace_context
+    if _trace_context is None:
+        _trace_context = get_trace_context()
+    return _trace_context
+
+def current_trace():
+    """The trace this thread is working for, or None"""
+    return getattr(trace_context(), 'trace', None)
+
+@contextmanager
+def use_trace(trace):
+    """Attribute the spans of this thread to a trace, e.g. on a worker thread"""
+    context = trace_context()
+    previous = getattr(context, 'trace', None)
+    previous_depth = getattr(context, 'depth', 0)
+    context.trace = trace
+    context.depth = 0
+    try:
+        yield trace
+    finally:
+        context.trace = previous
+        context.depth = previous_depth
+
+def record_span(name, start, **attrs):
+    """Add a span that started at a monotonic time and ends now to the current trace"""
+    trace = current_trace()
+    if trace is not None:
+        trace.record(name, start, time.monotonic(), getattr(trace_context(), 'depth', 0), **attrs)
+
+class TraceSpan:
+    """Times a block as a span of the current trace; does nothing outside a trace"""
+    
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.trace = None
+    
+    def __enter__(self):
+        self.trace = current_trace()
+        if self.trace is not None:
+            self.depth = getattr(trace_context(), 'depth', 0)
+            trace_context().depth = self.depth + 1
+            self.start = time.monotonic()
+        # Callers may add attributes to the returned dict while the span runs
+        return self.attrs
+    
+    def __exit__(self, exc_type, exc, traceback):
+        if self.trace is not None:
+            if exc_type is not None:
+                self.attrs['error'] = f"{exc_type.__name__}: {exc}"
+            trace_context().depth = self.depth
+            self.trace.record(self.name, self.start, time.monotonic(), self.depth, **self.attrs)
+        return False
+
+def trace_span(name, **attrs):
+    """Span context manager for the current trace"""
+    return TraceSpan(name, attrs)
+
+class TraceRecorder:
+    """Keeps the slowest recent traces in memory and optionally appends them to a JSONL file"""
+    
+    def __init__(self, slow_seconds, capacity, path=None):
+        self.slow_seconds = slow_seconds
+        self.traces = deque(maxlen=capacity)
+        self.finished = 0
+        self.sampled = 0
+        self._file = open(path, 'a', encoding='utf-8', buffering=1) if path else None
+        self._lock = threading.Lock()
+    
+    def finish(self, trace):
+        """Close a trace, keeping it if it was slow"""
+        duration = trace.finish()
+        with self._lock:
+            self.finished += 1
+            if duration < self.slow_seconds:
+                return False
+            self.sampled += 1
+            record = trace.to_dict()
+            self.traces.append(record)
+            if self._file:
+                self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return True
+    
+    def recent(self):
+        """Kept traces, newest first"""
+        with self._lock:
+            return list(reversed(self.traces))
+
+@st.cache_resource
+def get_trace_recorder():
+    """Shared recorder of slow interaction traces"""
+    slow_seconds = float(get_secret("TRACE_SLOW_SECONDS", DEFAULT_TRACE_SLOW_SECONDS))
+    return TraceRecorder(slow_seconds, TRACE_BUFFER_SIZE, get_secret("TRACE_LOG_PATH"))
+
+class GenerationJob:
+    """A unit of generation work waiting in, or running from, a scheduler lane"""
+    
+    def __init__(self, lane, key, func, args, tag):
+        self.lane = lane
+        self.key = key
+        self.func = func
+        self.args = args
+        # Tags of everyone waiting on the job; it is only cancelled once all of them cancel
+        self.tags = {tag}
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        # Worker-side spans go to the trace of the click that queued the work
+        self.trace = current_trace()
+
+class GenerationScheduler:
+    """Runs all model work on one thread pool with priority lanes and per-lane caps"""
+    
+    def __init__(self, lane_caps, workers, rate_limiter):
+        self.lane_caps = lane_caps
+        self.rate_limiter = rate_limiter
+        self._queues = {lane: deque() for lane in lane_caps}
+        self._running = {lane: 0 for lane in lane_caps}
+        self._inflight = {}
+        self._condition = threading.Condition()
+        self._counters = {lane: {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0,
+                                 'wait_seconds': 0.0, 'max_wait_seconds': 0.0} for lane in lane_caps}
+        self._local = threading.local()
+        for worker_number in range(workers):
+            threading.Thread(target=self._work, name=f"generation-worker-{worker_number}", daemon=True).start()
+    
+    def submit(self, lane, key, func, *args, tag=None):
+        """Queue work, sharing the future of identical work that is already pending"""
+        with self._condition:
+            job = self._inflight.get(key)
+            if job is not None:
+                job.tags.add(tag)
+                # Promote queued background work when someone is now waiting on it
+                if job in self._queues[job.lane] and self._priority(lane) < self._priority(job.lane):
+                    self._queues[job.lane].remove(job)
+                    job.lane = lane
+                    job.trace = job.trace or current_trace()
+                    self._queues[lane].appendleft(job)
+                    self._condition.notify()
+                return job.future
+            
+            job = GenerationJob(lane, key, func, args, tag)
+            self._inflight[key] = job
+            self._queues[lane].append(job)
+            self._counters[lane]['submitted'] += 1
+            self._condition.notify()
+            return job.future
+    
+    def cancel(self, tag, lanes=(LANE_PREFETCH, LANE_WARMUP)):
+        """Withdraw a tag from queued work, dropping jobs nobody else waits on; returns how many were dropped"""
+        cancelled = 0
+        with self._condition:
+            for lane in lanes:
+                queue = self._queues[lane]
+                for job in [job for job in queue if tag in job.tags]:
+                    job.tags.discard(tag)
+                    if job.tags:
+                        continue
+                    queue.remove(job)
+                    self._inflight.pop(job.key, None)
+                    job.future.cancel()
+                    self._counters[lane]['cancelled'] += 1
+                    cancelled += 1
+        return cancelled
+    
+    def metrics(self):
+        """Queue depth, running jobs and counters for each lane"""
+        with self._condition:
+            return {
+                lane: {
+                    'queued': len(self._queues[lane]),
+                    'running': self._running[lane],
+                    **self._counters[lane]
+                }
+                for lane in self.lane_caps
+            }
+    
+    def current_lane(self):
+        """Lane of the job running on the calling worker thread, or None elsewhere"""
+        return getattr(self._local, 'lane', None)
+    
+    def acquire_request(self, lane):
+        """Charge one upstream model call to the rate limiter, returning False if it must not be made
+        
+        The token a job took to start pays for its first call. Interactive work,
+        and calls made outside the scheduler, wait for a token; background lanes
+        only spend quota above what is reserved for students' clicks.
+        """
+        if getattr(self._local, 'prepaid', False):
+            self._local.prepaid = False
+            return True
+        if lane in (None, LANE_INTERACTIVE):
+            with trace_span('quota wait'):
+                self.rate_limiter.acquire()
+            return True
+        return self.rate_limiter.try_acquire(INTERACTIVE_RESERVED_REQUESTS)
+    
+    def _priority(self, lane):
+        return list(self.lane_caps).index(lane)
+    
+    def _next_job(self):
+        """The next runnable job, or None and how long to sleep: None means until notified"""
+        quota_wait = None
+        for lane, cap in self.lane_caps.items():
+            if not self._queues[lane] or self._running[lane] >= cap:
+                continue
+            if lane != LANE_INTERACTIVE and not self.rate_limiter.try_acquire(INTERACTIVE_RESERVED_REQUESTS):
+                # Nothing notifies when quota refills, so wake up when it has
+                quota_wait = self.rate_limiter.seconds_until(INTERACTIVE_RESERVED_REQUESTS)
+                continue
+            return self._queues[lane].popleft(), None
+        return None, quota_wait
+    
+    def _work(self):
+        while True:
+            with self._condition:
+                job, timeout = self._next_job()
+                while job is None:
+                    self._condition.wait(timeout)
+                    job, timeout = self._next_job()
+                lane = job.lane
+                self._running[lane] += 1
+                dequeued = time.monotonic()
+                wait = dequeued - job.submitted_at
+                self._counters[lane]['wait_seconds'] += wait
+                self._counters[lane]['max_wait_seconds'] = max(self._counters[lane]['max_wait_seconds'], wait)
+            
+            with use_trace(job.trace):
+                if job.trace:
+                    job.trace.record('queue wait', job.submitted_at, dequeued, lane=lane)
+                if lane == LANE_INTERACTIVE:
+                    with trace_span('quota wait'):
+                        self.rate_limiter.acquire()
+                
+                if job.future.set_running_or_notify_cancel():
+                    self._local.lane = lane
+                    self._local.prepaid = True
+                    try:
+                        job.future.set_result(job.func(*job.args))
+                        outcome = 'completed'
+                    except Exception as e:
+                        job.future.set_exception(e)
+                        outcome = 'failed'
+                    finally:
+                        self._local.lane = None
+                        self._local.prepaid = False
+                else:
+                    outcome = 'cancelled'
+            
+            with self._condition:
+                self._running[lane] -= 1
+                self._counters[lane][outcome] += 1
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+                self._condition.notify()
+
+@st.cache_resource
+def get_generation_scheduler():
+    """Shared scheduler for all word-card generation work"""
+    requests_per_minute = float(get_secret("MODEL_REQUESTS_PER_MINUTE", MODEL_REQUESTS_PER_MINUTE))
+    return GenerationScheduler(SCHEDULER_LANE_CAPS, SCHEDULER_WORKERS, RateLimiter(requests_per_minute))
+
+def is_cache_only():
+    """True while new cards cannot be generated and only cached cards are served"""
+    return not get_backend_router().can_generate()
+
+# Token accounting; prices are USD per million tokens for gemini-1.5-flash
+MODEL_INPUT_PRICE_PER_MILLION = 0.075
+MODEL_OUTPUT_PRICE_PER_MILLION = 0.30
+USAGE_BUCKET_SECONDS = 3600
+USAGE_WINDOW_BUCKETS = 48
+DEFAULT_DAILY_TOKEN_BUDGET = 2_000_000
+BUDGET_WARNING_SHARE = 0.8
+
+def estimate_tokens(text):
+    """Rough token count for when the response has no usage metadata"""
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    # Cyrillic splits into roughly twice as many tokens per character as English
+    return max(1, round(ascii_chars / 4 + (len(text) - ascii_chars) / 2))
+
+def token_cost(prompt_tokens, output_tokens):
+    """Cost in USD of a number of prompt and output tokens"""
+    return (prompt_tokens * MODEL_INPUT_PRICE_PER_MILLION + output_tokens * MODEL_OUTPUT_PRICE_PER_MILLION) / 1_000_000
+
+class UsageTracker:
+    """Rolling hourly aggregates of model calls and tokens, broken down by subsection and user"""
+    
+    def __init__(self, bucket_seconds, window_buckets):
+        self.bucket_seconds = bucket_seconds
+        self._buckets = deque(maxlen=window_buckets)
+        self._lock = threading.Lock()
+    
+    def _bucket(self, now):
+        start = now - now % self.bucket_seconds
+        if not self._buckets or self._buckets[-1]['start'] != start:
+            self._buckets.append({
+                'start': start, 'calls': 0, 'cards': 0, 'estimated': 0,
+                'prompt_tokens': 0, 'output_tokens': 0,
+                'subsections': Counter(), 'users': Counter()
+            })
+        return self._buckets[-1]
+    
+    def record(self, user, section, subsection, prompt_tokens, output_tokens, estimated=False):
+        """Count one model call"""
+        tokens = prompt_tokens + output_tokens
+        with self._lock:
+            bucket = self._bucket(time.time())
+            bucket['calls'] += 1
+            bucket['estimated'] += int(estimated)
+            bucket['prompt_tokens'] += prompt_tokens
+            bucket['output_tokens'] += output_tokens
+            bucket['subsections'][f"{section} / {subsection}"] += tokens
+            bucket['users'][user or 'background'] += tokens
+    
+    def record_card(self):
+        """Count a card that was produced, for the tokens-per-card trend"""
+        with self._lock:
+            self._bucket(time.time())['cards'] += 1
+    
+    def summary(self, window_seconds=86400):
+        """Totals, breakdowns and the hourly trend over the last `window_seconds`"""
+        since = time.time() - window_seconds
+        totals = {'calls': 0, 'cards': 0, 'estimated': 0, 'prompt_tokens': 0, 'output_tokens': 0}
+        subsections, users, trend = Counter(), Counter(), []
+        with self._lock:
+            for bucket in self._buckets:
+                if bucket['start'] + self.bucket_seconds <= since:
+                    continue
+                for field in totals:
+                    totals[field] += bucket[field]
+                subsections.update(bucket['subsections'])
+                users.update(bucket['users'])
+                bucket_tokens = bucket['prompt_tokens'] + bucket['output_tokens']
+                trend.append((bucket['start'], bucket_tokens / bucket['cards'] if bucket['cards'] else None))
+        
+        totals['tokens'] = totals['prompt_tokens'] + totals['output_tokens']
+        totals['cost'] = token_cost(totals['prompt_tokens'], totals['output_tokens'])
+        totals['tokens_per_card'] = totals['tokens'] / totals['cards'] if totals['cards'] else 0.0
+        return {'totals': totals, 'subsections': subsections, 'users': users, 'trend': trend}
+
+@st.cache_resource
+def get_usage_tracker():
+    """Shared token usage aggregates"""
+    return UsageTracker(USAGE_BUCKET_SECONDS, USAGE_WINDOW_BUCKETS)
+
+def record_model_usage(backend, response, user, section, subsection):
+    """Count a response's tokens against the daily budget if its backend is billed, and return its cost"""
+    if backend.billed:
+        get_usage_tracker().record(user, section, subsection, response.prompt_tokens, response.output_tokens,
+                                   response.estimated)
+    return backend.cost_of(response.prompt_tokens, response.output_tokens)
+
+def get_daily_token_budget():
+    """Daily token budget from the DAILY_TOKEN_BUDGET secret"""
+    return int(get_secret("DAILY_TOKEN_BUDGET", DEFAULT_DAILY_TOKEN_BUDGET))
+
+# Generation backends. MODEL_BACKENDS (a secret) lists the enabled ones:
+# 'gemini', 'local' (a small model on this machine's CPU through llama.cpp,
+# LOCAL_MODEL_PATH pointing at a GGUF file) and 'fixture' (synthetic cards, for
+# demos and load tests only). Each prompt section goes to the best healthy
+# backend allowed to produce it.
+DEFAULT_MODEL_BACKENDS = 'gemini'
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+# A small local model only writes sentences, translations and phrases
+DEFAULT_LOCAL_MODEL_SECTIONS = 'examples,negation,collocations'
+LOCAL_MODEL_CONTEXT_TOKENS = 4096
+LOCAL_MODEL_MAX_OUTPUT_TOKENS = 1536
+# Routing score: expected seconds plus expected cost, a US cent weighing as much
+# as ROUTING_SECONDS_PER_CENT seconds; background lanes barely count latency
+ROUTING_SECONDS_PER_CENT = 60
+BACKGROUND_LATENCY_WEIGHT = 0.05
+ROUTING_SMOOTHING = 0.2
+TYPICAL_REQUEST_TOKENS = (1200, 900)
 
-# Configure Gemini API
 try:
-    GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-1.5-flash')
-except KeyError:
-    st.error("⚠️ Gemini API key not found! Please add GEMINI_API_KEY to your secrets.")
-    st.stop()
-except Exception as e:
-    st.error(f"⚠️ Error configuring Gemini API: {str(e)}")
-    st.stop()
+    import llama_cpp
+except ImportError:
+    llama_cpp = None
+
+class BackendResponse:
+    """A backend's answer and its token counts, estimated when the backend doesn't report them"""
+    
+    def __init__(self, text, prompt_tokens=None, output_tokens=None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.estimated = False
+
+class ModelBackend(abc.ABC):
+    """Answers card prompts; subclasses implement _generate and set their prices and typical latency"""
+    name = None
+    remote = False
+    input_price_per_million = 0.0
+    output_price_per_million = 0.0
+    typical_seconds = 1.0
+    
+    def __init__(self, sections=None):
+        # Prompt sections this backend may produce, or None for all of them
+        self.sections = sections
+        self.breaker = CircuitBreaker(MODEL_FAILURE_THRESHOLD, MODEL_COOLDOWN_SECONDS)
+        self.requests = 0
+        self.latency = self.typical_seconds
+        self.cost = self.cost_of(*TYPICAL_REQUEST_TOKENS)
+        self._stats_lock = threading.Lock()
+    
+    @property
+    def billed(self):
+        return bool(self.input_price_per_million or self.output_price_per_million)
+    
+    def can_produce(self, section_names):
+        return self.sections is None or set(section_names) <= self.sections
+    
+    def cost_of(self, prompt_tokens, output_tokens):
+        return (prompt_tokens * self.input_price_per_million + output_tokens * self.output_price_per_million) / 1_000_000
+    
+    def score(self, latency_weight):
+        """Lower is better: expected seconds, weighted, plus expected cost in seconds"""
+        return latency_weight * self.latency + self.cost * 100 * ROUTING_SECONDS_PER_CENT
+    
+    def generate(self, prompt):
+        """Answer a prompt through the backend's circuit breaker, updating its latency and cost"""
+        if not self.breaker.allow():
+            raise ModelUnavailableError(self.breaker.reason or f"{self.name} is unavailable")
+        started = time.monotonic()
+        try:
+            response = self._generate(prompt)
+        except Exception as e:
+            self.breaker.record_failure(str(e), trip=is_quota_error(e))
+            raise
+        self.breaker.record_success()
+        
+        if not response.prompt_tokens:
+            response.prompt_tokens = estimate_tokens(prompt)
+            response.output_tokens = estimate_tokens(response.text or '')
+            response.estimated = True
+        response.output_tokens = response.output_tokens or 0
+        with self._stats_lock:
+            self.requests += 1
+            self.latency += ROUTING_SMOOTHING * (time.monotonic() - started - self.latency)
+            self.cost += ROUTING_SMOOTHING * (self.cost_of(response.prompt_tokens, response.output_tokens) - self.cost)
+        return response
+    
+    @abc.abstractmethod
+    def _generate(self, prompt):
+        """Send a prompt to the model and return its BackendResponse"""
+
+class GeminiBackend(ModelBackend):
+    """Google Gemini, configured on the first request rather than at import"""
+    name = 'gemini'
+    remote = True
+    input_price_per_million = MODEL_INPUT_PRICE_PER_MILLION
+    output_price_per_million = MODEL_OUTPUT_PRICE_PER_MILLION
+    typical_seconds = 2.0
+    
+    def __init__(self, api_key, model_name):
+        super().__init__()
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+        self._model_lock = threading.Lock()
+    
+    def _generate(self, prompt):
+        with self._model_lock:
+            if self._model is None:
+                genai.configure(api_key=self.api_key)
+                self._model = genai.GenerativeModel(self.model_name)
+        response = self._model.generate_content(prompt)
+        usage = getattr(response, 'usage_metadata', None)
+        return BackendResponse(response.text, getattr(usage, 'prompt_token_count', None),
+                               getattr(usage, 'candidates_token_count', None))
+
+class LocalBackend(ModelBackend):
+    """A small instruction-tuned model run on this machine's CPU with llama.cpp, loaded on first use"""
+    name = 'local'
+    typical_seconds = 20.0
+    
+    def __init__(self, model_path, sections, threads=None):
+        super().__init__(sections)
+        self.model_path = model_path
+        self.threads = threads
+        self._llama = None
+        self._model_lock = threading.Lock()
+    
+    def _generate(self, prompt):
+        # One inference at a time; parallel ones would only compete for the same cores
+        with self._model_lock:
+            if self._llama is None:
+                self._llama = llama_cpp.Llama(model_path=self.model_path, n_ctx=LOCAL_MODEL_CONTEXT_TOKENS,
+                                              n_threads=self.threads, verbose=False)
+            result = self._llama.create_chat_completion(
+                messages=[{'role': 'user', 'content': prompt}],
+                max_tokens=LOCAL_MODEL_MAX_OUTPUT_TOKENS,
+                temperature=0.2,
+                response_format={'type': 'json_object'}
+            )
+        usage = result.get('usage') or {}
+        return BackendResponse(result['choices'][0]['message']['content'], usage.get('prompt_tokens'),
+                               usage.get('completion_tokens'))
+
+class FixtureBackend(ModelBackend):
+    """Answers every prompt with deterministic fixture cards, without any model"""
+    name = 'fixture'
+    typical_seconds = 0.01
+    
+    def _generate(self, prompt):
+        words = re.findall(r'English word: "([^"]*)"', prompt) or ['word']
+        # Only the fields a model would answer with, not the card's identity
+        cards = [{field: value for field, value in make_fixture_card(word, '', '').items()
+                  if field not in ('english_word', 'section', 'subsection')} for word in words]
+        if re.search(r'^\s*\d+\. English word', prompt, re.M):
+            return BackendResponse(json.dumps({str(number): card for number, card in enumerate(cards, 1)}, ensure_ascii=False))
+        return BackendResponse(json.dumps(cards[0], ensure_ascii=False))
+
+class BackendRouter:
+    """Picks a backend for each prompt section by health, expected latency and cost"""
+    
+    def __init__(self, backends, config_error=None):
+        self.backends = backends
+        self.config_error = config_error
+        self.routed = Counter()
+    
+    def candidates(self, section_names, lane=None):
+        """Healthy backends that may produce all of the sections, best first"""
+        latency_weight = 1.0 if lane in (None, LANE_INTERACTIVE) else BACKGROUND_LATENCY_WEIGHT
+        usable = [backend for backend in self.backends
+                  if backend.can_produce(section_names) and backend.breaker.available()]
+        return sorted(usable, key=lambda backend: backend.score(latency_weight))
+    
+    def plan(self, section_names, lane=None):
+        """[(backend, section names)] covering the sections, the group with the headword first"""
+        groups = {}
+        for name in section_names:
+            candidates = self.candidates([name], lane)
+            if not candidates:
+                raise ModelUnavailableError(self.unavailable_reason())
+            groups.setdefault(candidates[0], []).append(name)
+            self.routed[(candidates[0].name, name)] += 1
+        # The other sections are written for the headword the first group produces
+        return sorted(groups.items(), key=lambda group: 'headword' not in group[1])
+    
+    def can_generate(self):
+        return all(self.candidates([section.name]) for section in active_prompt_sections())
+    
+    def unavailable_reason(self):
+        reasons = [backend.breaker.reason for backend in self.backends if not backend.breaker.available()]
+        return next((reason for reason in reasons if reason), None) or self.config_error or "No generation backend is available"
+
+@st.cache_resource
+def get_backend_router():
+    """Shared generation backends, built from the MODEL_BACKENDS secret"""
+    backends, errors = [], []
+    names = [name.strip() for name in str(get_secret("MODEL_BACKENDS", DEFAULT_MODEL_BACKENDS)).split(',') if name.strip()]
+    for name in names:
+        if name == 'gemini':
+            api_key = get_secret("GEMINI_API_KEY")
+            if api_key:
+                backends.append(GeminiBackend(api_key, GEMINI_MODEL_NAME))
+            else:
+                errors.append("Gemini API key not found! Please add GEMINI_API_KEY to your secrets.")
+        elif name == 'local':
+            path = get_secret("LOCAL_MODEL_PATH")
+            if llama_cpp is None:
+                errors.append("The local backend needs the llama-cpp-python package")
+            elif not path or not os.path.exists(path):
+                errors.append("LOCAL_MODEL_PATH does not point to a model file")
+            else:
+                sections = get_secret("LOCAL_MODEL_SECTIONS", DEFAULT_LOCAL_MODEL_SECTIONS)
+                threads = get_secret("LOCAL_MODEL_THREADS")
+                backends.append(LocalBackend(path, {name.strip() for name in sections.split(',')},
+                                             int(threads) if threads else None))
+        elif name == 'fixture':
+            backends.append(FixtureBackend())
+        else:
+            errors.append(f"Unknown model backend '{name}'")
+    return BackendRouter(backends, '; '.join(errors) or None)
+
+# Hedged model requests, enabled with the HEDGE_REQUESTS secret: when a request
+# someone is waiting on hasn't answered by a high percentile of recent
+# latencies, an identical one is raced against it if the quota has headroom
+HEDGE_PERCENTILE = 0.9
+HEDGE_MIN_SAMPLES = 20
+HEDGE_LATENCY_WINDOW = 200
+HEDGE_MIN_DELAY_SECONDS = 0.5
+
+class HedgeStats:
+    """Recent model latencies, the hedge delay derived from them and what hedging won and cost"""
+    
+    def __init__(self, window, percentile, min_samples):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.eligible = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.no_headroom = 0
+        self.extra_cost = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+    
+    def delay(self):
+        """Seconds to wait before hedging, or None until enough latencies have been seen"""
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return max(HEDGE_MIN_DELAY_SECONDS, ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))])
+    
+    def record(self, outcome):
+        """Count an eligible request: 'fast', 'no_headroom', 'primary' or 'hedge' (the winner)"""
+        with self._lock:
+            self.eligible += 1
+            if outcome == 'no_headroom':
+                self.no_headroom += 1
+            elif outcome in ('primary', 'hedge'):
+                self.hedged += 1
+                self.hedge_wins += outcome == 'hedge'
+    
+    def add_extra_cost(self, cost):
+        with self._lock:
+            self.extra_cost += cost
+    
+    def summary(self):
+        with self._lock:
+            return {
+                'eligible': self.eligible,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'win_rate': self.hedge_wins / self.hedged if self.hedged else 0.0,
+                'no_headroom': self.no_headroom,
+                'extra_cost': self.extra_cost,
+                'samples': len(self.latencies)
+            }
+
+@st.cache_resource
+def get_hedge_stats():
+    """Shared latency window and hedging counters"""
+    return HedgeStats(HEDGE_LATENCY_WINDOW, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+
+@st.cache_resource
+def get_model_request_pool():
+    """Threads that run raced model requests, two per interactive job"""
+    return ThreadPoolExecutor(max_workers=2 * SCHEDULER_LANE_CAPS[LANE_INTERACTIVE], thread_name_prefix='model-request')
+
+def is_hedging_enabled():
+    return str(get_secret("HEDGE_REQUESTS", "false")).lower() in ('1', 'true', 'yes')
+
+def request_card_content(backend, prompt, required_keys, english_word, section, subsection, user, attempt, racer=None):
+    """One model request, returning (parsed card or the ValueError parsing raised, cost in USD)"""
+    started = time.monotonic()
+    with trace_span('model call', attempt=attempt, backend=backend.name, **({'racer': racer} if racer else {})):
+        response = backend.generate(prompt)
+    if backend.remote:
+        get_hedge_stats().observe(time.monotonic() - started)
+    cost = record_model_usage(backend, response, user, section, subsection)
+    response_text = response.text
+    recorder = get_response_recorder()
+    if recorder:
+        recorder.record(english_word, section, subsection, response_text)
+    
+    # Malformed output is returned rather than raised so it isn't counted against the upstream
+    try:
+        return parse_card_response(response_text, required_keys), cost
+    except ValueError as e:
+        return e, cost
+
+def hedged_card_request(backend, prompt, required_keys, english_word, section, subsection, user, attempt):
+    """Race a second identical request against a slow first one and return the first valid card"""
+    stats = get_hedge_stats()
+    pool = get_model_request_pool()
+    trace = current_trace()
+    
+    def race(racer):
+        with use_trace(trace):
+            return request_card_content(backend, prompt, required_keys, english_word, section, subsection, user,
+                                        attempt, racer)
+    
+    primary = pool.submit(race, 'primary')
+    delay = stats.delay()
+    if delay is None or wait([primary], timeout=delay).done:
+        stats.record('fast')
+        return primary.result()
+    # Hedges only spend quota above what is reserved for other students' clicks
+    if not get_generation_scheduler().rate_limiter.try_acquire(INTERACTIVE_RESERVED_REQUESTS):
+        stats.record('no_headroom')
+        return primary.result()
+    
+    hedge = pool.submit(race, 'hedge')
+    record_span('hedge sent', time.monotonic(), after_seconds=round(delay, 2))
+    racers = {primary: 'primary', hedge: 'hedge'}
+    pending = set(racers)
+    winner = None
+    fallback = None
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                content, _ = future.result()
+            except Exception as e:
+                fallback = fallback or e
+                continue
+            if isinstance(content, dict) and winner is None:
+                winner = future
+            elif not isinstance(fallback, ValueError):
+                # A malformed answer still means the upstream responded
+                fallback = content
+    
+    # The request that didn't win is what hedging cost extra, whenever it finishes
+    loser = hedge if winner in (None, primary) else primary
+    loser.add_done_callback(lambda f: None if f.exception() else stats.add_extra_cost(f.result()[1]))
+    if winner is None:
+        stats.record('primary')
+        if isinstance(fallback, ValueError):
+            return fallback, 0.0
+        raise fallback
+    stats.record(racers[winner])
+    return winner.result()
+
+def get_session_id():
+    """Return the id of the current browser session, if running under Streamlit"""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def generate_word_card(english_word, section, subsection, user=None):
+    """Generate a card with the model and store it in the shared cache"""
+    russian_content = get_enhanced_russian_content(english_word, section, subsection, user=user)
+    get_usage_tracker().record_card()
+    card = {
+        'english_word': english_word,
+        'section': section,
+        'subsection': subsection,
+        **russian_content
+    }
+    get_card_cache().put(make_card_key(english_word, section, subsection), card)
+    return card
+
+def schedule_word_card(english_word, section, subsection, lane, tag=None, user=None):
+    """Queue generation of a card unless it is already cached, returning a future or None
+
+    `tag` groups jobs for cancellation; `user` is who the model usage is billed
+    to, None for shared background work.
+    """
+    card_key = make_card_key(english_word, section, subsection)
+    if card_key in get_card_cache():
+        return None
+    if is_cache_only():
+        if lane == LANE_INTERACTIVE:
+            raise ModelUnavailableError(get_backend_router().unavailable_reason())
+        # Background work would only pile up behind a dead upstream
+        return None
+    return get_generation_scheduler().submit(lane, card_key, generate_word_card, english_word, section, subsection, user, tag=tag)
+
+def get_word_card(english_word, section, subsection):
+    """Return the card for a word from the shared cache, generating it on a miss"""
+    with trace_span('cache lookup') as span:
+        card = get_card_cache().get(make_card_key(english_word, section, subsection))
+        span['hit'] = card is not None
+    if card is None:
+        with trace_span('generation'):
+            future = schedule_word_card(english_word, section, subsection, LANE_INTERACTIVE,
+                                        tag=get_session_id(), user=get_session_id())
+            card = future.result() if future else get_card_cache().get(make_card_key(english_word, section, subsection))
+    return card
+
+# Optional access log of Get Next Word requests, one tab-separated line each,
+# enabled by setting ACCESS_LOG_PATH in the secrets; see simulate_cache.py
+ACCESS_LOG_FIELDS = ['timestamp', 'cohort', 'section', 'subsection', 'word', 'hit', 'latency_ms']
+
+class AccessLog:
+    """Appends card requests to a compact TSV file"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+    
+    def record(self, cohort, section, subsection, word, hit, latency_seconds):
+        line = f"{time.time():.3f}\t{cohort}\t{section}\t{subsection}\t{word}\t{int(hit)}\t{latency_seconds * 1000:.0f}\n"
+        with self._lock:
+            self._file.write(line)
+
+def parse_access_log_line(line):
+    """Turn one access log line back into a dict of ACCESS_LOG_FIELDS"""
+    timestamp, cohort, section, subsection, word, hit, latency_ms = line.rstrip('\n').split('\t')
+    return {
+        'timestamp': float(timestamp),
+        'cohort': cohort,
+        'section': section,
+        'subsection': subsection,
+        'word': word,
+        'hit': hit == '1',
+        'latency_ms': int(latency_ms)
+    }
+
+@st.cache_resource
+def get_access_log():
+    """Shared access log, or None when logging is disabled"""
+    path = get_secret("ACCESS_LOG_PATH")
+    return AccessLog(path) if path else None
+
+def log_card_access(english_word, section, subsection, hit, started):
+    """Record one Get Next Word request if the access log is enabled"""
+    access_log = get_access_log()
+    if access_log is None:
+        return
+    order, cohort = get_word_order()
+    access_log.record(cohort if order != 'random' else '', section, subsection, english_word, hit,
+                      time.monotonic() - started)
+
+def prefetch_next_word(section, subsection):
+    """Pick this session's next word now and generate its card in the background"""
+    next_word = get_random_word_from_subsection(section, subsection)
+    if next_word is None:
+        st.session_state.prefetched_word_key = None
+        return
+    st.session_state.prefetched_word_key = make_card_key(next_word, section, subsection)
+    schedule_word_card(next_word, section, subsection, LANE_PREFETCH, tag=get_session_id(), user=get_session_id())
+
+def take_prefetched_word(section, subsection):
+    """Return the prefetched word for this subsection if it is still unused"""
+    card_key = st.session_state.get('prefetched_word_key')
+    st.session_state.prefetched_word_key = None
+    if not card_key:
+        return None
+    
+    word, word_section, word_subsection = parse_card_key(card_key)
+    used_words = st.session_state.subsection_progress.get(f"{section}_{subsection}", set())
+    if (word_section, word_subsection) != (section, subsection) or word in used_words:
+        return None
+    if is_cache_only() and card_key not in get_card_cache():
+        return None
+    if word not in get_sections_from_json().get(section, {}).get(subsection, []):
+        return None
+    return word
+
+def cancel_stale_prefetch():
+    """Cancel background work for a subsection the user has navigated away from"""
+    card_key = st.session_state.get('prefetched_word_key')
+    if not card_key:
+        return
+    
+    _, section, subsection = parse_card_key(card_key)
+    if (section, subsection) != (st.session_state.get('selected_section'), st.session_state.get('selected_subsection')):
+        get_generation_scheduler().cancel(get_session_id())
+        st.session_state.prefetched_word_key = None
+
+def warm_up_subsection(section, subsection, count):
+    """Queue low-priority generation for the first uncached words of a subsection, in this session's word order"""
+    sections = get_sections_from_json()
+    if subsection not in sections.get(section, {}):
+        return 0
+    order, cohort = get_word_order()
+    if order == 'random':
+        words = sections[section][subsection]
+    else:
+        words = get_vocabulary_index().ordered_words(section, subsection, order, cohort)
+    
+    queued = 0
+    for word in words:
+        if queued >= count:
+            break
+        if schedule_word_card(word, section, subsection, LANE_WARMUP, tag='warmup'):
+            queued += 1
+    return queued
+
+def load_current_card():
+    """Resolve the session's current card key through the shared cache"""
+    card_key = st.session_state.get('current_word_key')
+    if not card_key:
+        return None
+    
+    card = get_card_cache().get(card_key)
+    if card is None:
+        # The card was evicted from the shared cache, so rebuild it
+        try:
+            with st.spinner("Loading..."):
+                card = get_word_card(*parse_card_key(card_key))
+        except ModelUnavailableError:
+            st.warning("📴 This card is no longer saved and can't be regenerated right now.")
+            return None
+    return card
+
+# Card fields whose Cyrillic words are indexed for Russian -> English lookup;
+# example sentences are left out so common words don't match every card
+RUSSIAN_FORM_FIELDS = ['russian_word', 'lemma', 'pronunciation_stress', 'cases', 'plural_forms',
+                       'verb_conjugation', 'mood', 'perfective_partner', 'imperfective_partner']
+RUSSIAN_RELATED_FIELDS = ['prefixes_suffixes']
+CYRILLIC_WORD = re.compile(r"[а-я]+(?:-[а-я]+)*")
+
+def normalize_russian(text):
+    """Lowercase Russian text with stress marks removed and ё folded into е"""
+    return strip_stress(text.lower()).replace('ё', 'е')
+
+def russian_tokens(value):
+    """Every normalized Cyrillic word in a card field, however deeply nested"""
+    if isinstance(value, str):
+        return set(CYRILLIC_WORD.findall(normalize_russian(value)))
+    if isinstance(value, Mapping):
+        value = list(value.values())
+    if isinstance(value, list):
+        return set().union(*(russian_tokens(item) for item in value)) if value else set()
+    return set()
+
+class RussianIndex:
+    """Maps normalized Russian word forms to the cached cards they appear in"""
+    # Names the terms persisted in snapshots; bump the number when card_entry changes
+    snapshot_name = 'russian/1'
+    
+    def __init__(self):
+        self.forms = {}
+        self.related = {}
+        self._card_forms = {}
+        self._lock = threading.Lock()
+    
+    def on_card_change(self, card_key, card):
+        """CardCache listener: reindex a stored card, or drop one that was removed"""
+        self.set_entry(card_key, None if card is None else self.card_entry(card))
+    
+    def card_entry(self, card):
+        """(forms, related words) of a card"""
+        forms, related = set(), set()
+        for field in RUSSIAN_FORM_FIELDS:
+            if field in card:
+                forms |= russian_tokens(card[field])
+        for field in RUSSIAN_RELATED_FIELDS:
+            if field in card:
+                related |= russian_tokens(card[field])
+        return forms, related - forms
+    
+    def set_entry(self, card_key, entry):
+        """Index a card's terms, or drop the card when entry is None"""
+        forms, related = (set(entry[0]), set(entry[1])) if entry is not None else (set(), set())
+        with self._lock:
+            old_forms, old_related = self._card_forms.pop(card_key, (set(), set()))
+            for postings, old, new in ((self.forms, old_forms, forms), (self.related, old_related, related)):
+                for token in old - new:
+                    keys = postings.get(token)
+                    if keys is not None:
+                        keys.discard(card_key)
+                        if not keys:
+                            del postings[token]
+                for token in new - old:
+                    postings.setdefault(token, set()).add(card_key)
+            if entry is not None:
+                self._card_forms[card_key] = (forms, related)
+    
+    def search(self, query, limit=20):
+        """Cards containing every Russian word of the query, as (card key, 'form' or 'related') pairs"""
+        tokens = CYRILLIC_WORD.findall(normalize_russian(query))
+        if not tokens:
+            return []
+        
+        results = []
+        with self._lock:
+            for kind, postings in (('form', self.forms), ('related', self.related)):
+                matches = None
+                for token in tokens:
+                    keys = postings.get(token, set()) | (self.forms.get(token, set()) if kind == 'related' else set())
+                    matches = keys if matches is None else matches & keys
+                    if not matches:
+                        break
+                seen = {card_key for card_key, _ in results}
+                results.extend((card_key, kind) for card_key in sorted(matches or ()) if card_key not in seen)
+        return results[:limit]
+    
+    def __len__(self):
+        with self._lock:
+            return len(self.forms)
+
+@st.cache_resource
+def get_russian_index():
+    """Reverse index over the shared card cache, kept current through a cache listener"""
+    index = RussianIndex()
+    get_card_cache().add_index(index)
+    return index
+
+# Word graph over cached cards. Edge kinds from strongest to weakest; a
+# card's neighbours are ranked by these weights for display and prefetch
+WORD_GRAPH_EDGE_WEIGHTS = {'aspect': 4, 'related': 3, 'collocation': 2, 'root': 1}
+WORD_GRAPH_MENTION_FIELDS = {
+    'aspect': ['perfective_partner', 'imperfective_partner'],
+    'collocation': ['common_collocations']
+}
+# Collocations inflect the words they mention, so they match case forms
+WORD_GRAPH_FORM_FIELDS = ['cases', 'plural_forms']
+WORD_GRAPH_ROOT_LETTERS = 4
+WORD_GRAPH_NEIGHBOURS = 6
+WORD_GRAPH_PREFETCH = 2
+# "сердечный (cardiac)" pairs in related_words, whose English side may name a vocabulary word
+RELATED_WORD_TRANSLATION = re.compile(r"[а-яё́-]+\s*\(([^()]*)\)", re.I)
+
+def word_roots(headword):
+    """Rough shared-root keys of a single Russian word: its first letters, with and without a verbal prefix"""
+    word = headword[:-2] if headword.endswith(('ся', 'сь')) else headword
+    if len(word) < WORD_GRAPH_ROOT_LETTERS:
+        return set()
+    roots = {word[:WORD_GRAPH_ROOT_LETTERS]}
+    for prefix in VERB_PREFIXES:
+        # Single-letter prefixes would split too many plain stems (с|ердце)
+        if len(prefix) > 1 and word.startswith(prefix) and len(word) - len(prefix) > WORD_GRAPH_ROOT_LETTERS:
+            roots.add(word[len(prefix):len(prefix) + WORD_GRAPH_ROOT_LETTERS])
+            break
+    return roots
+
+def related_word_translations(value):
+    """Normalized English translations given in parentheses after related words"""
+    if isinstance(value, list):
+        value = ', '.join(item for item in value if isinstance(item, str))
+    if not isinstance(value, str):
+        return set()
+    translations = set()
+    for english in RELATED_WORD_TRANSLATION.findall(value):
+        for candidate in re.split(r"[,;/]| or ", english):
+            candidate = normalize_vocabulary_word(candidate).lower()
+            if candidate:
+                translations.add(candidate)
+    return translations
+
+class WordGraph:
+    """Links cached cards through aspect pairs, related words, collocations and shared roots"""
+    snapshot_name = 'word-graph/1'
+    
+    def __init__(self):
+        self.headwords = {}
+        self.forms = {}
+        self.roots = {}
+        self.mentions = {kind: {} for kind in ('aspect', 'related', 'collocation')}
+        self.labels = {}
+        self._cards = {}
+        self._lock = threading.Lock()
+    
+    def on_card_change(self, card_key, card):
+        """CardCache listener: relink a stored card, or drop one that was removed"""
+        self.set_entry(card_key, None if card is None else self.card_entry(card))
+    
+    def card_entry(self, card):
+        """(headwords, forms, roots, mentions by kind, related word translations, label) of a card"""
+        headwords = set()
+        for field in ('lemma', 'russian_word'):
+            if isinstance(card.get(field), str):
+                headword = ' '.join(CYRILLIC_WORD.findall(normalize_russian(card[field])))
+                if headword:
+                    headwords.add(headword)
+        roots = set().union(*(word_roots(headword) for headword in headwords if ' ' not in headword))
+        forms = set(headwords)
+        for field in WORD_GRAPH_FORM_FIELDS:
+            if field in card:
+                forms |= russian_tokens(card[field])
+        
+        related_field = card.get('prefixes_suffixes')
+        related_field = related_field.get('related_words') if isinstance(related_field, Mapping) else None
+        mentions = {kind: set().union(*(russian_tokens(card.get(field)) for field in fields)) - headwords
+                    for kind, fields in WORD_GRAPH_MENTION_FIELDS.items()}
+        mentions['related'] = russian_tokens(related_field) - headwords
+        label = strip_stress(card['russian_word']) if isinstance(card.get('russian_word'), str) else None
+        return headwords, forms, roots, mentions, related_word_translations(related_field), label
+    
+    def set_entry(self, card_key, entry):
+        """Link a card through its terms, or drop the card when entry is None"""
+        label = None
+        if entry is not None:
+            headwords, forms, roots, mentions, translations, label = entry
+            entry = (set(headwords), set(forms), set(roots),
+                     {kind: set(tokens) for kind, tokens in mentions.items()}, set(translations))
+        
+        with self._lock:
+            old = self._cards.pop(card_key, None)
+            old_headwords, old_forms, old_roots, old_mentions, _ = old or (set(), set(), set(), {}, set())
+            headwords, forms, roots, mentions, _ = entry or (set(), set(), set(), {}, set())
+            updates = [(self.headwords, old_headwords, headwords), (self.forms, old_forms, forms),
+                       (self.roots, old_roots, roots)]
+            updates += [(postings, old_mentions.get(kind, set()), mentions.get(kind, set()))
+                        for kind, postings in self.mentions.items()]
+            for postings, old_tokens, new_tokens in updates:
+                for token in old_tokens - new_tokens:
+                    keys = postings.get(token)
+                    if keys is not None:
+                        keys.discard(card_key)
+                        if not keys:
+                            del postings[token]
+                for token in new_tokens - old_tokens:
+                    postings.setdefault(token, set()).add(card_key)
+            self.labels.pop(card_key, None)
+            if entry is not None:
+                self._cards[card_key] = entry
+                if label is not None:
+                    self.labels[card_key] = label
+    
+    def label(self, card_key):
+        """The Russian word of a linked card, or None"""
+        with self._lock:
+            return self.labels.get(card_key)
+    
+    def neighbours(self, card_key, vocabulary=None, limit=WORD_GRAPH_NEIGHBOURS):
+        """Strongest links of a card as (card key, kind) pairs, nearest subsections first
+        
+        Related words whose English translation is a vocabulary word link to
+        that word's card even when it is not cached yet.
+        """
+        kinds = {}
+        _, section, subsection = parse_card_key(card_key)
+        
+        def nearness(key):
+            _, key_section, key_subsection = parse_card_key(key)
+            return key_section != section, key_subsection != subsection, key
+        
+        def link(keys, kind):
+            for key in keys:
+                if key != card_key and WORD_GRAPH_EDGE_WEIGHTS[kind] > WORD_GRAPH_EDGE_WEIGHTS.get(kinds.get(key), 0):
+                    kinds[key] = kind
+        
+        with self._lock:
+            entry = self._cards.get(card_key)
+            if entry is None:
+                return []
+            headwords, forms, roots, mentions, translations = entry
+            for root in roots:
+                link(self.roots.get(root, ()), 'root')
+            for kind, tokens in mentions.items():
+                targets = self.forms if kind == 'collocation' else self.headwords
+                for token in tokens:
+                    link(targets.get(token, ()), kind)
+                # Links are symmetric: cards that mention this one
+                for token in (forms if kind == 'collocation' else headwords):
+                    link(self.mentions[kind].get(token, ()), kind)
+            
+            if vocabulary is not None:
+                for english_word in translations:
+                    candidates = [make_card_key(english_word, *location) for location in vocabulary.locations(english_word)]
+                    # A saved card of the word beats a nearer subsection that would need generating
+                    candidates.sort(key=lambda key: (key not in self._cards,) + nearness(key))
+                    link(candidates[:1], 'related')
+        
+        ranked = sorted(kinds, key=lambda key: (-WORD_GRAPH_EDGE_WEIGHTS[kinds[key]],) + nearness(key))
+        return [(key, kinds[key]) for key in ranked[:limit]]
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._cards)
+
+@st.cache_resource
+def get_word_graph():
+    """Word graph over the shared card cache, kept current through a cache listener"""
+    graph = WordGraph()
+    get_card_cache().add_index(graph)
+    return graph
+
+def prefetch_word_neighbours(card_key):
+    """Generate the strongest uncached neighbours of a card in the background"""
+    queued = 0
+    for neighbour_key, _ in get_word_graph().neighbours(card_key, get_vocabulary_index()):
+        if queued >= WORD_GRAPH_PREFETCH:
+            break
+        if schedule_word_card(*parse_card_key(neighbour_key), LANE_PREFETCH, tag=get_session_id(), user=get_session_id()):
+            queued += 1
+    return queued
+
+def display_word_neighbours(card_key):
+    """Buttons for a card's related words; saved ones open straight from the cache"""
+    cache = get_card_cache()
+    graph = get_word_graph()
+    neighbours = graph.neighbours(card_key, get_vocabulary_index())
+    if is_cache_only():
+        neighbours = [(key, kind) for key, kind in neighbours if key in cache]
+    if not neighbours:
+        return
+    
+    # Prefetch once per card, not on every rerun of the page
+    if st.session_state.get('neighbours_prefetched_key') != card_key:
+        st.session_state.neighbours_prefetched_key = card_key
+        prefetch_word_neighbours(card_key)
+    
+    st.markdown("---")
+    st.markdown("### 🔗 Related Words")
+    labels = {'aspect': "aspect pair", 'related': "related word", 'collocation': "used together", 'root': "same root"}
+    cols = st.columns(len(neighbours))
+    for col, (neighbour_key, kind) in zip(cols, neighbours):
+        word, section, subsection = parse_card_key(neighbour_key)
+        russian_word = graph.label(neighbour_key)
+        label = f"{russian_word} ({word})" if russian_word else word
+        if neighbour_key not in cache:
+            label += " ⏳"
+        with col:
+            if st.button(label, key=f"neighbour_{neighbour_key}", help=labels[kind], use_container_width=True):
+                open_word_card(neighbour_key)
+                st.rerun()
+
+# Concordance over the example sentences of cached cards: (slot, sentence,
+# translation, grammar) fields, plus negation and case examples
+EXAMPLE_SENTENCE_FIELDS = [
+    ('formal', 'formal_sentence', 'formal_sentence_english', 'formal_grammar'),
+    ('informal', 'informal_sentence', 'informal_sentence_english', 'informal_grammar'),
+    ('question', 'question', 'question_english', 'question_grammar'),
+    ('answer', 'answer', 'answer_english', 'answer_grammar')
+]
+# English grammar terms recognised in *_grammar fields and in queries, with their synonyms
+GRAMMAR_TAG_SYNONYMS = {
+    'nominative': 'nominative', 'genitive': 'genitive', 'dative': 'dative', 'accusative': 'accusative',
+    'instrumental': 'instrumental', 'prepositional': 'prepositional', 'locative': 'prepositional',
+    'singular': 'singular', 'plural': 'plural', 'present': 'present', 'past': 'past', 'future': 'future',
+    'perfective': 'perfective', 'imperfective': 'imperfective', 'imperative': 'imperative',
+    'conditional': 'conditional', 'infinitive': 'infinitive',
+    'formal': 'formal', 'informal': 'informal', 'question': 'question', 'questions': 'question',
+    'answer': 'answer', 'answers': 'answer', 'negation': 'negation', 'negative': 'negation'
+}
+# A case table entry counts as an example sentence from this many Russian words
+CASE_EXAMPLE_MIN_WORDS = 3
+# Cards read to verify candidates before a concordance search gives up
+CONCORDANCE_MAX_CARDS = 200
+
+def grammar_tags(text):
+    """Normalized grammar terms named in an English description like 'genitive plural'"""
+    if not isinstance(text, str):
+        return set()
+    return {GRAMMAR_TAG_SYNONYMS[word] for word in tokenize_english(text) if word in GRAMMAR_TAG_SYNONYMS}
+
+def case_example(value):
+    """Split a 'form - sentence (translation)' case entry into sentence and translation, or None"""
+    if not isinstance(value, str):
+        return None
+    translation = re.search(r"\(([^()]*[a-z][^()]*)\)\s*$", value, re.I)
+    sentence = value[:translation.start()] if translation else value
+    sentence = re.split(r"\s[-–—:]\s", sentence, maxsplit=1)[-1].strip()
+    # Bare forms and locally built tables ('dative давлениям, ...') are not sentences
+    if LATIN_LETTER.search(sentence) or len(CYRILLIC_WORD.findall(normalize_russian(sentence))) < CASE_EXAMPLE_MIN_WORDS:
+        return None
+    return sentence, translation.group(1).strip() if translation else ''
+
+def card_sentences(card):
+    """Example sentences of a card as (slot, Russian, English, grammar tags) tuples"""
+    sentences = []
+    for slot, field, english_field, grammar_field in EXAMPLE_SENTENCE_FIELDS:
+        if isinstance(card.get(field), str) and card[field].strip():
+            sentences.append((slot, card[field], card.get(english_field, ''), {slot} | grammar_tags(card.get(grammar_field))))
+    
+    negation = card.get('negation')
+    if isinstance(negation, Mapping) and isinstance(negation.get('negative_example'), str) and negation['negative_example'].strip():
+        sentences.append(('negation', negation['negative_example'], negation.get('negative_example_english', ''),
+                          {'negation'} | grammar_tags(negation.get('negative_form'))))
+    
+    for field in ('cases', 'plural_forms'):
+        table = card.get(field)
+        if not isinstance(table, Mapping):
+            continue
+        for form_name, value in table.items():
+            example = case_example(value)
+            if example:
+                # 'genitive_plural' -> genitive, plural; singular case names get 'singular'
+                tags = grammar_tags(form_name.replace('_', ' ')) | ({'plural'} if field == 'plural_forms' else {'singular'})
+                sentences.append((form_name, *example, tags))
+    return sentences
+
+def tag_terms(tags):
+    """Posting terms for a set of grammar tags: each tag, and each pair so 'genitive plural' needs one sentence with both"""
+    tags = sorted(tags)
+    return set(tags) | {f"{first}+{second}" for number, first in enumerate(tags) for second in tags[number + 1:]}
+
+class ConcordanceIndex:
+    """Maps normalized Russian tokens and grammar tags to the cached cards whose example sentences contain them
+    
+    Postings are per card to keep memory close to the Russian index; search
+    re-reads the candidate cards to pick out the matching sentences.
+    """
+    
+    snapshot_name = 'concordance/1'
+    
+    def __init__(self):
+        self.tokens = {}
+        self.tags = {}
+        self.sentences = 0
+        self._card_terms = {}
+        self._lock = threading.Lock()
+    
+    def on_card_change(self, card_key, card):
+        """CardCache listener: reindex a stored card's sentences, or drop one that was removed"""
+        self.set_entry(card_key, None if card is None else self.card_entry(card))
+    
+    def card_entry(self, card):
+        """(tokens, tag terms, sentence count) of a card's example sentences"""
+        tokens, tags, count = set(), set(), 0
+        for _, russian, _, sentence_tags in card_sentences(card):
+            tokens |= russian_tokens(russian)
+            tags |= tag_terms(sentence_tags)
+            count += 1
+        return tokens, tags, count
+    
+    def set_entry(self, card_key, entry):
+        """Index a card's sentence terms, or drop the card when entry is None"""
+        tokens, tags, count = (set(entry[0]), set(entry[1]), entry[2]) if entry is not None else (set(), set(), 0)
+        with self._lock:
+            old_tokens, old_tags, old_count = self._card_terms.pop(card_key, (set(), set(), 0))
+            for postings, old, new in ((self.tokens, old_tokens, tokens), (self.tags, old_tags, tags)):
+                for term in old - new:
+                    keys = postings.get(term)
+                    if keys is not None:
+                        keys.discard(card_key)
+                        if not keys:
+                            del postings[term]
+                for term in new - old:
+                    postings.setdefault(term, set()).add(card_key)
+            self.sentences += count - old_count
+            if entry is not None:
+                self._card_terms[card_key] = (tokens, tags, count)
+    
+    def candidates(self, tokens=(), tags=(), any_tokens=()):
+        """Card keys with every token and tag, and at least one of any_tokens when given"""
+        with self._lock:
+            matches = None
+            for postings, terms in ((self.tokens, tokens), (self.tags, tag_terms(tags))):
+                for term in terms:
+                    keys = postings.get(term, set())
+                    matches = set(keys) if matches is None else matches & keys
+                    if not matches:
+                        return set()
+            if any_tokens:
+                keys = set().union(*(self.tokens.get(token, set()) for token in any_tokens))
+                matches = keys if matches is None else matches & keys
+        return matches or set()
+    
+    def __len__(self):
+        with self._lock:
+            return self.sentences
+
+@st.cache_resource
+def get_concordance():
+    """Example sentence index over the shared card cache, kept current through a cache listener"""
+    concordance = ConcordanceIndex()
+    get_card_cache().add_index(concordance)
+    return concordance
+
+# Derived card indexes whose per-card terms are persisted in snapshots
+CARD_INDEX_TYPES = [RussianIndex, WordGraph, ConcordanceIndex]
+
+def parse_concordance_query(query):
+    """Russian tokens and grammar tags of a query like 'more genitive plural examples' or 'сердце'"""
+    tokens = set(CYRILLIC_WORD.findall(normalize_russian(query)))
+    return tokens, grammar_tags(query)
+
+def find_example_sentences(tokens=(), tags=(), any_tokens=(), near=None, exclude=None, limit=20):
+    """Cached example sentences matching a query, as dicts with the card key, slot, text, translation and tags
+    
+    Cards from the `near` (section, subsection) come first, then the rest of
+    its section, then everything else.
+    """
+    tokens, tags, any_tokens = set(tokens), set(tags), set(any_tokens)
+    if not (tokens or tags or any_tokens):
+        return []
+    
+    # Card keys start with 'section|subsection|', so prefixes order them by nearness
+    section_prefix = f"{near[0]}|" if near else ''
+    subsection_prefix = f"{near[0]}|{near[1]}|" if near else ''
+    
+    def nearness(card_key):
+        return not card_key.startswith(subsection_prefix), not card_key.startswith(section_prefix), card_key
+    
+    cache = get_card_cache()
+    results = []
+    candidates = get_concordance().candidates(tokens, tags, any_tokens) - {exclude}
+    for card_key in heapq.nsmallest(CONCORDANCE_MAX_CARDS, candidates, key=nearness):
+        card = cache.get(card_key)
+        if card is None:
+            continue
+        for slot, russian, english, sentence_tags in card_sentences(card):
+            sentence_tokens = russian_tokens(russian)
+            if tokens <= sentence_tokens and tags <= sentence_tags and (not any_tokens or any_tokens & sentence_tokens):
+                results.append({'card_key': card_key, 'slot': slot, 'russian': russian, 'english': english,
+                                'tags': sorted(sentence_tags - {slot})})
+                if len(results) >= limit:
+                    return results
+    return results
+
+def display_example_search(card_key, card):
+    """Expander to search the example sentences of every saved card, without calling the model"""
+    _, section, subsection = parse_card_key(card_key)
+    with st.expander(f"🔍 More Example Sentences ({len(get_concordance()):,} saved)", expanded=False):
+        query_col, word_col = st.columns([3, 1])
+        with query_col:
+            query = st.text_input("Search sentences", placeholder="e.g. genitive plural, negation, сердце",
+                                  key=f"example_query_{card_key}")
+        with word_col:
+            st.markdown("")
+            using_word = st.button("Using this word", key=f"example_word_{card_key}", use_container_width=True)
+        
+        if using_word:
+            # Any inflected form of the word, from the same fields the Russian index uses
+            forms = set().union(*(russian_tokens(card[field]) for field in RUSSIAN_FORM_FIELDS if field in card))
+            results = find_example_sentences(any_tokens=forms, near=(section, subsection), exclude=card_key)
+        elif query:
+            tokens, tags = parse_concordance_query(query)
+            if not (tokens or tags):
+                st.caption("Type Russian words or grammar terms such as genitive, plural, past or negation.")
+                return
+            results = find_example_sentences(tokens, tags, near=(section, subsection), exclude=card_key)
+        else:
+            return
+        
+        if not results:
+            st.caption("No saved example sentence matches yet.")
+        for result in results:
+            word, result_section, result_subsection = parse_card_key(result['card_key'])
+            st.markdown(f"**{result['russian']}**")
+            if result['english']:
+                st.markdown(result['english'])
+            details = f" · {', '.join(result['tags'])}" if result['tags'] else ""
+            st.caption(f"{result['slot']} example for '{word}' — {result_section} › {result_subsection}{details}")
+
+# Hand-edited source vocabulary and the validated artifact compile_vocabulary.py
+# builds from it; the app serves the artifact while the source checksum it
+# records matches db.json, and compiles db.json in memory otherwise
+VOCABULARY_SOURCE_PATH = 'db.json'
+VOCABULARY_PATH = 'vocabulary.json'
+VOCABULARY_ARTIFACT_FORMAT = 1
+
+# Subsections sharing at least this share of their words are reported as copies
+NEAR_DUPLICATE_SIMILARITY = 0.9
+
+# Words a student needs to learn to complete a subsection
+SUBSECTION_WORD_GOAL = 3
+
+# 'random' gives each student any unused word. 'cohort' walks a permutation
+# seeded by the cohort name and 'curriculum' goes from the simplest terms up,
+# so students in one class request mostly the same cards and hit a warm cache
+WORD_ORDERS = ('random', 'cohort', 'curriculum')
+DEFAULT_WORD_ORDER = 'random'
+
+def normalize_vocabulary_word(word):
+    """Canonical display form of a word: NFC, single spaces, no surrounding whitespace"""
+    return ' '.join(unicodedata.normalize('NFC', word).split())
+
+def vocabulary_word_identity(word):
+    """Key under which two spellings of a word count as duplicates"""
+    return normalize_vocabulary_word(word).casefold().replace('\u2019', "'")
+
+def vocabulary_checksum(raw):
+    """SHA-256 of a raw vocabulary file, recorded in the artifact compiled from it"""
+    return hashlib.sha256(raw).hexdigest()
+
+def compile_vocabulary(source, source_checksum):
+    """Normalize and deduplicate a raw vocabulary file, returning (artifact, issues)
+
+    Issues are (level, message) pairs; any 'error' makes the artifact unfit to serve.
+    """
+    issues = []
+    database = {}
+    display_names = set()
+    entry_count = 0
+    for section_key, section_data in source.get('vocabulary_database', {}).items():
+        section_name = section_data.get('name')
+        if not section_name:
+            section_name = section_key.replace('_', ' ').title()
+            issues.append(('warning', f"section {section_key} has no name, using '{section_name}'"))
+        if not section_data.get('description'):
+            issues.append(('warning', f"section '{section_name}' has no description"))
+        if section_name in display_names:
+            issues.append(('error', f"section name '{section_name}' is used twice"))
+        display_names.add(section_name)
+        
+        # A subsection holding further subsections instead of words was nested by mistake
+        pending = list(section_data.get('subsections', {}).items())
+        subsections = {}
+        while pending:
+            subsection_key, subsection_data = pending.pop(0)
+            nested = [(key, value) for key, value in subsection_data.items() if isinstance(value, dict)]
+            if nested and not subsection_data.get('words'):
+                issues.append(('warning', f"{section_key}.{subsection_key} holds subsections "
+                                          f"{', '.join(key for key, _ in nested)}; moved up a level"))
+                pending[:0] = nested
+                continue
+            
+            subsection_name = subsection_data.get('name')
+            if not subsection_name:
+                subsection_name = subsection_key.replace('_', ' ').title()
+                issues.append(('warning', f"subsection {section_key}.{subsection_key} has no name, using '{subsection_name}'"))
+            if not subsection_data.get('description'):
+                issues.append(('warning', f"subsection '{section_name} / {subsection_name}' has no description"))
+            if subsection_key in subsections or any(entry['name'] == subsection_name for entry in subsections.values()):
+                issues.append(('error', f"subsection '{section_name} / {subsection_name}' is defined twice"))
+            
+            raw_words = subsection_data.get('words', [])
+            entry_count += len(raw_words)
+            words = []
+            seen = set()
+            for word in raw_words:
+                if not isinstance(word, str) or not normalize_vocabulary_word(word):
+                    issues.append(('error', f"'{section_name} / {subsection_name}' has an invalid word {word!r}"))
+                    continue
+                identity = vocabulary_word_identity(word)
+                if identity not in seen:
+                    seen.add(identity)
+                    words.append(normalize_vocabulary_word(word))
+            if len(words) < len(raw_words):
+                issues.append(('info', f"'{section_name} / {subsection_name}': {len(raw_words)} entries, "
+                                       f"{len(words)} unique"))
+            if not words:
+                issues.append(('warning', f"subsection '{section_name} / {subsection_name}' has no words; dropped"))
+                continue
+            
+            subsections[subsection_key] = {
+                'name': subsection_name,
+                'description': subsection_data.get('description', ''),
+                'words': words
+            }
+        
+        database[section_key] = {
+            'name': section_name,
+            'description': section_data.get('description', ''),
+            'subsections': subsections
+        }
+    
+    identities = [
+        (f"{section['name']} / {subsection['name']}", {vocabulary_word_identity(word) for word in subsection['words']})
+        for section in database.values() for subsection in section['subsections'].values()
+    ]
+    for position, (name, words) in enumerate(identities):
+        for other_name, other_words in identities[position + 1:]:
+            similarity = len(words & other_words) / len(words | other_words)
+            if similarity >= NEAR_DUPLICATE_SIMILARITY:
+                issues.append(('warning', f"'{name}' and '{other_name}' share {similarity:.0%} of their words "
+                                          f"({len(words)} and {len(other_words)} unique)"))
+    
+    if not identities:
+        issues.append(('error', "the vocabulary has no words"))
+    
+    artifact = {
+        'format': VOCABULARY_ARTIFACT_FORMAT,
+        'source_checksum': source_checksum,
+        'source_entry_count': entry_count,
+        'subsection_count': len(identities),
+        'word_count': sum(len(words) for _, words in identities),
+        'vocabulary_database': database
+    }
+    return artifact, issues
+
+def validate_vocabulary_artifact(artifact):
+    """Raise ValueError unless the artifact is a compiled vocabulary this version can serve"""
+    if artifact.get('format') != VOCABULARY_ARTIFACT_FORMAT:
+        raise ValueError(f"vocabulary artifact format {artifact.get('format')!r} is not {VOCABULARY_ARTIFACT_FORMAT}; "
+                         f"run compile_vocabulary.py")
+    subsection_count = 0
+    word_count = 0
+    for section_key, section_data in artifact['vocabulary_database'].items():
+        for subsection_key, subsection_data in section_data['subsections'].items():
+            words = subsection_data['words']
+            if not words or len({vocabulary_word_identity(word) for word in words}) != len(words):
+                raise ValueError(f"vocabulary artifact subsection {section_key}.{subsection_key} is empty or has duplicates")
+            subsection_count += 1
+            word_count += len(words)
+    if (subsection_count, word_count) != (artifact['subsection_count'], artifact['word_count']):
+        raise ValueError("vocabulary artifact counts do not match its contents")
+
+# (path, mtime, size) -> value computed from the file, so reruns don't rehash unchanged files
+_file_summaries = {}
+
+def file_summary(path, summarize):
+    """Return summarize(raw bytes) for a file, recomputed only when its mtime or size changes"""
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _file_summaries.get(path)
+    if cached is None or cached[0] != stamp:
+        with open(path, 'rb') as file:
+            cached = (stamp, summarize(file.read()))
+        _file_summaries[path] = cached
+    return cached[1]
+
+def vocabulary_path():
+    """The compiled artifact, or the source file when the artifact is missing or was compiled from other contents"""
+    try:
+        recorded = file_summary(VOCABULARY_PATH, lambda raw: json.loads(raw).get('source_checksum'))
+    except (OSError, ValueError):
+        return VOCABULARY_SOURCE_PATH
+    try:
+        current = file_summary(VOCABULARY_SOURCE_PATH, vocabulary_checksum)
+    except FileNotFoundError:
+        return VOCABULARY_PATH
+    return VOCABULARY_PATH if recorded == current else VOCABULARY_SOURCE_PATH
+
+def tokenize_english(text):
+    """Split English text into lowercase search tokens"""
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+class VocabularyIndex:
+    """In-memory index over the vocabulary, updated subsection by subsection on change
+    
+    A reload updates the word and search dicts in place under the lock, so the
+    readers of those dicts take the lock too.
+    """
+    
+    def __init__(self):
+        self.database = None
+        self.sections = {}
+        self.word_ids = {}
+        self.words = []
+        self.word_locations = {}
+        self.search_index = {}
+        self.word_counts = {}
+        self.section_goals = {}
+        self.overall_goal = 0
+        self.descriptions = {}
+        self._orders = {}
+        self.mtime = None
+        self.version = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def refresh(self, path):
+        """Reload the file if it changed on disk, returning the applied changes or None
+
+        A raw source file is compiled in memory, so the app never serves duplicates.
+        """
+        mtime = (path, os.stat(path).st_mtime_ns)
+        if mtime == self.mtime:
+            return None
+        
+        with self._lock:
+            if mtime == self.mtime:
+                return None
+            with open(path, 'rb') as file:
+                raw = file.read()
+            data = json.loads(raw)
+            if 'format' not in data:
+                data, issues = compile_vocabulary(data, vocabulary_checksum(raw))
+                errors = [message for level, message in issues if level == 'error']
+                if errors:
+                    raise ValueError(f"{path}: {errors[0]}")
+            validate_vocabulary_artifact(data)
+            changes = self.apply(data['vocabulary_database'])
+            self.mtime = mtime
+            return changes
+    
+    def apply(self, database):
+        """Diff a freshly loaded database against the index and apply only the changes; called holding the lock"""
+        entries = {}
+        for section_key, section_data in database.items():
+            section_name = section_data.get('name', section_key.replace('_', ' ').title())
+            for subsection_key, subsection_data in section_data.get('subsections', {}).items():
+                subsection_name = subsection_data.get('name', subsection_key.replace('_', ' ').title())
+                words = subsection_data.get('words', [])
+                entries[(section_key, subsection_key)] = (section_name, subsection_name, tuple(words))
+        
+        changes = {
+            'added_subsections': [],
+            'removed_subsections': [],
+            'changed_subsections': [],
+            'added_words': [],
+            'removed_words': []
+        }
+        
+        for entry_key, old_entry in self._entries.items():
+            new_entry = entries.get(entry_key)
+            if new_entry == old_entry:
+                continue
+            
+            section_name, subsection_name, old_words = old_entry
+            if new_entry is None or new_entry[:2] != old_entry[:2]:
+                # Subsection removed or renamed: everything under the old name goes
+                changes['removed_subsections'].append((section_name, subsection_name))
+                removed = set(old_words)
+            else:
+                changes['changed_subsections'].append((section_name, subsection_name))
+                removed = set(old_words) - set(new_entry[2])
+            
+            for word in removed:
+                self._remove_location(word, section_name, subsection_name)
+                changes['removed_words'].append((word, section_name, subsection_name))
+        
+        for entry_key, new_entry in entries.items():
+            old_entry = self._entries.get(entry_key)
+            if new_entry == old_entry:
+                continue
+            
+            section_name, subsection_name, new_words = new_entry
+            if old_entry is None or new_entry[:2] != old_entry[:2]:
+                changes['added_subsections'].append((section_name, subsection_name))
+                added = set(new_words)
+            else:
+                added = set(new_words) - set(old_entry[2])
+            
+            for word in added:
+                self._add_location(word, section_name, subsection_name)
+                changes['added_words'].append((word, section_name, subsection_name))
+        
+        # Rebuild the lightweight section -> subsection -> words view in file order
+        sections = {}
+        for section_key, section_data in database.items():
+            section_name = section_data.get('name', section_key.replace('_', ' ').title())
+            sections[section_name] = {}
+            for subsection_key in section_data.get('subsections', {}):
+                _, subsection_name, words = entries[(section_key, subsection_key)]
+                sections[section_name][subsection_name] = list(words)
+        
+        self._entries = entries
+        self.sections = sections
+        self.word_counts = {
+            (section_name, subsection_name): len(words)
+            for section_name, subsections in sections.items()
+            for subsection_name, words in subsections.items()
+        }
+        self.section_goals = {
+            section_name: sum(min(len(words), SUBSECTION_WORD_GOAL) for words in subsections.values())
+            for section_name, subsections in sections.items()
+        }
+        self.overall_goal = sum(self.section_goals.values())
+        self.descriptions = {}
+        for section_data in database.values():
+            self.descriptions[section_data['name']] = section_data.get('description', '')
+            for subsection_data in section_data.get('subsections', {}).values():
+                self.descriptions[(section_data['name'], subsection_data['name'])] = subsection_data.get('description', '')
+        # Only the word orders of subsections that changed are recomputed
+        touched = set(changes['removed_subsections'] + changes['changed_subsections'] + changes['added_subsections'])
+        self._orders = {order_key: words for order_key, words in self._orders.items() if order_key[:2] not in touched}
+        self.database = database
+        self.version += 1
+        return changes
+    
+    def subsection_goal(self, section_name, subsection_name):
+        """Number of words needed to complete a subsection"""
+        return min(self.word_counts.get((section_name, subsection_name), 0), SUBSECTION_WORD_GOAL)
+    
+    def ordered_words(self, section_name, subsection_name, order, seed):
+        """A subsection's words in a deterministic order shared by everyone with the same seed"""
+        order_key = (section_name, subsection_name, order, seed)
+        with self._lock:
+            words = self._orders.get(order_key)
+            if words is None:
+                words = list(self.sections.get(section_name, {}).get(subsection_name, []))
+                random.Random(f"{seed}|{section_name}|{subsection_name}").shuffle(words)
+                if order == 'curriculum':
+                    # Single-word, shorter terms first; ties keep the seeded order
+                    words.sort(key=lambda word: (len(tokenize_english(word)), len(word)))
+                self._orders[order_key] = words
+        return words
+    
+    def _add_location(self, word, section_name, subsection_name):
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            # IDs are never reused, so anything keyed by ID stays valid
+            word_id = len(self.words)
+            self.word_ids[word] = word_id
+            self.words.append(word)
+        
+        locations = self.word_locations.setdefault(word_id, set())
+        if not locations:
+            for token in tokenize_english(word):
+                self.search_index.setdefault(token, set()).add(word_id)
+        locations.add((section_name, subsection_name))
+    
+    def _remove_location(self, word, section_name, subsection_name):
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            return
+        
+        locations = self.word_locations.get(word_id, set())
+        locations.discard((section_name, subsection_name))
+        if not locations:
+            self.word_locations.pop(word_id, None)
+            for token in tokenize_english(word):
+                token_ids = self.search_index.get(token)
+                if token_ids is not None:
+                    token_ids.discard(word_id)
+                    if not token_ids:
+                        del self.search_index[token]
+    
+    def locations(self, word):
+        """Sorted (section, subsection) pairs a word appears in, empty if it is not in the vocabulary"""
+        with self._lock:
+            word_id = self.word_ids.get(normalize_vocabulary_word(word))
+            return sorted(self.word_locations.get(word_id, ())) if word_id is not None else []
+    
+    def search(self, query, limit=20):
+        """Find English words whose tokens start with every token of the query"""
+        query_tokens = tokenize_english(query)
+        if not query_tokens:
+            return []
+        
+        with self._lock:
+            matches = None
+            for query_token in query_tokens:
+                token_matches = set()
+                for token, word_ids in self.search_index.items():
+                    if token.startswith(query_token):
+                        token_matches |= word_ids
+                matches = token_matches if matches is None else matches & token_matches
+                if not matches:
+                    return []
+            
+            results = []
+            for word_id in sorted(matches, key=lambda word_id: (len(self.words[word_id]), self.words[word_id])):
+                results.append((self.words[word_id], sorted(self.word_locations.get(word_id, ()))))
+                if len(results) >= limit:
+                    break
+        return results
 
-# App configuration
-st.set_page_config(
-    page_title="Russian Learning App",
-    page_icon="🏥",
-    layout="wide"
-)
+@st.cache_resource
+def get_vocabulary_index():
+    """Shared vocabulary index, loaded once per process and refreshed on change"""
+    return VocabularyIndex()
+
+def apply_vocabulary_changes(changes):
+    """Invalidate cached cards for words that left the vocabulary
+
+    Each session drops the same words from its own progress when its tracker
+    sees the new index version on its next rerun.
+    """
+    cache = get_card_cache()
+    for word, section_name, subsection_name in changes['removed_words']:
+        cache.invalidate(make_card_key(word, section_name, subsection_name))
 
 def load_vocabulary_database():
-    """Load vocabulary database from JSON file"""
+    """Load vocabulary database from JSON file, reindexing only what changed"""
+    index = get_vocabulary_index()
     try:
-        # Read the JSON file uploaded by user
-        with open('db.json', 'r', encoding='utf-8') as file:
-            data = json.load(file)
-        return data['vocabulary_database']
+        changes = index.refresh(vocabulary_path())
+        if changes:
+            apply_vocabulary_changes(changes)
     except Exception as e:
-        st.error(f"Error loading database: {str(e)}")
-        return None
+        if index.database is None:
+            st.error(f"Error loading database: {str(e)}")
+            return None
+        # Keep serving the last good index while the file is mid-edit
+        st.warning(f"Vocabulary reload skipped: {str(e)}")
+    return index.database
 
 def get_sections_from_json():
     """Extract sections and subsections from JSON database"""
-    db = load_vocabulary_database()
-    if not db:
+    if not load_vocabulary_database():
         return {}
-    
-    sections = {}
-    for section_key, section_data in db.items():
-        section_name = section_data.get('name', section_key.replace('_', ' ').title())
-        sections[section_name] = {}
-        
-        if 'subsections' in section_data:
-            for subsection_key, subsection_data in section_data['subsections'].items():
-                subsection_name = subsection_data.get('name', subsection_key.replace('_', ' ').title())
-                sections[section_name][subsection_name] = subsection_data.get('words', [])
-    
-    return sections
+    return get_vocabulary_index().sections
 
 def initialize_progress_from_json():
     """Initialize session state progress tracking based on JSON structure"""
@@ -62,82 +2700,261 @@ def initialize_progress_from_json():
             key = f"{section}_{subsection}"
             if key not in st.session_state.subsection_progress:
                 st.session_state.subsection_progress[key] = set()
+    
+    # Catch up with vocabulary changes before anything reads the progress sets
+    get_progress_tracker()
+
+class ProgressTracker:
+    """A session's learned words with learned counts per subsection, per section and overall, updated in O(1)"""
+    
+    def __init__(self, words):
+        self.words = words
+        self.learned = {}
+        self.section_learned = {}
+        self.overall_learned = 0
+        self.index_version = None
+    
+    def _credit(self, index, section, subsection, delta):
+        # Section and overall totals only count words up to each subsection's goal
+        goal = index.subsection_goal(section, subsection)
+        before = self.learned.get((section, subsection), 0)
+        after = before + delta
+        self.learned[(section, subsection)] = after
+        credited = min(after, goal) - min(before, goal)
+        self.section_learned[section] = self.section_learned.get(section, 0) + credited
+        self.overall_learned += credited
+    
+    def add(self, index, section, subsection, word):
+        """Record a learned word"""
+        words = self.words.setdefault(f"{section}_{subsection}", set())
+        if word not in words:
+            words.add(word)
+            self._credit(index, section, subsection, 1)
+    
+    def reset(self, index, section, subsection):
+        """Forget every learned word in a subsection"""
+        words = self.words.get(f"{section}_{subsection}")
+        if words:
+            self._credit(index, section, subsection, -len(words))
+        self.words[f"{section}_{subsection}"] = set()
+    
+    def rebuild(self, index):
+        """Recount everything from the word sets, used when the vocabulary has changed
+        
+        Words and subsections that left the vocabulary are dropped first. This
+        runs in the session's own rerun, so no other thread edits its progress.
+        """
+        self.learned = {}
+        self.section_learned = {}
+        self.overall_learned = 0
+        progress_keys = set()
+        for section, subsections in index.sections.items():
+            for subsection, subsection_words in subsections.items():
+                progress_key = f"{section}_{subsection}"
+                progress_keys.add(progress_key)
+                words = self.words.get(progress_key)
+                if words:
+                    words.intersection_update(subsection_words)
+                    self._credit(index, section, subsection, len(words))
+        for progress_key in set(self.words) - progress_keys:
+            del self.words[progress_key]
+        self.index_version = index.version
+
+def get_progress_tracker():
+    """This session's progress tracker, recounted if the vocabulary changed since its last use"""
+    if 'subsection_progress' not in st.session_state:
+        st.session_state.subsection_progress = {}
+    tracker = st.session_state.get('progress_tracker')
+    if tracker is None or tracker.words is not st.session_state.subsection_progress:
+        tracker = ProgressTracker(st.session_state.subsection_progress)
+        st.session_state.progress_tracker = tracker
+    
+    index = get_vocabulary_index()
+    if tracker.index_version != index.version:
+        tracker.rebuild(index)
+    return tracker
+
+# Media images are downloaded once into the app's static directory and
+# served from there; bundled copies in static/media are used first
+FLIP_CARD_IMAGE_URL = 'https://raw.githubusercontent.com/SavvyGaikwad/media/main/side/{number}.jpeg'
+FLIP_CARD_IMAGE_COUNT = 55
+STATIC_DIR = 'static'
+STATIC_URL = 'app/static'
+ASSET_BUNDLE_DIR = os.path.join(STATIC_DIR, 'media')
+ASSET_CACHE_DIR = os.path.join(STATIC_DIR, 'cache')
+ASSET_DOWNLOAD_TIMEOUT_SECONDS = 10
+ASSET_RETRY_SECONDS = 300
+THUMBNAIL_SCALE = 2
+
+try:
+    from PIL import Image, ImageSequence
+    # Errors Pillow raises for truncated, corrupt, oversized or unsupported images
+    THUMBNAIL_ERRORS = (OSError, ImportError, ValueError, EOFError, SyntaxError, Image.DecompressionBombError)
+except ImportError:
+    Image = None
+    THUMBNAIL_ERRORS = (OSError, ImportError, ValueError)
+
+def asset_path_for_url(url):
+    """Map a media repository URL to its path inside the repository, e.g. 'side/12.jpeg'"""
+    path = urllib.parse.urlparse(url).path
+    return urllib.parse.unquote(path.split('/main/', 1)[-1])
+
+def make_gif_thumbnail(data, width):
+    """Resize every frame of an image to `width` pixels wide, keeping animation timing"""
+    image = Image.open(io.BytesIO(data))
+    height = max(1, round(image.height * width / image.width))
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(image):
+        frames.append(frame.convert('RGBA').resize((width, height), Image.LANCZOS))
+        durations.append(frame.info.get('duration', image.info.get('duration', 100)))
+    
+    output = io.BytesIO()
+    frames[0].save(output, format='GIF', save_all=True, append_images=frames[1:], duration=durations,
+                   loop=image.info.get('loop', 0), disposal=2, optimize=True)
+    return output.getvalue()
+
+class AssetStore:
+    """Downloads media once, transcodes thumbnails in the background and hands out static URLs"""
+    
+    def __init__(self, bundle_dir, cache_dir):
+        self.bundle_dir = bundle_dir
+        self.cache_dir = cache_dir
+        self._thumbnails = {}
+        self._failed = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+    
+    def local_file(self, relative_path):
+        """Return the bundled or previously downloaded file for a path, or None"""
+        for directory in (self.bundle_dir, self.cache_dir):
+            path = os.path.join(directory, relative_path)
+            if os.path.isfile(path):
+                return path
+        return None
+    
+    def _write(self, relative_path, data):
+        path = os.path.join(self.cache_dir, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+    
+    def fetch(self, url):
+        """Return the bytes of a media file, downloading it on first use; None if unavailable"""
+        relative_path = asset_path_for_url(url)
+        path = self.local_file(relative_path)
+        if path:
+            with open(path, 'rb') as file:
+                return file.read()
+        
+        with self._lock:
+            if time.monotonic() - self._failed.get(url, -ASSET_RETRY_SECONDS) < ASSET_RETRY_SECONDS:
+                return None
+        try:
+            with urllib.request.urlopen(url, timeout=ASSET_DOWNLOAD_TIMEOUT_SECONDS) as response:
+                data = response.read()
+        except (OSError, ValueError):
+            with self._lock:
+                self._failed[url] = time.monotonic()
+            return None
+        
+        self._write(relative_path, data)
+        return data
+    
+    def run_in_background(self, key, func, *args):
+        """Run func(*args) on a background thread unless work under the same key is already running"""
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        
+        def run():
+            try:
+                func(*args)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+        
+        threading.Thread(target=run, daemon=True).start()
+    
+    def fetch_in_background(self, url):
+        """Start downloading a media file unless a download is already running"""
+        self.run_in_background(url, self.fetch, url)
+    
+    def _static_url_of(self, path):
+        return f"{STATIC_URL}/{urllib.parse.quote(os.path.relpath(path, STATIC_DIR).replace(os.sep, '/'))}"
+    
+    def static_url(self, url):
+        """Return the app's static URL for a media file, or the original URL while it downloads"""
+        path = self.local_file(asset_path_for_url(url))
+        if path is None:
+            self.fetch_in_background(url)
+            return url
+        return self._static_url_of(path)
+    
+    def thumbnail(self, url, width):
+        """Static URL of a small transcoded copy of an image, or the image's own URL until it is ready
+        
+        Thumbnails are named by a hash of their content, so browsers can keep
+        them, and the render never waits for a download or a transcode.
+        """
+        relative_path = os.path.join('thumbnails', str(width), asset_path_for_url(url))
+        with self._lock:
+            thumbnail_url = self._thumbnails.get(relative_path)
+            failed = time.monotonic() - self._failed.get(relative_path, -ASSET_RETRY_SECONDS) < ASSET_RETRY_SECONDS
+        if thumbnail_url is not None:
+            return thumbnail_url
+        if Image is not None and not failed and self.local_file(asset_path_for_url(url)) is not None:
+            self.run_in_background(relative_path, self._make_thumbnail, url, width, relative_path)
+        return self.static_url(url)
+    
+    def _make_thumbnail(self, url, width, relative_path):
+        directory, name = os.path.split(relative_path)
+        hashed_name = re.compile(re.escape(os.path.splitext(name)[0]) + r'\.[0-9a-f]{12}\.gif')
+        
+        # A thumbnail made before a restart is found by its name
+        try:
+            existing = [entry for entry in os.listdir(os.path.join(self.cache_dir, directory)) if hashed_name.fullmatch(entry)]
+        except FileNotFoundError:
+            existing = []
+        if existing:
+            path = os.path.join(self.cache_dir, directory, existing[0])
+        else:
+            # A broken image keeps its original URL and is retried later, never cached
+            try:
+                with open(self.local_file(asset_path_for_url(url)), 'rb') as file:
+                    data = make_gif_thumbnail(file.read(), width * THUMBNAIL_SCALE)
+            except THUMBNAIL_ERRORS:
+                with self._lock:
+                    self._failed[relative_path] = time.monotonic()
+                return
+            hashed_path = os.path.join(directory, f"{os.path.splitext(name)[0]}.{hashlib.sha256(data).hexdigest()[:12]}.gif")
+            self._write(hashed_path, data)
+            path = os.path.join(self.cache_dir, hashed_path)
+        
+        with self._lock:
+            self._thumbnails[relative_path] = self._static_url_of(path)
+
+@st.cache_resource
+def get_asset_store():
+    """Asset store shared by every session"""
+    return AssetStore(ASSET_BUNDLE_DIR, ASSET_CACHE_DIR)
+
+def media_image(url, width):
+    """Image source for st.image: the static URL of a thumbnail sized for `width`, falling back to the image's URL"""
+    return get_asset_store().thumbnail(url, width)
 
 def display_flip_card():
     """Display a flip card at the bottom of the sidebar with random images"""
     
-    # Generate random image number (1-55)
-    random_image_num = random.randint(1, 55)
-    image_url = f"https://raw.githubusercontent.com/SavvyGaikwad/media/main/side/{random_image_num}.jpeg"
+    # Keep the same image for the whole session so reruns don't fetch a new one
+    if 'flip_card_image' not in st.session_state:
+        st.session_state.flip_card_image = random.randint(1, FLIP_CARD_IMAGE_COUNT)
+    image_url = get_asset_store().static_url(FLIP_CARD_IMAGE_URL.format(number=st.session_state.flip_card_image))
     
-    # CSS and HTML for the flip card
+    # HTML for the flip card; its styles are in styles/base.css
     flip_card_html = f"""
-    <style>
-    .flip-card {{
-        background-color: transparent;
-        width: 190px;
-        height: 254px;
-        perspective: 1000px;
-        font-family: sans-serif;
-        margin: 20px auto;
-    }}
-    .title {{
-        font-size: 1.5em;
-        font-weight: 900;
-        text-align: center;
-        margin: 0;
-    }}
-    .flip-card-inner {{
-        position: relative;
-        width: 100%;
-        height: 100%;
-        text-align: center;
-        transition: transform 0.8s;
-        transform-style: preserve-3d;
-    }}
-    .flip-card:hover .flip-card-inner {{
-        transform: rotateY(180deg);
-    }}
-    .flip-card-front, .flip-card-back {{
-        box-shadow: 0 8px 14px 0 rgba(0,0,0,0.2);
-        position: absolute;
-        display: flex;
-        flex-direction: column;
-        justify-content: center;
-        width: 100%;
-        height: 100%;
-        -webkit-backface-visibility: hidden;
-        backface-visibility: hidden;
-        border: 1px solid coral;
-        border-radius: 1rem;
-    }}
-    .flip-card-front {{
-        background: linear-gradient(120deg, bisque 60%, rgb(255, 231, 222) 88%,
-           rgb(255, 211, 195) 40%, rgba(255, 127, 80, 0.603) 48%);
-        color: coral;
-    }}
-    .flip-card-back {{
-        background: linear-gradient(120deg, rgb(255, 174, 145) 30%, coral 88%,
-           bisque 40%, rgb(255, 185, 160) 78%);
-        color: white;
-        transform: rotateY(180deg);
-        padding: 10px;
-        box-sizing: border-box;
-    }}
-    .flip-card-back img {{
-        width: 100%;
-        height: 70%;
-        object-fit: cover;
-        border-radius: 0.5rem;
-        margin-bottom: 10px;
-    }}
-    .back-text {{
-        font-size: 1.2em;
-        font-weight: bold;
-        margin: 0;
-    }}
-    </style>
-    
     <div class="flip-card">
         <div class="flip-card-inner">
             <div class="flip-card-front">
@@ -164,10 +2981,21 @@ def add_flip_card_to_sidebar():
     
     # Optional: Add a refresh button to get a new random image
     if st.sidebar.button("🔄 New Image", help="Get a new image"):
+        st.session_state.flip_card_image = random.randint(1, FLIP_CARD_IMAGE_COUNT)
         st.rerun()
 
-def get_random_word_from_subsection(section_name, subsection_name):
-    """Get a random unused word from specified subsection"""
+def get_word_order():
+    """This session's (order, cohort), from ?order= and ?cohort= or the WORD_ORDER and COHORT secrets"""
+    if 'word_order' not in st.session_state:
+        cohort = st.query_params.get("cohort") or get_secret("COHORT")
+        order = st.query_params.get("order") or get_secret("WORD_ORDER") or ('cohort' if cohort else DEFAULT_WORD_ORDER)
+        if order not in WORD_ORDERS:
+            order = DEFAULT_WORD_ORDER
+        st.session_state.word_order = (order, cohort or 'default')
+    return st.session_state.word_order
+
+def get_random_word_from_subsection(section_name, subsection_name, cached_only=False):
+    """Get an unused word from specified subsection, following this session's word order"""
     sections = get_sections_from_json()
     
     if section_name not in sections or subsection_name not in sections[section_name]:
@@ -175,6 +3003,19 @@ def get_random_word_from_subsection(section_name, subsection_name):
     
     progress_key = f"{section_name}_{subsection_name}"
     used_words = st.session_state.subsection_progress.get(progress_key, set())
+    if cached_only:
+        # Words without a saved card count as used while generation is down
+        cache = get_card_cache()
+        used_words = used_words | {
+            word for word in sections[section_name][subsection_name]
+            if make_card_key(word, section_name, subsection_name) not in cache
+        }
+    
+    order, cohort = get_word_order()
+    if order != 'random':
+        ordered_words = get_vocabulary_index().ordered_words(section_name, subsection_name, order, cohort)
+        return next((word for word in ordered_words if word not in used_words), None)
+    
     available_words = sections[section_name][subsection_name]
     
     # Find unused words
@@ -185,107 +3026,22 @@ def get_random_word_from_subsection(section_name, subsection_name):
     return None
 
 def get_section_description(section_name):
-    """Get section description from JSON database"""
-    db = load_vocabulary_database()
-    if not db:
+    """Get section description from the vocabulary"""
+    if not load_vocabulary_database():
         return "No description available"
-    
-    # Updated mapping for new JSON structure
-    section_mapping = {
-        'Core Subjects': 'core_subjects',
-        'Clinical & Hospital Environment': 'clinical_hospital',  
-        'Communication & Ethics': 'communication_ethics',
-        'Environmental Health & Botany': 'environmental_health',
-        'Life Abroad / General Living': 'life_abroad',
-        'Academic & Study Support': 'academic_support',
-        'Emergency Situations': 'emergency_situations'
-    }
-    
-    section_key = section_mapping.get(section_name)
-    if section_key and section_key in db:
-        return db[section_key].get('description', 'No description available')
-    
-    return "No description available"
+    return get_vocabulary_index().descriptions.get(section_name) or "No description available"
 
 def get_subsection_description(section_name, subsection_name):
-    """Get subsection description from JSON database"""
-    db = load_vocabulary_database()
-    if not db:
+    """Get subsection description from the vocabulary"""
+    if not load_vocabulary_database():
         return "No description available"
-    
-    # Updated section mapping
-    section_mapping = {
-        'Core Subjects': 'core_subjects',
-        'Clinical & Hospital Environment': 'clinical_hospital',
-        'Communication & Ethics': 'communication_ethics', 
-        'Environmental Health & Botany': 'environmental_health',
-        'Life Abroad / General Living': 'life_abroad',
-        'Academic & Study Support': 'academic_support',
-        'Emergency Situations': 'emergency_situations'
-    }
-    
-    # Updated subsection mapping for all new subsections
-    subsection_mapping = {
-        # Core Subjects
-        'Anatomy': 'anatomy',
-        'Physiology': 'physiology',
-        'Biochemistry': 'biochemistry', 
-        'Pathology': 'pathology',
-        'Pharmacology': 'pharmacology',
-        'Microbiology': 'microbiology',
-        'Forensic Medicine': 'forensic_medicine',
-        'Cell Biology': 'cell_biology',
-        
-        # Clinical & Hospital Environment
-        'Clinical Skills & Tools': 'clinical_skills',
-        'Symptoms & Signs': 'symptoms_signs',
-        'Hospital Departments': 'hospital_departments',
-        'Medical Procedures': 'medical_procedures', 
-        'Community Medicine': 'community_medicine',
-        
-        # Communication & Ethics
-        'Doctor-Patient Communication': 'doctor_patient',
-        'Medical Ethics & Law': 'medical_ethics',
-        'Medical Abbreviations': 'medical_abbreviations',
-        'Medical Research Terms': 'research_terms',
-        'Medical Jargon vs Layman\'s Terms': 'medical_jargon',
-        
-        # Environmental Health & Botany
-        'Flowers & Trees': 'flowers_trees',
-        'Environmental Science': 'environmental_science', 
-        'Weather & Seasons': 'weather_seasons',
-        
-        # Life Abroad / General Living
-        'Housing & Accommodation': 'housing_accommodation',
-        'Transportation': 'transportation',
-        'Shopping & Food': 'shopping_food',
-        'Conversation with Strangers': 'conversation_strangers',
-        
-        # Academic & Study Support
-        'Maths & Biostatistics': 'maths_biostats',
-        'History': 'history',
-        'Psychology': 'psychology',
-        
-        # Emergency Situations
-        'Medical Emergencies': 'medical_emergencies',
-        'Non-Medical Emergencies': 'non_medical_emergencies'
-    }
-    
-    section_key = section_mapping.get(section_name)
-    subsection_key = subsection_mapping.get(subsection_name)
-    
-    if section_key and section_key in db and 'subsections' in db[section_key]:
-        if subsection_key and subsection_key in db[section_key]['subsections']:
-            return db[section_key]['subsections'][subsection_key].get('description', 'No description available')
-    
-    return "No description available"
+    return get_vocabulary_index().descriptions.get((section_name, subsection_name)) or "No description available"
 
 def count_words_in_subsection(section_name, subsection_name):
     """Count total words available in a subsection"""
-    sections = get_sections_from_json()
-    if section_name in sections and subsection_name in sections[section_name]:
-        return len(sections[section_name][subsection_name])
-    return 0
+    if not load_vocabulary_database():
+        return 0
+    return get_vocabulary_index().word_counts.get((section_name, subsection_name), 0)
 
 def display_grammatical_info(data):
     """Display comprehensive grammatical information in organized tabs with English translations"""
@@ -503,22 +3259,990 @@ def display_grammatical_info(data):
         st.info("💭 **Remember:** Practice with the case examples above - they show real usage patterns!")
         st.info("🔄 **Tip:** Try creating your own sentences using different cases to reinforce learning")
 
-def get_enhanced_russian_content(english_word, section, subsection):
-    """Enhanced version that requests English translations for grammatical forms"""
-    prompt = f"""
-    You are a Russian language expert helping MBBS students learn medical and general Russian vocabulary with comprehensive grammatical analysis.
+# Local Russian morphology: case, plural and conjugation tables are built here
+# instead of being generated by the model
+LOCAL_MORPHOLOGY = True
+
+try:
+    import pymorphy3 as pymorphy
+except ImportError:
+    try:
+        import pymorphy2 as pymorphy
+    except ImportError:
+        pymorphy = None
+
+CASE_NAMES = ['nominative', 'genitive', 'dative', 'accusative', 'instrumental', 'prepositional']
+PYMORPHY_CASES = ['nomn', 'gent', 'datv', 'accs', 'ablt', 'loct']
+PERSON_KEYS = ['я', 'ты', 'он_она', 'мы', 'вы', 'они']
+PYMORPHY_PERSONS = [('1per', 'sing'), ('2per', 'sing'), ('3per', 'sing'), ('1per', 'plur'), ('2per', 'plur'), ('3per', 'plur')]
+FUTURE_AUXILIARY = ['буду', 'будешь', 'будет', 'будем', 'будете', 'будут']
+
+VELARS = 'гкх'
+SIBILANTS = 'жшщч'
+VOWELS = 'аеёиоуыэюя'
+STRESS_MARK = '́'
+
+# Nouns that never change form
+INDECLINABLE_NOUNS = {
+    'кофе', 'пальто', 'кино', 'метро', 'радио', 'фото', 'бюро', 'депо', 'казино', 'кафе',
+    'резюме', 'шоссе', 'пюре', 'алоэ', 'каноэ', 'такси', 'меню', 'интервью', 'жюри', 'кенгуру',
+    'шимпанзе', 'какао', 'видео', 'аудио', 'табло', 'пианино', 'пенсне', 'портмоне', 'купе',
+    'ателье', 'кашпо', 'эскимо', 'боа', 'хобби', 'лобби', 'регби', 'сальто', 'либидо', 'эмбарго'
+}
+
+# Full paradigms: six singular then six plural forms
+IRREGULAR_NOUNS = {
+    'человек': 'человек человека человеку человека человеком человеке люди людей людям людей людьми людях',
+    'ребёнок': 'ребёнок ребёнка ребёнку ребёнка ребёнком ребёнке дети детей детям детей детьми детях',
+    'ребенок': 'ребенок ребенка ребенку ребенка ребенком ребенке дети детей детям детей детьми детях',
+    'мать': 'мать матери матери мать матерью матери матери матерей матерям матерей матерями матерях',
+    'дочь': 'дочь дочери дочери дочь дочерью дочери дочери дочерей дочерям дочерей дочерьми дочерях',
+    'путь': 'путь пути пути путь путём пути пути путей путям пути путями путях',
+    'глаз': 'глаз глаза глазу глаз глазом глазе глаза глаз глазам глаза глазами глазах',
+    'ухо': 'ухо уха уху ухо ухом ухе уши ушей ушам уши ушами ушах',
+    'плечо': 'плечо плеча плечу плечо плечом плече плечи плеч плечам плечи плечами плечах',
+    'колено': 'колено колена колену колено коленом колене колени коленей коленям колени коленями коленях',
+    'яблоко': 'яблоко яблока яблоку яблоко яблоком яблоке яблоки яблок яблокам яблоки яблоками яблоках',
+    'веко': 'веко века веку веко веком веке веки век векам веки веками веках',
+    'брат': 'брат брата брату брата братом брате братья братьев братьям братьев братьями братьях',
+    'друг': 'друг друга другу друга другом друге друзья друзей друзьям друзей друзьями друзьях',
+    'сын': 'сын сына сыну сына сыном сыне сыновья сыновей сыновьям сыновей сыновьями сыновьях',
+    'стул': 'стул стула стулу стул стулом стуле стулья стульев стульям стулья стульями стульях',
+    'лист': 'лист листа листу лист листом листе листья листьев листьям листья листьями листьях',
+    'зуб': 'зуб зуба зубу зуб зубом зубе зубы зубов зубам зубы зубами зубах',
+    'волос': 'волос волоса волосу волос волосом волосе волосы волос волосам волосы волосами волосах',
+    'семя': 'семя семени семени семя семенем семени семена семян семенам семена семенами семенах',
+    'небо': 'небо неба небу небо небом небе небеса небес небесам небеса небесами небесах',
+    'чудо': 'чудо чуда чуду чудо чудом чуде чудеса чудес чудесам чудеса чудесами чудесах',
+    'церковь': 'церковь церкви церкви церковь церковью церкви церкви церквей церквям церкви церквями церквях',
+    'сестра': 'сестра сестры сестре сестру сестрой сестре сёстры сестёр сёстрам сестёр сёстрами сёстрах',
+    'медсестра': 'медсестра медсестры медсестре медсестру медсестрой медсестре медсёстры медсестёр медсёстрам медсестёр медсёстрами медсёстрах',
+    'любовь': 'любовь любви любви любовь любовью любви любви любвей любвям любви любвями любвях'
+}
+
+# Oblique stems for masculine nouns that lose a vowel when declined
+FLEETING_VOWEL_STEMS = {
+    'день': 'дн', 'рот': 'рт', 'лоб': 'лб', 'сон': 'сн', 'мох': 'мх', 'лёд': 'льд', 'лед': 'льд',
+    'пёс': 'пс', 'угол': 'угл', 'узел': 'узл', 'ноготь': 'ногт', 'локоть': 'локт', 'ветер': 'ветр',
+    'огонь': 'огн', 'хребет': 'хребт', 'ремень': 'ремн', 'кашель': 'кашл', 'корень': 'корн',
+    'камень': 'камн', 'желудок': 'желудк', 'позвонок': 'позвонк', 'пупок': 'пупк', 'сосок': 'соск',
+    'висок': 'виск', 'кусок': 'куск', 'комок': 'комк', 'песок': 'песк', 'платок': 'платк',
+    'звонок': 'звонк', 'рисунок': 'рисунк', 'подарок': 'подарк', 'потолок': 'потолк',
+    'отрезок': 'отрезк', 'росток': 'ростк', 'цветок': 'цветк', 'рынок': 'рынк', 'уголок': 'уголк',
+    'участок': 'участк', 'остаток': 'остатк', 'недостаток': 'недостатк', 'осадок': 'осадк',
+    'порядок': 'порядк', 'припадок': 'припадк', 'отросток': 'отростк', 'посёлок': 'посёлк'
+}
+
+# Masculine nouns with a stressed -а plural
+A_PLURAL_NOUNS = {
+    'доктор', 'профессор', 'директор', 'паспорт', 'адрес', 'поезд', 'город', 'дом', 'лес',
+    'берег', 'голос', 'век', 'номер', 'отпуск', 'остров', 'цвет', 'снег', 'рукав', 'бок',
+    'округ', 'счёт', 'счет', 'учитель', 'фельдшер', 'катер', 'тормоз', 'ордер', 'сорт', 'череп'
+}
+
+# Masculine nouns in -ц with stressed endings (отцом, not отцем)
+STRESSED_TS_NOUNS = {'отец', 'конец', 'рубец', 'образец', 'боец', 'кузнец', 'певец', 'мудрец', 'близнец', 'жрец', 'огурец', 'дворец', 'продавец', 'мертвец', 'слепец', 'хитрец'}
+
+# Masculine nouns in -ой that are not adjectives
+OI_NOUNS = {'гной', 'слой', 'покой', 'перегной', 'запой', 'конвой', 'геморрой', 'прибой', 'строй', 'зной', 'отбой', 'бой', 'рой', 'настой', 'простой', 'разбой'}
+
+def strip_stress(text):
+    """Remove combining stress marks from Russian text"""
+    return text.replace(STRESS_MARK, '')
+
+@st.cache_resource
+def get_morph_analyzer():
+    """Offline morphological dictionary when pymorphy is installed, otherwise None"""
+    if pymorphy is None:
+        return None
+    return pymorphy.MorphAnalyzer()
+
+def _dictionary_inflect(word, pos_tags, grammemes):
+    """Inflect a word with the offline dictionary, or return None"""
+    analyzer = get_morph_analyzer()
+    if analyzer is None:
+        return None
+    for parse in analyzer.parse(word):
+        if parse.tag.POS in pos_tags and parse.is_known:
+            inflected = parse.inflect(set(grammemes))
+            return inflected.word if inflected else None
+    return None
+
+# Neuter -ье/-ьё nouns whose genitive plural is not -ий
+IE_GENITIVE_PLURALS = {'платье': 'платьев', 'устье': 'устьев', 'подмастерье': 'подмастерьев', 'ружьё': 'ружей', 'ружье': 'ружей'}
+
+# Nouns used only in the singular, which get no plural table
+SINGULAR_ONLY_NOUNS = {
+    'здоровье', 'зрение', 'слух', 'обоняние', 'осязание', 'кровообращение', 'пищеварение',
+    'иммунитет', 'молоко', 'бельё', 'белье', 'потомство', 'лечение'
+}
+
+def _y_or_i(stem):
+    return 'и' if stem[-1:] in VELARS + SIBILANTS else 'ы'
+
+def _count_vowels(text):
+    return sum(1 for char in text if char in VOWELS)
+
+def _fleeting_stem(word):
+    """Oblique stem of a masculine noun, dropping a fleeting vowel where needed"""
+    if word.lower() in FLEETING_VOWEL_STEMS:
+        return FLEETING_VOWEL_STEMS[word.lower()]
+    if word.endswith('ец') and _count_vowels(word) > 1:
+        before = word[-3]
+        if before in VOWELS:
+            return word[:-2] + 'йц'
+        if before == 'л':
+            return word[:-2] + 'ьц'
+        return word[:-2] + 'ц'
+    if word.endswith(('чок', 'шок', 'жок')) and _count_vowels(word) > 1:
+        return word[:-2] + 'к'
+    if word.endswith('ёк'):
+        return word[:-2] + ('йк' if word[-3] in VOWELS else 'ьк')
+    return word
+
+def _zero_genitive_plural(stem, gender):
+    """Genitive plural with a zero ending, inserting a fleeting vowel in clusters"""
+    if len(stem) < 2 or stem[-1] in VOWELS or stem[-2] in VOWELS:
+        return stem
+    if stem[-2] in 'ьй':
+        return stem[:-2] + 'е' + stem[-1]
+    if stem[-1] == 'к':
+        return stem[:-1] + ('е' if stem[-2] in SIBILANTS else 'о') + 'к'
+    if stem[-1] == 'л' and stem[-2] in 'рл':
+        return stem
+    if gender == 'neuter' and stem[-1] in 'нлрмц':
+        return stem[:-1] + ('о' if stem[-2] in VELARS else 'е') + stem[-1]
+    return stem
+
+def _noun_forms(word, gender, animate):
+    """Rule-based singular and plural case forms for a single noun"""
+    lower = word.lower()
+    if word.isupper() or lower in INDECLINABLE_NOUNS or lower[-1] in 'иуюэ' or (lower[-1] in 'оеё' and gender == 'masculine'):
+        return [word] * 6, [word] * 6
+    if lower in IRREGULAR_NOUNS:
+        forms = IRREGULAR_NOUNS[lower].split()
+        return forms[:6], forms[6:]
+
+    ending = lower[-1]
+    if lower.endswith('мя'):
+        stem = word[:-1] + 'ен'
+        singular = [word, stem + 'и', stem + 'и', word, stem + 'ем', stem + 'и']
+        plural = [stem + 'а', word[:-2] + 'мён', stem + 'ам', stem + 'а', stem + 'ами', stem + 'ах']
+    elif lower.endswith('ия'):
+        stem = word[:-1]
+        singular = [word, stem + 'и', stem + 'и', stem + 'ю', stem + 'ей', stem + 'и']
+        plural = [stem + 'и', stem + 'й', stem + 'ям', stem + 'и', stem + 'ями', stem + 'ях']
+    elif lower.endswith(('ие', 'ье', 'ьё')):
+        stem = word[:-1]
+        prepositional = stem + ('и' if lower.endswith('ие') else 'е')
+        singular = [word, stem + 'я', stem + 'ю', word, stem + ('ем' if ending == 'е' else 'ём'), prepositional]
+        if lower in IE_GENITIVE_PLURALS:
+            genitive_plural = IE_GENITIVE_PLURALS[lower]
+        else:
+            genitive_plural = stem + 'й' if lower.endswith('ие') else word[:-2] + 'ий'
+        plural = [stem + 'я', genitive_plural, stem + 'ям', stem + 'я', stem + 'ями', stem + 'ях']
+    elif ending == 'а':
+        stem = word[:-1]
+        instrumental = 'ей' if stem[-1:] in SIBILANTS + 'ц' else 'ой'
+        singular = [word, stem + _y_or_i(stem), stem + 'е', stem + 'у', stem + instrumental, stem + 'е']
+        plural = [stem + _y_or_i(stem), _zero_genitive_plural(stem, 'feminine'), stem + 'ам', stem + _y_or_i(stem), stem + 'ами', stem + 'ах']
+    elif ending == 'я':
+        stem = word[:-1]
+        if stem[-1:] in VOWELS:
+            genitive_plural = stem + 'й'
+        elif lower.endswith('ля') and stem[-2:-1] not in VOWELS:
+            genitive_plural = stem[:-1] + 'ель'
+        else:
+            genitive_plural = stem + 'ь'
+        singular = [word, stem + 'и', stem + 'е', stem + 'ю', stem + 'ей', stem + 'е']
+        plural = [stem + 'и', genitive_plural, stem + 'ям', stem + 'и', stem + 'ями', stem + 'ях']
+    elif ending == 'о':
+        stem = word[:-1]
+        singular = [word, stem + 'а', stem + 'у', word, stem + 'ом', stem + 'е']
+        plural = [stem + 'а', _zero_genitive_plural(stem, 'neuter'), stem + 'ам', stem + 'а', stem + 'ами', stem + 'ах']
+    elif ending in 'её':
+        stem = word[:-1]
+        if stem[-1:] in SIBILANTS + 'ц':
+            singular = [word, stem + 'а', stem + 'у', word, stem + 'ем', stem + 'е']
+            plural = [stem + 'а', _zero_genitive_plural(stem, 'neuter'), stem + 'ам', stem + 'а', stem + 'ами', stem + 'ах']
+        else:
+            singular = [word, stem + 'я', stem + 'ю', word, stem + 'ем', stem + 'е']
+            plural = [stem + 'я', stem + 'ей', stem + 'ям', stem + 'я', stem + 'ями', stem + 'ях']
+    elif ending == 'ь' and gender == 'feminine':
+        stem = word[:-1]
+        hard = stem[-1:] in SIBILANTS
+        singular = [word, stem + 'и', stem + 'и', word, stem + 'ью', stem + 'и']
+        plural = [stem + 'и', stem + 'ей', stem + ('ам' if hard else 'ям'), stem + 'и', stem + ('ами' if hard else 'ями'), stem + ('ах' if hard else 'ях')]
+    elif ending in 'ьй':
+        stem = FLEETING_VOWEL_STEMS.get(lower, word[:-1])
+        prepositional = stem + ('и' if lower.endswith('ий') else 'е')
+        genitive_plural = stem + ('ей' if ending == 'ь' else 'ев')
+        nominative_plural = stem + ('я' if lower in A_PLURAL_NOUNS else 'и')
+        singular = [word, stem + 'я', stem + 'ю', word, stem + 'ем', prepositional]
+        plural = [nominative_plural, genitive_plural, stem + 'ям', nominative_plural, stem + 'ями', stem + 'ях']
+    else:
+        stem = _fleeting_stem(word)
+        if stem[-1] == 'ц':
+            instrumental = 'ом' if lower in STRESSED_TS_NOUNS else 'ем'
+        elif stem[-1] in SIBILANTS:
+            instrumental = 'ем' if _count_vowels(lower) > 1 else 'ом'
+        else:
+            instrumental = 'ом'
+        if stem[-1] in SIBILANTS:
+            genitive_plural = 'ей'
+        elif stem[-1] == 'ц' and instrumental == 'ем':
+            genitive_plural = 'ев'
+        else:
+            genitive_plural = 'ов'
+        nominative_plural = stem + ('а' if lower in A_PLURAL_NOUNS else _y_or_i(stem))
+        singular = [word, stem + 'а', stem + 'у', word, stem + instrumental, stem + 'е']
+        plural = [nominative_plural, stem + genitive_plural, stem + 'ам', nominative_plural, stem + 'ами', stem + 'ах']
+
+    # Animate nouns take the genitive form in the accusative plural, and
+    # masculine ones in the singular too
+    if animate:
+        plural[3] = plural[1]
+        if gender == 'masculine' and ending not in 'ая':
+            singular[3] = singular[1]
+    return singular, plural
+
+ADJECTIVE_ENDINGS = {
+    'hard': ('ый ого ому ым ом', 'ая ой ой ую ой ой', 'ое ого ому ое ым ом', 'ые ых ым ыми ых'),
+    'soft': ('ий его ему им ем', 'яя ей ей юю ей ей', 'ее его ему ее им ем', 'ие их им ими их'),
+    'velar': ('ий ого ому им ом', 'ая ой ой ую ой ой', 'ое ого ому ое им ом', 'ие их им ими их'),
+    'sibilant': ('ий его ему им ем', 'ая ей ей ую ей ей', 'ее его ему ее им ем', 'ие их им ими их')
+}
+
+def _adjective_stem(word):
+    """Split an adjective in any gender or number into stem and declension type"""
+    stem, ending = word[:-2], word[-2:].lower()
+    last = stem[-1:].lower()
+    stressed = ending == 'ой'
+    if last in VELARS or (last in SIBILANTS and (stressed or ending == 'ое')):
+        kind = 'velar'
+    elif last in SIBILANTS:
+        kind = 'sibilant'
+    elif ending in ('ий', 'яя', 'ее', 'ие'):
+        kind = 'soft'
+    else:
+        kind = 'hard'
+    return stem, kind, stressed
+
+def has_adjective_ending(word):
+    """True if a word ends like a full-form adjective in any gender or number"""
+    return len(word) >= 4 and word.lower().endswith(('ый', 'ий', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие'))
+
+def looks_like_adjective(word, in_phrase=False):
+    """Heuristic check for an adjective, telling it apart from nouns like критерий or заболевание"""
+    lower = word.lower()
+    if not lower.isalpha() or not has_adjective_ending(lower):
+        return False
+    if lower.endswith(('ый', 'ая', 'яя', 'ое', 'ее', 'ые')):
+        return True
+    if lower.endswith('ие'):
+        return lower[-3] in VELARS + SIBILANTS
+    if lower.endswith('ий'):
+        return in_phrase and lower[-3] in VELARS + SIBILANTS + 'н'
+    return lower not in OI_NOUNS and (in_phrase or len(lower) >= 6)
+
+def _adjective_forms(word, gender, animate):
+    """Rule-based case forms of an adjective agreeing with a head noun"""
+    stem, kind, stressed = _adjective_stem(word)
+    masculine, feminine, neuter, plural = (endings.split() for endings in ADJECTIVE_ENDINGS[kind])
+
+    if gender == 'feminine':
+        singular = [stem + ending for ending in feminine]
+    elif gender == 'neuter':
+        singular = [stem + ending for ending in neuter]
+    else:
+        nominative = stem + ('ой' if stressed else masculine[0])
+        genitive, dative, instrumental, prepositional = (stem + ending for ending in masculine[1:])
+        singular = [nominative, genitive, dative, genitive if animate else nominative, instrumental, prepositional]
+
+    nominative_plural, genitive_plural, dative_plural, instrumental_plural, prepositional_plural = (stem + ending for ending in plural)
+    accusative_plural = genitive_plural if animate else nominative_plural
+    return singular, [nominative_plural, genitive_plural, dative_plural, accusative_plural, instrumental_plural, prepositional_plural]
+
+def _dictionary_forms(word, pos_tags, agreement, animate):
+    """Override rule-based forms with dictionary forms where the dictionary knows the word"""
+    singular, plural = [None] * 6, [None] * 6
+    for index, case in enumerate(PYMORPHY_CASES):
+        extra = {'anim' if animate else 'inan'} if case == 'accs' and 'NOUN' not in pos_tags else set()
+        singular[index] = _dictionary_inflect(word, pos_tags, {case, 'sing', *agreement, *extra})
+        plural[index] = _dictionary_inflect(word, pos_tags, {case, 'plur', *extra})
+    return singular, plural
+
+def _merge_forms(rule_forms, dictionary_forms):
+    return [dictionary_form or rule_form for rule_form, dictionary_form in zip(rule_forms, dictionary_forms)]
+
+def decline_word(word, gender, animate, as_adjective):
+    """Singular and plural forms for one word, preferring the offline dictionary"""
+    if as_adjective:
+        singular, plural = _adjective_forms(word, gender, animate)
+        pos_tags = {'ADJF'}
+        agreement = {{'feminine': 'femn', 'neuter': 'neut'}.get(gender, 'masc')}
+    else:
+        singular, plural = _noun_forms(word, gender, animate)
+        pos_tags = {'NOUN'}
+        agreement = set()
+
+    if get_morph_analyzer() is not None and word.islower():
+        dictionary_singular, dictionary_plural = _dictionary_forms(word, pos_tags, agreement, animate)
+        singular = _merge_forms(singular, dictionary_singular)
+        plural = _merge_forms(plural, dictionary_plural)
+    return singular, plural
+
+def decline_phrase(lemma, gender, animate=False):
+    """Decline a noun or noun phrase: agreeing adjectives, the head noun, and a frozen tail"""
+    words = lemma.split()
+    head = next((index for index, word in enumerate(words)
+                 if not looks_like_adjective(word, in_phrase=index < len(words) - 1)), None)
+
+    if head is None:
+        # A substantivized adjective such as лёгкое or больной
+        declined = [decline_word(word, gender, animate, as_adjective=True) for word in words]
+    else:
+        declined = [decline_word(word, gender, animate, as_adjective=True) for word in words[:head]]
+        declined.append(decline_word(words[head], gender, animate, as_adjective=False))
+        tail = words[head + 1:]
+        declined.extend(([word] * 6, [word] * 6) for word in tail)
+
+    singular = [' '.join(forms[0][index] for forms in declined) for index in range(6)]
+    plural = [' '.join(forms[1][index] for forms in declined) for index in range(6)]
+    return singular, plural
+
+# Present (or perfective future) stems for verbs that do not follow the rules;
+# keyed by infinitive and also matched after a verbal prefix
+IRREGULAR_VERBS = {
+    'быть': ('буду будешь будет будем будете будут', None, None, 'будь'),
+    'хотеть': ('хочу хочешь хочет хотим хотите хотят', None, None, None),
+    'есть': ('ем ешь ест едим едите едят', 'ел', 'ела', 'ешь'),
+    'дать': ('дам дашь даст дадим дадите дадут', None, None, 'дай'),
+    'бежать': ('бегу бежишь бежит бежим бежите бегут', None, None, 'беги'),
+    'идти': ('иду идёшь идёт идём идёте идут', 'шёл', 'шла', 'иди'),
+    'йти': ('йду йдёшь йдёт йдём йдёте йдут', 'шёл', 'шла', 'йди'),
+    'прийти': ('приду придёшь придёт придём придёте придут', 'пришёл', 'пришла', 'приди'),
+    'ехать': ('еду едешь едет едем едете едут', None, None, 'поезжай'),
+    'пить': ('пью пьёшь пьёт пьём пьёте пьют', None, None, 'пей'),
+    'бить': ('бью бьёшь бьёт бьём бьёте бьют', None, None, 'бей'),
+    'лить': ('лью льёшь льёт льём льёте льют', None, None, 'лей'),
+    'шить': ('шью шьёшь шьёт шьём шьёте шьют', None, None, 'шей'),
+    'жить': ('живу живёшь живёт живём живёте живут', None, None, 'живи'),
+    'спать': ('сплю спишь спит спим спите спят', None, None, 'спи'),
+    'брать': ('беру берёшь берёт берём берёте берут', None, None, 'бери'),
+    'взять': ('возьму возьмёшь возьмёт возьмём возьмёте возьмут', None, None, 'возьми'),
+    'звать': ('зову зовёшь зовёт зовём зовёте зовут', None, None, 'зови'),
+    'ждать': ('жду ждёшь ждёт ждём ждёте ждут', None, None, 'жди'),
+    'рвать': ('рву рвёшь рвёт рвём рвёте рвут', None, None, 'рви'),
+    'мочь': ('могу можешь может можем можете могут', 'мог', 'могла', None),
+    'лечь': ('лягу ляжешь ляжет ляжем ляжете лягут', 'лёг', 'легла', 'ляг'),
+    'печь': ('пеку печёшь печёт печём печёте пекут', 'пёк', 'пекла', 'пеки'),
+    'течь': ('теку течёшь течёт течём течёте текут', 'тёк', 'текла', 'теки'),
+    'влечь': ('влеку влечёшь влечёт влечём влечёте влекут', 'влёк', 'влекла', 'влеки'),
+    'беречь': ('берегу бережёшь бережёт бережём бережёте берегут', 'берёг', 'берегла', 'береги'),
+    'жечь': ('жгу жжёшь жжёт жжём жжёте жгут', 'жёг', 'жгла', 'жги'),
+    'стричь': ('стригу стрижёшь стрижёт стрижём стрижёте стригут', 'стриг', 'стригла', 'стриги'),
+    'сесть': ('сяду сядешь сядет сядем сядете сядут', 'сел', 'села', 'сядь'),
+    'стать': ('стану станешь станет станем станете станут', None, None, 'стань'),
+    'давать': ('даю даёшь даёт даём даёте дают', None, None, 'давай'),
+    'ставать': ('стаю стаёшь стаёт стаём стаёте стают', None, None, 'ставай'),
+    'знавать': ('знаю знаёшь знаёт знаём знаёте знают', None, None, 'знавай'),
+    'петь': ('пою поёшь поёт поём поёте поют', None, None, 'пой'),
+    'класть': ('кладу кладёшь кладёт кладём кладёте кладут', 'клал', 'клала', 'клади'),
+    'вести': ('веду ведёшь ведёт ведём ведёте ведут', 'вёл', 'вела', 'веди'),
+    'нести': ('несу несёшь несёт несём несёте несут', 'нёс', 'несла', 'неси'),
+    'везти': ('везу везёшь везёт везём везёте везут', 'вёз', 'везла', 'вези'),
+    'расти': ('расту растёшь растёт растём растёте растут', 'рос', 'росла', 'расти'),
+    'начать': ('начну начнёшь начнёт начнём начнёте начнут', None, None, 'начни'),
+    'понять': ('пойму поймёшь поймёт поймём поймёте поймут', None, None, 'пойми'),
+    'принять': ('приму примешь примет примем примете примут', None, None, 'прими'),
+    'снять': ('сниму снимешь снимет снимем снимете снимут', None, None, 'сними'),
+    'занять': ('займу займёшь займёт займём займёте займут', None, None, 'займи'),
+    'поднять': ('подниму поднимешь поднимет поднимем поднимете поднимут', None, None, 'подними'),
+    'обнять': ('обниму обнимешь обнимет обнимем обнимете обнимут', None, None, 'обними'),
+    'умереть': ('умру умрёшь умрёт умрём умрёте умрут', 'умер', 'умерла', 'умри'),
+    'тереть': ('тру трёшь трёт трём трёте трут', 'тёр', 'тёрла', 'три'),
+    'деть': ('дену денешь денет денем денете денут', None, None, 'день'),
+    'брить': ('брею бреешь бреет бреем бреете бреют', None, None, 'брей'),
+    'жать': ('жму жмёшь жмёт жмём жмёте жмут', None, None, 'жми'),
+    'любить': ('люблю любишь любит любим любите любят', None, None, 'люби'),
+    'страдать': ('страдаю страдаешь страдает страдаем страдаете страдают', None, None, 'страдай'),
+    'ожидать': ('ожидаю ожидаешь ожидает ожидаем ожидаете ожидают', None, None, 'ожидай'),
+    'наблюдать': ('наблюдаю наблюдаешь наблюдает наблюдаем наблюдаете наблюдают', None, None, 'наблюдай')
+}
+
+VERB_PREFIXES = (
+    'пере', 'пред', 'недо', 'разо', 'подо', 'надо', 'обо', 'ото', 'вос', 'воз', 'раз', 'рас', 'под', 'над',
+    'при', 'про', 'пре', 'без', 'бес', 'вы', 'за', 'на', 'от', 'по', 'до', 'из', 'ис', 'об', 'во', 'вз', 'вс',
+    'со', 'у', 'с', 'в', 'о'
+)
+
+# -еть and -ать verbs that follow the second conjugation
+SECOND_CONJUGATION_VERBS = {
+    'смотреть', 'видеть', 'терпеть', 'зависеть', 'сидеть', 'лететь', 'вертеть', 'обидеть', 'ненавидеть',
+    'храпеть', 'свистеть', 'шуметь', 'гореть', 'висеть', 'звенеть', 'блестеть', 'слышать', 'держать',
+    'дышать', 'лежать', 'молчать', 'кричать', 'стучать', 'звучать', 'дрожать', 'стоять', 'боять'
+}
+
+# -евать verbs where -ева- is a suffix (ночевать -> ночую); others like
+# одевать keep it in the present stem
+EVAT_SUFFIX_VERBS = {'воевать', 'ночевать', 'танцевать', 'горевать', 'клевать', 'плевать', 'жевать', 'малевать'}
+
+# First-conjugation -ать verbs whose present stem ends in a changed consonant
+CONSONANT_STEM_VERBS = {
+    'казать': 'каж', 'сказать': 'скаж', 'резать': 'реж', 'мазать': 'маж', 'писать': 'пиш', 'плакать': 'плач', 'искать': 'ищ',
+    'чесать': 'чеш', 'прятать': 'пряч', 'лизать': 'лиж', 'вязать': 'вяж', 'сыпать': 'сыпл', 'дремать': 'дремл',
+    'щипать': 'щипл', 'колебать': 'колебл', 'шептать': 'шепч', 'хлестать': 'хлещ', 'полоскать': 'полощ',
+    'щекотать': 'щекоч', 'махать': 'маш', 'пахать': 'паш', 'рыскать': 'рыщ', 'глодать': 'глож'
+}
+
+# Verbs stressed on the stem, whose imperative ends in -ь rather than -и
+STEM_STRESSED_IMPERATIVES = {
+    'резать': 'режь', 'мазать': 'мажь', 'плакать': 'плачь', 'прятать': 'прячь', 'сыпать': 'сыпь',
+    'видеть': 'видь', 'слышать': 'слышь', 'ставить': 'ставь'
+}
+
+# Verbs with no imperative; matched exactly, since помочь and захотеть have one
+NO_IMPERATIVE_VERBS = {'мочь', 'смочь', 'хотеть'}
+
+CONSONANT_MUTATIONS = [('ст', 'щ'), ('зд', 'зж'), ('д', 'ж'), ('з', 'ж'), ('т', 'ч'), ('с', 'ш'),
+                       ('б', 'бл'), ('п', 'пл'), ('в', 'вл'), ('ф', 'фл'), ('м', 'мл')]
+
+def _match_irregular(table, infinitive):
+    """Find a table entry for an infinitive, allowing a single verbal prefix"""
+    if infinitive in table:
+        return '', infinitive
+    for suffix in sorted(table, key=len, reverse=True):
+        prefix = infinitive[:-len(suffix)]
+        if infinitive.endswith(suffix) and prefix in VERB_PREFIXES:
+            return prefix, suffix
+    return None, None
+
+def _present_forms(base):
+    """Present (imperfective) or simple future (perfective) forms of a non-reflexive verb"""
+    prefix, suffix = _match_irregular(IRREGULAR_VERBS, base)
+    if suffix:
+        return [prefix + form for form in IRREGULAR_VERBS[suffix][0].split()]
+
+    prefix, suffix = _match_irregular(CONSONANT_STEM_VERBS, base)
+    if suffix:
+        stem = prefix + CONSONANT_STEM_VERBS[suffix]
+        first, third_plural = ('ю', 'ют') if stem.endswith('л') else ('у', 'ут')
+        return [stem + first, stem + 'ешь', stem + 'ет', stem + 'ем', stem + 'ете', stem + third_plural]
+
+    second_conjugation = base.endswith('ить') or any(base.endswith(verb) for verb in SECOND_CONJUGATION_VERBS)
+    if second_conjugation:
+        stem = base[:-3]
+        first_stem = stem
+        if stem and stem[-1] not in VOWELS:
+            for source, target in CONSONANT_MUTATIONS:
+                if stem.endswith(source):
+                    first_stem = stem[:-len(source)] + target
+                    break
+        hard = stem[-1:] in SIBILANTS
+        first = first_stem + ('у' if first_stem[-1:] in SIBILANTS else 'ю')
+        return [first, stem + 'ишь', stem + 'ит', stem + 'им', stem + 'ите', stem + ('ат' if hard else 'ят')]
+
+    if base.endswith('овать') or any(base.endswith(verb) for verb in EVAT_SUFFIX_VERBS):
+        stem = base[:-5]
+        stem += 'у' if base.endswith('овать') or stem[-1:] in SIBILANTS + 'ц' else 'ю'
+    elif base.endswith('нуть'):
+        stem = base[:-3]
+        return [stem + 'у', stem + 'ешь', stem + 'ет', stem + 'ем', stem + 'ете', stem + 'ут']
+    elif base.endswith('ыть'):
+        stem = base[:-3] + 'о'
+    elif base.endswith('оть'):
+        stem = base[:-3]
+    elif base.endswith('ти'):
+        stem = base[:-2]
+        return [stem + 'у', stem + 'ёшь', stem + 'ёт', stem + 'ём', stem + 'ёте', stem + 'ут']
+    else:
+        stem = base[:-2]
+    return [stem + 'ю', stem + 'ешь', stem + 'ет', stem + 'ем', stem + 'ете', stem + 'ют']
+
+def _past_forms(base):
+    """Masculine, feminine, neuter and plural past forms of a non-reflexive verb"""
+    prefix, suffix = _match_irregular(IRREGULAR_VERBS, base)
+    if suffix and IRREGULAR_VERBS[suffix][1]:
+        masculine = prefix + IRREGULAR_VERBS[suffix][1]
+        feminine = prefix + IRREGULAR_VERBS[suffix][2]
+    else:
+        stem = base[:-2] if base.endswith('ть') else base
+        masculine, feminine = stem + 'л', stem + 'ла'
+    return [masculine, feminine, feminine[:-1] + 'о', feminine[:-1] + 'и']
+
+def _imperative(base, present):
+    """Singular imperative derived from the third person plural stem, or None for verbs without one"""
+    if base in NO_IMPERATIVE_VERBS:
+        return None
+    prefix, suffix = _match_irregular(IRREGULAR_VERBS, base)
+    if suffix and IRREGULAR_VERBS[suffix][3]:
+        return prefix + IRREGULAR_VERBS[suffix][3]
+    prefix, suffix = _match_irregular(STEM_STRESSED_IMPERATIVES, base)
+    if suffix:
+        return prefix + STEM_STRESSED_IMPERATIVES[suffix]
+    stem = present[5][:-2]
+    if stem[-1:] in VOWELS:
+        return stem + 'й'
+    return stem + 'и'
+
+def _add_reflexive(form):
+    return form + ('сь' if form[-1:] in VOWELS else 'ся')
+
+def conjugate_verb(infinitive, aspect='imperfective'):
+    """Build present, past, future and mood forms for a Russian verb"""
+    infinitive = infinitive.strip()
+    reflexive = infinitive.endswith(('ся', 'сь'))
+    base = infinitive[:-2] if reflexive else infinitive
+
+    present = _present_forms(base)
+    past = _past_forms(base)
+    if base.startswith('вы') and len(base) > len('выть'):
+        # Perfective вы- takes the stress, so endings keep an unstressed е: вызовешь, вынес
+        present = [form.replace('ё', 'е') for form in present]
+        past = [form.replace('ё', 'е') for form in past]
+    imperative = _imperative(base, present)
+    if reflexive:
+        present = [_add_reflexive(form) for form in present]
+        past = [past[0] + 'ся'] + [form + 'сь' for form in past[1:]]
+        imperative = imperative and _add_reflexive(imperative)
+
+    if get_morph_analyzer() is not None:
+        tense = 'futr' if aspect == 'perfective' else 'pres'
+        for index, (person, number) in enumerate(PYMORPHY_PERSONS):
+            present[index] = _dictionary_inflect(infinitive, {'INFN'}, {person, number, tense}) or present[index]
+        for index, grammeme in enumerate(['masc', 'femn', 'neut', 'plur']):
+            tags = {'past', grammeme} if grammeme == 'plur' else {'past', 'sing', grammeme}
+            past[index] = _dictionary_inflect(infinitive, {'INFN'}, tags) or past[index]
+        if imperative:
+            imperative = _dictionary_inflect(infinitive, {'INFN'}, {'impr', 'excl', 'sing'}) or imperative
+
+    if base == 'быть':
+        present_forms, future_forms = {}, dict(zip(PERSON_KEYS, present))
+    elif aspect == 'perfective':
+        present_forms, future_forms = {}, dict(zip(PERSON_KEYS, present))
+    else:
+        present_forms = dict(zip(PERSON_KEYS, present))
+        future_forms = {key: f"{auxiliary} {infinitive}" for key, auxiliary in zip(PERSON_KEYS, FUTURE_AUXILIARY)}
+
+    conjugation = {
+        'infinitive': infinitive,
+        'present': present_forms,
+        'past': dict(zip(['masculine', 'feminine', 'neuter', 'plural'], past)),
+        'future': future_forms
+    }
+    mood = {'conditional': f"{past[0]} бы ({past[1]} бы, {past[3]} бы)"}
+    if imperative:
+        imperative_plural = imperative[:-2] + 'тесь' if reflexive else imperative + 'те'
+        mood = {'imperative': f"{imperative}! {imperative_plural}!", **mood}
+    return conjugation, mood
+
+def build_grammar_tables(lemma, part_of_speech, gender, animate=False, aspect='imperfective'):
+    """Deterministic cases, plural_forms, verb_conjugation and mood fields for a card"""
+    lemma = strip_stress(lemma).strip()
+    part_of_speech = (part_of_speech or '').lower()
+    gender = (gender or '').lower()
+    tables = {'cases': {}, 'plural_forms': {}, 'verb_conjugation': {}, 'mood': {}}
+    if not lemma:
+        return tables
+
+    if 'verb' in part_of_speech and 'adverb' not in part_of_speech:
+        conjugation, mood = conjugate_verb(lemma.split()[0], aspect)
+        tables['verb_conjugation'] = conjugation
+        tables['mood'] = mood
+    elif 'noun' in part_of_speech and 'pronoun' not in part_of_speech:
+        singular, plural = decline_phrase(lemma, gender, animate)
+        tables['cases'] = dict(zip(CASE_NAMES, singular))
+        if SINGULAR_ONLY_NOUNS & set(lemma.lower().split()):
+            return tables
+        tables['plural_forms'] = {
+            'nominative_plural': plural[0],
+            'genitive_plural': plural[1],
+            'other_plurals': f"dative {plural[2]}, accusative {plural[3]}, instrumental {plural[4]}, prepositional {plural[5]}"
+        }
+    elif 'adjective' in part_of_speech and has_adjective_ending(lemma) and ' ' not in lemma:
+        forms = {word_gender: _adjective_forms(lemma, word_gender, animate) for word_gender in ('masculine', 'feminine', 'neuter')}
+        tables['cases'] = {
+            case: f"{forms['masculine'][0][index]} (m.), {forms['feminine'][0][index]} (f.), {forms['neuter'][0][index]} (n.)"
+            for index, case in enumerate(CASE_NAMES)
+        }
+        plural = forms['masculine'][1]
+        tables['plural_forms'] = {
+            'nominative_plural': plural[0],
+            'genitive_plural': plural[1],
+            'other_plurals': f"dative {plural[2]}, instrumental {plural[4]}, prepositional {plural[5]}"
+        }
+    return tables
+
+def apply_local_morphology(content):
+    """Fill a model response's grammar tables from the local morphology engine"""
+    aspect = (content.get('aspect') or 'imperfective').lower()
+    animate = (content.get('animacy') or '').lower() == 'animate'
+    tables = build_grammar_tables(
+        content.get('lemma') or content.get('russian_word', '').split('(')[0],
+        content.get('part_of_speech'),
+        content.get('gender'),
+        animate=animate,
+        aspect=aspect
+    )
+    if tables['verb_conjugation']:
+        tables['verb_conjugation']['aspect'] = aspect
+        for partner in ('perfective_partner', 'imperfective_partner'):
+            if content.get(partner):
+                tables['verb_conjugation'][partner] = content[partner]
+    content.update(tables)
+    return content
+
+FIXTURE_NOUNS = [
+    ('се́рдце', 'neuter'), ('кровь', 'feminine'), ('врач', 'masculine'), ('больни́ца', 'feminine'),
+    ('лёгкое', 'neuter'), ('кость', 'feminine'), ('пацие́нт', 'masculine'), ('ра́на', 'feminine'),
+    ('желу́док', 'masculine'), ('лека́рство', 'neuter'), ('давле́ние', 'neuter'), ('ана́лиз', 'masculine')
+]
+
+def make_fixture_card(english_word, section, subsection):
+    """Build a deterministic synthetic card for a word without calling the model"""
+    stressed, gender = FIXTURE_NOUNS[zlib.crc32(english_word.encode('utf-8')) % len(FIXTURE_NOUNS)]
+    lemma = strip_stress(stressed)
+    animate = lemma in ('врач', 'пациент')
+    content = {
+        'russian_word': f"{lemma} ({stressed})",
+        'lemma': lemma,
+        'part_of_speech': 'noun',
+        'gender': gender,
+        'animacy': 'animate' if animate else 'inanimate',
+        'aspect': 'not applicable',
+        'pronunciation_stress': stressed,
+        'etymology': f"Fixture entry for '{english_word}'",
+        'formal_sentence': f"Пациенту необходимо обследование: {lemma}.",
+        'formal_sentence_english': f"The patient needs an examination: {english_word}.",
+        'formal_pos': 'noun',
+        'formal_grammar': 'nominative singular',
+        'informal_sentence': f"Смотри, это {lemma}!",
+        'informal_sentence_english': f"Look, this is {english_word}!",
+        'informal_pos': 'noun',
+        'informal_grammar': 'nominative singular',
+        'question': f"Где {lemma}?",
+        'question_english': f"Where is the {english_word}?",
+        'question_pos': 'noun',
+        'question_grammar': 'nominative singular',
+        'answer': f"{lemma.capitalize()} здесь.",
+        'answer_english': f"The {english_word} is here.",
+        'answer_pos': 'noun',
+        'answer_grammar': 'nominative singular',
+        'prefixes_suffixes': {
+            'common_prefixes': 'не- (not)',
+            'common_suffixes': '-ный (adjective)',
+            'related_words': f"{lemma} (related forms)"
+        },
+        'negation': {
+            'negative_form': 'Used with нет + genitive',
+            'negative_example': f"Здесь нет: {lemma}.",
+            'negative_example_english': f"There is no {english_word} here."
+        },
+        'common_collocations': [f"{lemma} пациента (the patient's {english_word})"],
+        'regional_variations': 'None',
+        'difficulty_level': 'beginner'
+    }
+    apply_local_morphology(content)
+    return {'english_word': english_word, 'section': section, 'subsection': subsection, **content}
+
+REQUIRED_CARD_KEYS = ["russian_word", "part_of_speech", "formal_sentence", "informal_sentence", "question", "answer"]
+CLOSING_BRACKETS = {'{': '}', '[': ']'}
+# A complete string, an unterminated string, or a structural character
+JSON_STRUCTURE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|"|[{}\[\],]', re.S)
+JSON_DECODER = json.JSONDecoder()
+
+def extract_json_object(text):
+    """Find and parse the first JSON object in model output
     
-    Context: This is for the "{section}" section, specifically "{subsection}" subsection.
-    English word: "{english_word}"
+    Strings are skipped whole, so braces or backticks inside them, code fences,
+    leading prose and trailing commentary don't matter. Output cut off
+    mid-object is closed after its last complete member. Only a candidate
+    that fails to decode is scanned structurally, and the text is scanned
+    once: a candidate that fails is skipped as a whole, never rescanned.
+    """
+    position = 0
+    while True:
+        start = text.find('{', position)
+        if start == -1:
+            raise ValueError("No valid JSON found in response")
+        
+        # Well-formed objects are decoded in C straight from the text
+        try:
+            return JSON_DECODER.raw_decode(text, start)[0]
+        except (ValueError, RecursionError):
+            pass
+        
+        # Open brackets and where each opened; the object could be cut and
+        # closed at `cut` with the first `cut_depth` of them if the text ends
+        stack, opened_at = [], []
+        cut, cut_depth = None, 0
+        position = None
+        for match in JSON_STRUCTURE.finditer(text, start):
+            token = match.group()
+            index = match.start()
+            if token == '{' or token == '[':
+                stack.append(token)
+                opened_at.append(index)
+            elif token == '}' or token == ']':
+                # A mismatched bracket, or a balanced candidate that didn't
+                # decode above: give up on it and look past it
+                if not stack or CLOSING_BRACKETS[stack.pop()] != token or not stack:
+                    position = index + 1
+                    break
+                opened_at.pop()
+                cut, cut_depth = index + 1, len(stack)
+            elif token == ',':
+                cut, cut_depth = index, len(stack)
+            elif token == '"':
+                # Unterminated string: the response was cut off
+                break
+        if position is not None:
+            continue
+        
+        # Ran out of text inside the object: keep the complete members of the
+        # outermost open object that can be closed; brackets opened after the
+        # last cut are still on top of the stack, so the first cut_depth are
+        # the ones open at the cut
+        if cut is None:
+            raise ValueError("No valid JSON found in response")
+        for depth in range(cut_depth):
+            if stack[depth] != '{':
+                continue
+            # A candidate whose text up to the cut is already invalid can't be saved
+            try:
+                return JSON_DECODER.raw_decode(text, opened_at[depth])[0]
+            except json.JSONDecodeError as e:
+                if e.pos < cut:
+                    continue
+            except RecursionError:
+                continue
+            closing = ''.join(CLOSING_BRACKETS[bracket] for bracket in reversed(stack[depth:cut_depth]))
+            try:
+                return json.loads(text[opened_at[depth]:cut] + closing)
+            except (ValueError, RecursionError):
+                pass
+        raise ValueError("No valid JSON found in response")
+
+def parse_card_response(response_text, required_keys=REQUIRED_CARD_KEYS):
+    """Extract the card JSON from a model response, checking the required keys"""
+    with trace_span('extraction', characters=len(response_text)):
+        content = extract_json_object(response_text)
+    with trace_span('validation'):
+        if not isinstance(content, dict) or not all(key in content for key in required_keys):
+            raise ValueError("Missing required keys in response")
+    return content
+
+# Rule-based checks every generated card passes before it is cached and shared;
+# failing fields are regenerated on their own rather than the whole card
+CARD_REPAIR_ATTEMPTS = 2
+CYRILLIC_LETTER = re.compile(r'[а-яё]', re.I)
+LATIN_LETTER = re.compile(r'[a-z]', re.I)
+# An uppercase vowel inside a lowercase word, the other way models mark stress
+CAPITAL_STRESS = re.compile(r'[а-яё][АЕЁИОУЫЭЮЯ]')
+NOUN_GENDERS = ('masculine', 'feminine', 'neuter', 'common', 'plural')
+RUSSIAN_TEXT_FIELDS = ['formal_sentence', 'informal_sentence', 'question', 'answer']
+CARD_TRANSLATION_FIELDS = {f"{field}_english" for field in RUSSIAN_TEXT_FIELDS}
+GRAMMAR_TABLE_FIELDS = {'cases', 'plural_forms', 'verb_conjugation', 'mood'}
+# Optional on most cards, so an empty value is not a problem
+OPTIONAL_CARD_FIELDS = {'perfective_partner', 'imperfective_partner', 'regional_variations'}
+HEADWORD_FIELDS = ['russian_word', 'lemma', 'pronunciation_stress', 'part_of_speech', 'gender', 'animacy', 'aspect']
+
+def _headword(text):
+    """The Russian word itself, without the pronunciation in parentheses"""
+    return text.split('(')[0].strip()
+
+def _is_blank(value):
+    if isinstance(value, str):
+        return not value.strip()
+    if isinstance(value, (dict, list)):
+        return not value or any(_is_blank(item) for item in (value.values() if isinstance(value, dict) else value))
+    return value is None
+
+def _needs_stress_mark(text):
+    """Whether any word in the text has more than one syllable"""
+    return any(_count_vowels(word) > 1 for word in strip_stress(text).lower().split())
+
+def check_card_quality(content):
+    """Return {field: problem} for a card's content; empty when it is fit to share"""
+    problems = {}
+    for field, value in content.items():
+        if field not in GRAMMAR_TABLE_FIELDS and field not in OPTIONAL_CARD_FIELDS and _is_blank(value):
+            problems[field] = 'is empty'
+    
+    for field in ('russian_word', 'lemma'):
+        headword = _headword(content.get(field) or '')
+        if field not in problems and field in content:
+            if LATIN_LETTER.search(headword) or not CYRILLIC_LETTER.search(headword):
+                problems[field] = f"'{headword}' is not written in Cyrillic"
+    for field in RUSSIAN_TEXT_FIELDS:
+        if field not in problems and not CYRILLIC_LETTER.search(content.get(field) or ''):
+            problems[field] = 'has no Russian text'
+    
+    stress = content.get('pronunciation_stress') or ''
+    if 'pronunciation_stress' not in problems and _needs_stress_mark(_headword(content.get('russian_word') or stress)):
+        if STRESS_MARK not in stress and 'ё' not in stress.lower() and not CAPITAL_STRESS.search(stress):
+            problems['pronunciation_stress'] = 'has no stress mark'
+    
+    part_of_speech = (content.get('part_of_speech') or '').lower()
+    gender = (content.get('gender') or '').lower()
+    if 'noun' in part_of_speech and 'pronoun' not in part_of_speech:
+        if not gender.startswith(NOUN_GENDERS):
+            problems['gender'] = f"'{gender}' is not a gender, but the word is a noun"
+        cases = content.get('cases') or {}
+        forms = [str(cases.get(case) or '').strip().lower() for case in CASE_NAMES]
+        if not any(form and form != 'not applicable' for form in forms):
+            problems['cases'] = 'has no case forms, but the word is a noun'
+    elif 'verb' in part_of_speech and 'adverb' not in part_of_speech:
+        if gender.startswith(NOUN_GENDERS[:3]):
+            problems['gender'] = f"is '{gender}', but verbs have no gender"
+        aspect = (content.get('aspect') or (content.get('verb_conjugation') or {}).get('aspect') or '').lower()
+        if aspect and not aspect.startswith(('perfective', 'imperfective', 'both')):
+            problems['aspect'] = f"'{aspect}' is not a verb aspect"
+        conjugation = content.get('verb_conjugation') or {}
+        if not conjugation.get('past') or not (conjugation.get('present') or conjugation.get('future')):
+            problems['verb_conjugation'] = 'has no conjugated forms, but the word is a verb'
+    return problems
+
+def card_repair_fields(problems):
+    """Fields to regenerate for a set of problems, with the fields they have to agree with"""
+    fields = []
+    for field in problems:
+        if field in HEADWORD_FIELDS or (LOCAL_MORPHOLOGY and field in GRAMMAR_TABLE_FIELDS):
+            # Locally built tables are only as good as the headword they come from
+            group = HEADWORD_FIELDS
+        elif f"{field}_english" in CARD_TRANSLATION_FIELDS:
+            group = [field, f"{field}_english"]
+        else:
+            group = [field]
+        fields.extend(name for name in group if name not in fields)
+    return fields
+
+class CardQualityStats:
+    """How many generated cards failed the quality checks, on which fields, and how many were repaired"""
+    
+    def __init__(self):
+        self.checked = 0
+        self.rejected = 0
+        self.repaired = 0
+        self.fields = Counter()
+        self._lock = threading.Lock()
+    
+    def record(self, problems, repaired=False):
+        with self._lock:
+            self.checked += 1
+            if problems:
+                self.rejected += 1
+                self.repaired += repaired
+                self.fields.update(list(problems))
+
+@st.cache_resource
+def get_card_quality_stats():
+    """Shared card quality counters"""
+    return CardQualityStats()
+
+def repair_card(content, problems, english_word, section, subsection, user, backend, lane):
+    """Regenerate only the failing fields of a card until it passes, raising ValueError if it never does"""
+    stats = get_card_quality_stats()
+    first_problems = problems
+    scheduler = get_generation_scheduler()
+    for attempt in range(CARD_REPAIR_ATTEMPTS):
+        fields = card_repair_fields(problems)
+        shown = {field: value for field, value in content.items() if field not in GRAMMAR_TABLE_FIELDS}
+        listed = '\n    '.join(f"- {field}: {problem}" for field, problem in problems.items())
+        prompt = f"""
+    You wrote this JSON card for the English word "{english_word}" ("{section}" section, "{subsection}" subsection):
+    {json.dumps(shown, ensure_ascii=False)}
+    
+    These fields failed checks:
+    {listed}
+    
+    Reply with ONLY a JSON object with corrected values for these keys: {', '.join(fields)}.
+    Russian text must be in Cyrillic, and pronunciation_stress must mark the stressed vowel (е́, а́, etc.).
+    """
+        if not scheduler.acquire_request(lane):
+            raise ModelUnavailableError("No quota headroom left to repair the card")
+        try:
+            with trace_span('card repair', attempt=attempt + 1, fields=len(fields), backend=backend.name):
+                response = backend.generate(prompt)
+        except Exception as e:
+            # An open circuit breaker or a spent quota means no retry can succeed now
+            if isinstance(e, ModelUnavailableError) or is_quota_error(e):
+                raise ModelUnavailableError(str(e))
+            raise ValueError(f"Card repair failed: {e}")
+        record_model_usage(backend, response, user, section, subsection)
+        try:
+            repaired = extract_json_object(response.text)
+        except ValueError:
+            continue
+        if not isinstance(repaired, dict):
+            continue
+        content.update((field, repaired[field]) for field in fields if field in repaired)
+        if LOCAL_MORPHOLOGY:
+            apply_local_morphology(content)
+        problems = check_card_quality(content)
+        if not problems:
+            stats.record(first_problems, repaired=True)
+            return content
+    stats.record(first_problems)
+    raise ValueError("Card failed quality checks: " + '; '.join(f"{field} {problem}" for field, problem in problems.items()))
+
+# Raw responses are appended here when RESPONSE_CORPUS_PATH is set, building
+# the corpus that `python benchmarks.py responses` measures the extractor on
+class ResponseRecorder:
+    """Appends raw model responses to a JSONL file"""
+    
+    def __init__(self, path):
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+    
+    def record(self, english_word, section, subsection, text):
+        line = json.dumps({'english_word': english_word, 'section': section, 'subsection': subsection,
+                           'text': text}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+
+@st.cache_resource
+def get_response_recorder():
+    """Shared response recorder, or None when recording is disabled"""
+    path = get_secret("RESPONSE_CORPUS_PATH")
+    return ResponseRecorder(path) if path else None
+
+def is_quota_error(error):
+    """Whether a model error means the quota is used up, so retrying now is pointless"""
+    return '429' in str(error) or 'quota' in str(error).lower() or type(error).__name__ == 'ResourceExhausted'
+
+# Prompt templates: the card prompt is assembled from sections that each
+# produce a known set of card fields. Bump a section's version whenever its
+# text changes; cards record the versions they were generated from, and the
+# prompt migration regenerates just the fields of outdated sections. Cards
+# from before versioning count as version 1 of the sections whose fields they
+# have and version 0 of those added since, such as the lemma section.
+class PromptSection:
+    """One versioned part of the card prompt and the card fields it produces"""
     
-    Please provide ONLY a valid JSON response with this exact structure:
-    {{
+    def __init__(self, name, version, fields, structure, instructions=(), local_morphology=None):
+        self.name = name
+        self.version = version
+        self.fields = fields
+        self.structure = structure
+        self.instructions = list(instructions)
+        # True or False limits the section to prompts with or without local morphology
+        self.local_morphology = local_morphology
+
+PROMPT_SECTIONS = [
+    PromptSection('headword', 1, ['russian_word', 'part_of_speech', 'gender', 'pronunciation_stress', 'etymology'], """
         "russian_word": "Russian translation with pronunciation in parentheses",
         "part_of_speech": "noun/verb/adjective/adverb/etc.",
         "gender": "masculine/feminine/neuter/not applicable",
         "pronunciation_stress": "Word with stress mark (е́, а́, etc.) and phonetic guide",
-        "etymology": "Brief origin/etymology of the word",
-        
+        "etymology": "Brief origin/etymology of the word"
+    """),
+    PromptSection('examples', 1, [
+        'formal_sentence', 'formal_sentence_english', 'formal_pos', 'formal_grammar',
+        'informal_sentence', 'informal_sentence_english', 'informal_pos', 'informal_grammar',
+        'question', 'question_english', 'question_pos', 'question_grammar',
+        'answer', 'answer_english', 'answer_pos', 'answer_grammar'], """
         "formal_sentence": "A formal sentence using this word in Russian context",
         "formal_sentence_english": "English translation of the formal sentence",
         "formal_pos": "Part of speech used in formal sentence",
@@ -537,180 +4261,369 @@ def get_enhanced_russian_content(english_word, section, subsection):
         "answer": "An appropriate answer to that question in Russian",
         "answer_english": "English translation of the answer",
         "answer_pos": "Part of speech used in answer",
-        "answer_grammar": "Grammatical form used (case, number, tense, etc.)",
-        
-        "cases": {{
+        "answer_grammar": "Grammatical form used (case, number, tense, etc.)"
+    """),
+    # Declension and conjugation tables come from the local morphology engine
+    PromptSection('lemma', 1, ['lemma', 'animacy', 'aspect', 'perfective_partner', 'imperfective_partner'], """
+        "lemma": "Dictionary form in Cyrillic, without stress marks or pronunciation",
+        "animacy": "animate/inanimate",
+        "aspect": "perfective/imperfective/both/not applicable",
+        "perfective_partner": "perfective form if imperfective verb",
+        "imperfective_partner": "imperfective form if perfective verb"
+    """,
+        ["Do not include case, plural or conjugation tables; they are generated separately"], local_morphology=True),
+    PromptSection('grammar_tables', 1, ['cases', 'verb_conjugation', 'mood', 'plural_forms'], """
+        "cases": {
             "nominative": "Russian form with example sentence and English translation",
             "accusative": "Russian form with example sentence and English translation",
             "genitive": "Russian form with example sentence and English translation",
             "dative": "Russian form with example sentence and English translation",
             "instrumental": "Russian form with example sentence and English translation",
             "prepositional": "Russian form with example sentence and English translation"
-        }},
+        },
         
-        "verb_conjugation": {{
+        "verb_conjugation": {
             "infinitive": "Infinitive form if verb",
-            "present": {{
+            "present": {
                 "я": "я form",
                 "ты": "ты form",
                 "он_она": "он/она form",
                 "мы": "мы form",
                 "вы": "вы form",
                 "они": "они form"
-            }},
-            "past": {{
+            },
+            "past": {
                 "masculine": "past masculine form",
                 "feminine": "past feminine form",
                 "neuter": "past neuter form",
                 "plural": "past plural form"
-            }},
-            "future": {{
+            },
+            "future": {
                 "я": "я future form",
                 "ты": "ты future form",
                 "он_она": "он/она future form",
                 "мы": "мы future form",
                 "вы": "вы future form",
                 "они": "они future form"
-            }},
+            },
             "aspect": "perfective/imperfective/both",
             "perfective_partner": "perfective form if imperfective",
             "imperfective_partner": "imperfective form if perfective"
-        }},
+        },
         
-        "mood": {{
+        "mood": {
             "imperative": "Command form (делай! делайте!)",
             "conditional": "Conditional form (would do)"
-        }},
+        },
         
-        "plural_forms": {{
+        "plural_forms": {
             "nominative_plural": "Plural nominative form with English explanation",
             "genitive_plural": "Plural genitive form with English explanation",
             "other_plurals": "Other important plural forms with English explanations"
-        }},
-        
-        "prefixes_suffixes": {{
+        }""",
+        ["For each case declension, provide the Russian form AND a short example with English translation",
+         "For plural forms, include English explanations of usage"], local_morphology=False),
+    PromptSection('word_formation', 1, ['prefixes_suffixes'], """
+        "prefixes_suffixes": {
             "common_prefixes": "Common prefixes that change meaning with examples",
             "common_suffixes": "Common suffixes that change meaning with examples",
             "related_words": "Words formed with prefixes/suffixes with English translations"
-        }},
-        
-        "negation": {{
+        }"""),
+    PromptSection('negation', 1, ['negation'], """
+        "negation": {
             "negative_form": "How word behaves in negative sentences with English explanation",
             "negative_example": "Example of word in negative sentence",
             "negative_example_english": "English translation of negative example"
-        }},
-        
+        }""", ["For negative examples, always include English translations"]),
+    PromptSection('collocations', 1, ['common_collocations'], """
         "common_collocations": [
             "Common phrase 1 with this word (with English translation)",
             "Common phrase 2 with this word (with English translation)",
             "Common phrase 3 with this word (with English translation)"
-        ],
-        
+        ]""", ["For collocations, include English translations in parentheses"]),
+    PromptSection('usage', 1, ['regional_variations', 'difficulty_level'], """
         "regional_variations": "Any regional differences in usage",
         "difficulty_level": "beginner/intermediate/advanced"
+    """)
+]
+PROMPT_INTRODUCTION = ("You are a Russian language expert helping MBBS students learn medical and general "
+                       "Russian vocabulary with comprehensive grammatical analysis.")
+PROMPT_GENERAL_INSTRUCTIONS = ["Make all examples relevant to MBBS students in Russia",
+                               "Focus on practical, medical-relevant usage"]
+
+def active_prompt_sections(names=None):
+    """Prompt sections in use with the current morphology setting, optionally only the named ones"""
+    return [section for section in PROMPT_SECTIONS
+            if section.local_morphology in (None, LOCAL_MORPHOLOGY) and (names is None or section.name in names)]
+
+def prompt_versions():
+    """{section name: version} of the prompt new cards are generated from"""
+    return {section.name: section.version for section in active_prompt_sections()}
+
+def stale_prompt_sections(card):
+    """Names of the prompt sections a cached card was generated from an older version of"""
+    versions = card.get('prompt_versions') or {}
+    stale = []
+    for section in active_prompt_sections():
+        version = versions.get(section.name)
+        if version is None:
+            # Only unstamped sections need their fields looked at, which decodes them
+            version = 1 if all(field in card for field in section.fields) else 0
+        if version < section.version:
+            stale.append(section.name)
+    return stale
+
+def render_prompt_sections(sections, indent=''):
+    """The JSON structure and IMPORTANT list for a set of prompt sections"""
+    structure = ',\n        \n'.join(section.structure.lstrip('\n').rstrip() for section in sections)
+    instructions = [line for section in sections for line in section.instructions] + PROMPT_GENERAL_INSTRUCTIONS
+    structure = '\n'.join(indent + line if line.strip() else line for line in structure.split('\n'))
+    return structure, '\n    '.join(f"- {line}" for line in instructions)
+
+def build_card_prompt(english_word, section, subsection, section_names=None):
+    """The card prompt for a word, for all prompt sections or only the named ones"""
+    structure, instructions = render_prompt_sections(active_prompt_sections(section_names))
+    return f"""
+    {PROMPT_INTRODUCTION}
+    
+    Context: This is for the "{section}" section, specifically "{subsection}" subsection.
+    English word: "{english_word}"
+    
+    Please provide ONLY a valid JSON response with this exact structure:
+    {{
+{structure}
     }}
     
     IMPORTANT: 
-    1. For each case declension, provide the Russian form AND a short example with English translation
-    2. For plural forms, include English explanations of usage
-    3. For negative examples, always include English translations
-    4. For collocations, include English translations in parentheses
-    5. Make all examples relevant to MBBS students in Russia
-    6. Focus on practical, medical-relevant usage
+    {instructions}
     """
-    
-    # Use the same error handling as the original function
-    # but with enhanced prompt for better English translations
-    try:
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        # Same JSON parsing logic as original...
-        if response_text.startswith('```'):
-            lines = response_text.split('\n')
-            json_lines = []
-            in_json = False
-            for line in lines:
-                if line.strip().startswith('{') or in_json:
-                    in_json = True
-                    json_lines.append(line)
-                    if line.strip().endswith('}') and line.count('}') >= line.count('{'):
-                        break
-            response_text = '\n'.join(json_lines)
-        
-        start_idx = response_text.find('{')
-        end_idx = response_text.rfind('}') + 1
-        
-        if start_idx != -1 and end_idx != 0:
-            json_text = response_text[start_idx:end_idx]
-            content = json.loads(json_text)
-            
-            required_keys = ["russian_word", "part_of_speech", "formal_sentence", "informal_sentence", "question", "answer"]
-            if all(key in content for key in required_keys):
-                return content
-            else:
-                raise ValueError("Missing required keys in response")
-        else:
-            raise ValueError("No valid JSON found in response")
-            
-    except Exception as e:
-        st.error(f"Error generating enhanced content: {str(e)}")
-        # Return the same fallback as original function
-        return get_enhanced_russian_content(english_word, section, subsection)
 
-def create_theme_toggle():
-    """Create the theme toggle component"""
-    toggle_html = f"""
-    <style>
-    .theme-toggle-container {{
-        display: flex;
-        justify-content: center;
-        padding: 10px 0;
-        margin-bottom: 20px;
-    }}
+def build_field_prompt(cards, section_names):
+    """A prompt asking for only some prompt sections' fields of several existing cards"""
+    structure, instructions = render_prompt_sections(active_prompt_sections(section_names), indent='    ')
+    listed = '\n    '.join(
+        f"{number}. English word: \"{card['english_word']}\" (\"{card['section']}\" section, "
+        f"\"{card['subsection']}\" subsection); Russian: {card.get('russian_word', 'unknown')}, "
+        f"{card.get('part_of_speech', 'unknown part of speech')}"
+        for number, card in enumerate(cards, 1)
+    )
+    return f"""
+    {PROMPT_INTRODUCTION}
     
-    .toggle {{
-        width: 38px;
-        height: 38px;
-        border-radius: 8px;
-        display: grid;
-        place-items: center;
-        cursor: pointer;
-        line-height: 1;
-        background-color: {'#1e1e1e' if st.session_state.get('dark_mode', False) else '#f0f2f6'};
-        border: 2px solid {'#333' if st.session_state.get('dark_mode', False) else '#e1e5e9'};
-        transition: all 0.3s ease;
-    }}
+    Part of each of these existing vocabulary cards has to be rewritten:
+    {listed}
     
-    .toggle:hover {{
-        transform: scale(1.05);
-        box-shadow: 0 4px 12px rgba(0,0,0,0.15);
+    Please provide ONLY a valid JSON response that maps each card's number to an object with this exact structure:
+    {{
+        "1": {{
+{structure}
+        }}
     }}
     
-    .input {{
-        display: none;
-    }}
+    IMPORTANT: 
+    {instructions}
+    """
+
+def fill_card_sections(content, backend, section_names, english_word, section, subsection, user, lane):
+    """Fill some prompt sections of a card from another backend, trying the next best ones if it fails"""
+    card = {'english_word': english_word, 'section': section, 'subsection': subsection, **content}
+    prompt = build_field_prompt([card], section_names)
+    fields = [field for prompt_section in active_prompt_sections(section_names) for field in prompt_section.fields]
+    alternatives = [candidate for candidate in get_backend_router().candidates(section_names, lane) if candidate is not backend]
+    scheduler = get_generation_scheduler()
+    for candidate in [backend] + alternatives:
+        if not scheduler.acquire_request(lane):
+            raise ModelUnavailableError(f"No quota headroom left to fill {', '.join(section_names)}")
+        try:
+            with trace_span('section fill', backend=candidate.name, sections=len(section_names)):
+                response = candidate.generate(prompt)
+        except Exception:
+            continue
+        record_model_usage(candidate, response, user, section, subsection)
+        try:
+            result = extract_json_object(response.text)
+        except ValueError:
+            result = None
+        result = result.get('1') if isinstance(result, dict) else None
+        if isinstance(result, dict) and all(field in result for field in fields):
+            content.update((field, result[field]) for field in fields)
+            return content
+        # Unlike the main request, unusable output here counts against the
+        # backend's health so routing moves these sections elsewhere
+        candidate.breaker.record_failure(f"{candidate.name} returned unusable {', '.join(section_names)}")
+    raise ValueError(f"No backend could fill {', '.join(section_names)}")
+
+def get_enhanced_russian_content(english_word, section, subsection, user=None):
+    """Enhanced version that requests English translations for grammatical forms"""
+    router = get_backend_router()
+    scheduler = get_generation_scheduler()
+    lane = scheduler.current_lane()
+    section_names = [prompt_section.name for prompt_section in active_prompt_sections()]
     
-    .icon {{
-        grid-column: 1 / 1;
-        grid-row: 1 / 1;
-        transition: transform 500ms;
-        line-height: 0.1;
-    }}
+    # Retries are bounded; upstream errors feed each backend's circuit breaker,
+    # which moves its sections elsewhere or, with nowhere left, switches the
+    # app to cache-only mode instead of retrying forever
+    last_error = None
+    for attempt in range(MODEL_MAX_ATTEMPTS):
+        prompt_started = time.monotonic()
+        (backend, primary_sections), *other_groups = router.plan(section_names, lane)
+        prompt = build_card_prompt(english_word, section, subsection, primary_sections)
+        primary_fields = {field for prompt_section in active_prompt_sections(primary_sections) for field in prompt_section.fields}
+        required_keys = [key for key in REQUIRED_CARD_KEYS if key in primary_fields]
+        record_span('prompt build', prompt_started, characters=len(prompt), backend=backend.name)
+        # Every upstream call, retries included, is charged to the shared quota
+        if not scheduler.acquire_request(lane):
+            last_error = ModelUnavailableError("No quota headroom left for background generation")
+            break
+        try:
+            # Only requests a student is waiting on are worth a hedge's extra cost
+            if is_hedging_enabled() and backend.remote and lane == LANE_INTERACTIVE:
+                content, _ = hedged_card_request(backend, prompt, required_keys, english_word, section, subsection,
+                                                 user, attempt + 1)
+            else:
+                content, _ = request_card_content(backend, prompt, required_keys, english_word, section, subsection,
+                                                  user, attempt + 1)
+        except ModelUnavailableError as e:
+            last_error = e
+            continue
+        except Exception as e:
+            last_error = ModelUnavailableError(str(e))
+            if is_quota_error(e):
+                break
+            if attempt + 1 < MODEL_MAX_ATTEMPTS:
+                with trace_span('retry backoff'):
+                    time.sleep(MODEL_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+            continue
+        
+        # Malformed output is retried without counting against the upstream
+        try:
+            if isinstance(content, ValueError):
+                raise content
+            for group_backend, group_sections in other_groups:
+                fill_card_sections(content, group_backend, group_sections, english_word, section, subsection, user, lane)
+            if LOCAL_MORPHOLOGY:
+                with trace_span('morphology'):
+                    apply_local_morphology(content)
+            with trace_span('quality check') as span:
+                problems = check_card_quality(content)
+                span['problems'] = len(problems)
+            if problems:
+                content = repair_card(content, problems, english_word, section, subsection, user, backend, lane)
+                content['prompt_versions'] = prompt_versions()
+                return content
+            get_card_quality_stats().record(problems)
+            content['prompt_versions'] = prompt_versions()
+            return content
+        except ValueError as e:
+            last_error = e
     
-    .icon--moon {{
-        transition-delay: 200ms;
-        color: #b4b4b4;
-        transform: {'rotate(360deg) scale(0)' if st.session_state.get('dark_mode', False) else 'scale(1)'};
-    }}
+    raise last_error
+
+# Cards per model request when the prompt migration regenerates outdated fields
+PROMPT_MIGRATION_BATCH_SIZE = 5
+
+class PromptMigration:
+    """Regenerates the outdated fields of cached cards, a batch per model request, in the warmup lane"""
     
-    .icon--sun {{
-        color: #ffa500;
-        transform: {'scale(1) rotate(360deg)' if st.session_state.get('dark_mode', False) else 'scale(0)'};
-        transition-delay: {'200ms' if st.session_state.get('dark_mode', False) else '0ms'};
-    }}
-    </style>
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.scanned = 0
+        self.stale = Counter()
+        self.queued = 0
+        self.migrated = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+    
+    def scan(self):
+        """Group outdated cached cards by subsection and outdated sections"""
+        groups = {}
+        scanned = 0
+        stale = Counter()
+        for card_key, card in get_card_cache().cards():
+            scanned += 1
+            sections = tuple(stale_prompt_sections(card))
+            if sections:
+                stale.update(sections)
+                _, section, subsection = parse_card_key(card_key)
+                groups.setdefault((section, subsection, sections), []).append(card_key)
+        with self._lock:
+            self.scanned = scanned
+            self.stale = stale
+        return groups
     
+    def start(self):
+        """Queue every outdated card for regeneration, returning the number of batches queued"""
+        scheduler = get_generation_scheduler()
+        queued = 0
+        for (section, subsection, sections), card_keys in self.scan().items():
+            for start in range(0, len(card_keys), self.batch_size):
+                batch = card_keys[start:start + self.batch_size]
+                # Keyed by the first card so a second scan doesn't queue the same batch again
+                scheduler.submit(LANE_WARMUP, f"migration|{batch[0]}", self.run_batch, batch, sections, tag='migration')
+                queued += 1
+        with self._lock:
+            self.queued += queued
+        return queued
+    
+    def run_batch(self, card_keys, section_names):
+        """Regenerate the given sections' fields of some cards from one subsection with a single request"""
+        cache = get_card_cache()
+        stored = {card_key: cache.get(card_key) for card_key in card_keys}
+        cards = [(card_key, card.to_dict()) for card_key, card in stored.items() if card is not None]
+        if not cards:
+            return 0
+        _, section, subsection = parse_card_key(cards[0][0])
+        prompt = build_field_prompt([card for _, card in cards], section_names)
+        
+        router = get_backend_router()
+        candidates = router.candidates(section_names, LANE_WARMUP)
+        try:
+            if not candidates:
+                raise ModelUnavailableError(router.unavailable_reason())
+            if not get_generation_scheduler().acquire_request(LANE_WARMUP):
+                raise ModelUnavailableError("No quota headroom left for the migration")
+            response = candidates[0].generate(prompt)
+        except Exception as e:
+            with self._lock:
+                self.failed += len(cards)
+            raise ModelUnavailableError(str(e))
+        record_model_usage(candidates[0], response, None, section, subsection)
+        
+        try:
+            results = extract_json_object(response.text)
+        except ValueError:
+            results = {}
+        sections = active_prompt_sections(section_names)
+        fields = [field for prompt_section in sections for field in prompt_section.fields]
+        migrated = 0
+        for number, (card_key, card) in enumerate(cards, 1):
+            update = results.get(str(number)) if isinstance(results, dict) else None
+            if not isinstance(update, dict) or any(field not in update for field in fields):
+                continue
+            updated = {**card, **{field: update[field] for field in fields}}
+            if LOCAL_MORPHOLOGY and {'headword', 'lemma'} & set(section_names):
+                apply_local_morphology(updated)
+            # A card that got worse keeps its old fields and stays outdated
+            if check_card_quality(updated):
+                continue
+            updated['prompt_versions'] = {**card.get('prompt_versions', {}),
+                                          **{prompt_section.name: prompt_section.version for prompt_section in sections}}
+            # A card regenerated for a student while the batch ran is newer; keep it
+            if cache.put(card_key, updated, replaces=stored[card_key]):
+                migrated += 1
+        with self._lock:
+            self.migrated += migrated
+            self.failed += len(cards) - migrated
+        return migrated
+
+@st.cache_resource
+def get_prompt_migration():
+    """Shared prompt migration runner"""
+    return PromptMigration(PROMPT_MIGRATION_BATCH_SIZE)
+
+def create_theme_toggle():
+    """Create the theme toggle component"""
+    toggle_html = f"""
     <div class="theme-toggle-container">
         <div class="toggle" id="theme-toggle" onclick="toggleTheme()">
             <div class="icon icon--moon">
@@ -786,387 +4699,60 @@ def create_theme_toggle():
     
     return toggle_html
 
+# Stylesheets are built once from styles/ into minified, content-hashed files
+# under static/, so a rerun only sends a one-line @import the browser has cached
+STYLES_DIR = 'styles'
+THEME_STYLESHEETS = {
+    'light': ['base.css', 'light.css'],
+    'dark': ['base.css', 'dark.css']
+}
+
+def minify_css(css):
+    """Strip comments and redundant whitespace from a stylesheet"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+@st.cache_resource
+def build_theme_stylesheets():
+    """Compile each theme's stylesheet into the static directory once, returning their URLs"""
+    os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+    urls = {}
+    for theme, sources in THEME_STYLESHEETS.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(STYLES_DIR, source), 'r', encoding='utf-8') as file:
+                parts.append(file.read())
+        css = minify_css('\n'.join(parts))
+        
+        filename = f"theme-{theme}-{zlib.crc32(css.encode('utf-8')):08x}.css"
+        path = os.path.join(ASSET_CACHE_DIR, filename)
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(css)
+        
+        # Drop stylesheets compiled from earlier versions of this theme's sources
+        for stale in os.listdir(ASSET_CACHE_DIR):
+            if stale.startswith(f"theme-{theme}-") and stale.endswith('.css') and stale != filename:
+                try:
+                    os.remove(os.path.join(ASSET_CACHE_DIR, stale))
+                except OSError:
+                    pass
+        urls[theme] = f"{STATIC_URL}/{os.path.relpath(path, STATIC_DIR).replace(os.sep, '/')}"
+    return urls
+
 def apply_theme():
     """Apply dark or light theme based on session state"""
     if 'dark_mode' not in st.session_state:
         st.session_state.dark_mode = False
     
-    if st.session_state.dark_mode:
-        # Dark mode styles (unchanged)
-        st.markdown("""
-        <style>
-        /* Dark Mode Styles */
-        .stApp {
-            background-color: #0e1117 !important;
-            color: #fafafa !important;
-        }
-        
-        /* SIDEBAR - More specific selectors */
-        .css-1d391kg, .css-1lcbmhc, .css-17eq0hr, section[data-testid="stSidebar"] {
-            background-color: #262730 !important;
-        }
-        
-        .css-1d391kg .stMarkdown, 
-        .css-1lcbmhc .stMarkdown,
-        section[data-testid="stSidebar"] .stMarkdown,
-        section[data-testid="stSidebar"] .element-container {
-            color: #fafafa !important;
-            background-color: transparent !important;
-        }
-        
-        /* Sidebar headers - all levels */
-        section[data-testid="stSidebar"] h1,
-        section[data-testid="stSidebar"] h2, 
-        section[data-testid="stSidebar"] h3,
-        section[data-testid="stSidebar"] h4,
-        section[data-testid="stSidebar"] h5,
-        section[data-testid="stSidebar"] h6,
-        section[data-testid="stSidebar"] .stMarkdown h1,
-        section[data-testid="stSidebar"] .stMarkdown h2, 
-        section[data-testid="stSidebar"] .stMarkdown h3,
-        section[data-testid="stSidebar"] .stMarkdown h4,
-        section[data-testid="stSidebar"] .stMarkdown h5,
-        section[data-testid="stSidebar"] .stMarkdown h6 {
-            color: #fafafa !important;
-        }
-        
-        /* Sidebar text elements */
-        section[data-testid="stSidebar"] p,
-        section[data-testid="stSidebar"] .stMarkdown p,
-        section[data-testid="stSidebar"] strong,
-        section[data-testid="stSidebar"] .stMarkdown strong,
-        section[data-testid="stSidebar"] span,
-        section[data-testid="stSidebar"] div,
-        section[data-testid="stSidebar"] label {
-            color: #fafafa !important;
-        }
-        
-        /* Sidebar buttons */
-        section[data-testid="stSidebar"] .stButton > button {
-            background-color: #ff6b6b !important;
-            color: white !important;
-            border: none !important;
-        }
-        
-        section[data-testid="stSidebar"] .stButton > button[kind="primary"] {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-            color: white !important;
-        }
-        
-        section[data-testid="stSidebar"] .stButton > button[kind="secondary"] {
-            background-color: #1e1e1e !important;
-            color: #fafafa !important;
-            border: 1px solid #333 !important;
-        }
-        
-        /* More aggressive targeting for all secondary buttons in sidebar */
-        section[data-testid="stSidebar"] button[kind="secondary"],
-        section[data-testid="stSidebar"] .stButton button[kind="secondary"],
-        section[data-testid="stSidebar"] .element-container button[kind="secondary"],
-        section[data-testid="stSidebar"] div[data-testid="column"] button[kind="secondary"] {
-            background-color: #1e1e1e !important;
-            color: #fafafa !important;
-            border: 1px solid #333 !important;
-        }
-        
-        /* Target all buttons that might be in the sidebar columns */
-        section[data-testid="stSidebar"] .stButton button,
-        section[data-testid="stSidebar"] button {
-            background-color: #1e1e1e !important;
-            color: #fafafa !important;
-            border: 1px solid #333 !important;
-        }
-        
-        /* Override for primary buttons */
-        section[data-testid="stSidebar"] .stButton button[kind="primary"],
-        section[data-testid="stSidebar"] button[kind="primary"] {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-            color: white !important;
-        }
-        
-        /* Sidebar inputs */
-        section[data-testid="stSidebar"] .stTextInput input,
-        section[data-testid="stSidebar"] .stSelectbox select,
-        section[data-testid="stSidebar"] .stNumberInput input {
-            background-color: #1e1e1e !important;
-            color: #fafafa !important;
-            border: 1px solid #333 !important;
-        }
-        
-        /* Sidebar widget labels */
-        section[data-testid="stSidebar"] .stTextInput label,
-        section[data-testid="stSidebar"] .stSelectbox label,
-        section[data-testid="stSidebar"] .stNumberInput label,
-        section[data-testid="stSidebar"] .stSlider label {
-            color: #fafafa !important;
-        }
-        
-        /* Main content area */
-        .main .block-container {
-            background-color: #0e1117;
-            color: #fafafa;
-        }
-        
-        /* Cards and containers */
-        div[data-testid="stContainer"] {
-            background-color: #1e1e1e;
-            border: 1px solid #333;
-            border-radius: 10px;
-            padding: 20px;
-            margin: 10px 0;
-        }
-        
-        /* Metrics */
-        div[data-testid="metric-container"] {
-            background-color: #1e1e1e;
-            border: 1px solid #333;
-            border-radius: 8px;
-            padding: 15px;
-        }
-        
-        div[data-testid="metric-container"] > div {
-            color: #fafafa !important;
-        }
-        
-        /* Buttons */
-        .stButton > button {
-            background-color: #ff6b6b;
-            color: white;
-            border: none;
-            border-radius: 8px;
-            transition: all 0.3s ease;
-        }
-        
-        .stButton > button:hover {
-            background-color: #ff5252;
-            transform: translateY(-2px);
-            box-shadow: 0 4px 8px rgba(255, 107, 107, 0.3);
-        }
-        
-        /* Primary button */
-        .stButton > button[kind="primary"] {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        }
-        
-        .stButton > button[kind="primary"]:hover {
-            background: linear-gradient(135deg, #5a6fd8 0%, #6a4190 100%);
-        }
-        
-        /* Expanders */
-        .streamlit-expanderHeader {
-            background-color: #1e1e1e !important;
-            color: #fafafa !important;
-            border: 1px solid #333;
-        }
-        
-        .streamlit-expanderContent {
-            background-color: #262730 !important;
-            border: 1px solid #333;
-        }
-        
-        /* Progress bars */
-        .stProgress > div > div > div {
-            background: linear-gradient(90deg, #ff6b6b, #4ecdc4);
-        }
-        
-        /* Text inputs and selectboxes */
-        .stTextInput > div > div > input,
-        .stSelectbox > div > div > select {
-            background-color: #1e1e1e !important;
-            color: #fafafa !important;
-            border: 1px solid #333 !important;
-        }
-        
-        /* Success/Info/Error messages */
-        .stSuccess {
-            background-color: #1e3a1e !important;
-            border: 1px solid #4caf50 !important;
-            color: #fafafa !important;
-        }
-        
-        .stInfo {
-            background-color: #1e2a3a !important;
-            border: 1px solid #2196f3 !important;
-            color: #fafafa !important;
-        }
-        
-        .stError {
-            background-color: #3a1e1e !important;
-            border: 1px solid #f44336 !important;
-            color: #fafafa !important;
-        }
-        
-        /* Tabs */
-        .stTabs [data-baseweb="tab-list"] {
-            background-color: #1e1e1e;
-        }
-        
-        .stTabs [data-baseweb="tab"] {
-            color: #fafafa;
-            background-color: #262730;
-        }
-        
-        .stTabs [aria-selected="true"] {
-            background-color: #ff6b6b !important;
-            color: white !important;
-        }
-        
-        /* Markdown headers */
-        .stMarkdown h1, .stMarkdown h2, .stMarkdown h3, .stMarkdown h4 {
-            color: #fafafa;
-        }
-        
-        /* Code blocks */
-        .stCode {
-            background-color: #1e1e1e;
-            border: 1px solid #333;
-        }
-        
-        /* Force dark theme on all text elements */
-        * {
-            scrollbar-width: thin;
-            scrollbar-color: #666 #1e1e1e;
-        }
-        
-        *::-webkit-scrollbar {
-            width: 8px;
-        }
-        
-        *::-webkit-scrollbar-track {
-            background: #1e1e1e;
-        }
-        
-        *::-webkit-scrollbar-thumb {
-            background-color: #666;
-            border-radius: 4px;
-        }
-        </style>
-        """, unsafe_allow_html=True)
-    else:
-        # Light mode styles with very slight orange background
-        st.markdown("""
-        <style>
-        /* Light Mode Styles with slight orange tint */
-        .stApp {
-            background-color: #fffef8 !important;
-            color: #262730;
-        }
-        
-        /* Main content area */
-        .main .block-container {
-            background-color: #fffef8;
-            color: #262730;
-        }
-        
-        section[data-testid="stSidebar"] {
-            background-color: #faf7f2 !important;
-        }
-        
-        /* Sidebar text and headers */
-        section[data-testid="stSidebar"] h1,
-        section[data-testid="stSidebar"] h2, 
-        section[data-testid="stSidebar"] h3,
-        section[data-testid="stSidebar"] .stMarkdown h1,
-        section[data-testid="stSidebar"] .stMarkdown h2, 
-        section[data-testid="stSidebar"] .stMarkdown h3 {
-            color: #262730 !important;
-        }
-        
-        section[data-testid="stSidebar"] p,
-        section[data-testid="stSidebar"] .stMarkdown p,
-        section[data-testid="stSidebar"] strong,
-        section[data-testid="stSidebar"] .stMarkdown strong {
-            color: #262730 !important;
-        }
-        
-        /* Sidebar buttons */
-        section[data-testid="stSidebar"] .stButton > button {
-            background-color: #ff6b6b !important;
-            color: white !important;
-        }
-        
-        section[data-testid="stSidebar"] .stButton > button[kind="secondary"] {
-            background-color: #ffffff !important;
-            color: #262730 !important;
-            border: 1px solid #e1e5e9 !important;
-        }
-        
-        /* Cards and containers */
-        div[data-testid="stContainer"] {
-            background-color: #fefcf7;
-            border: 1px solid #e1e5e9;
-            border-radius: 10px;
-            padding: 20px;
-            margin: 10px 0;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }
-        
-        /* Metrics */
-        div[data-testid="metric-container"] {
-            background-color: #fefcf7;
-            border: 1px solid #e1e5e9;
-            border-radius: 8px;
-            padding: 15px;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-        }
-        
-        /* Buttons */
-        .stButton > button {
-            background-color: #ff6b6b;
-            color: white;
-            border: none;
-            border-radius: 8px;
-            transition: all 0.3s ease;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }
-        
-        .stButton > button:hover {
-            background-color: #ff5252;
-            transform: translateY(-2px);
-            box-shadow: 0 4px 8px rgba(255, 107, 107, 0.3);
-        }
-        
-        /* Primary button */
-        .stButton > button[kind="primary"] {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        }
-        
-        .stButton > button[kind="primary"]:hover {
-            background: linear-gradient(135deg, #5a6fd8 0%, #6a4190 100%);
-        }
-        
-        /* Progress bars */
-        .stProgress > div > div > div {
-            background: linear-gradient(90deg, #ff6b6b, #4ecdc4);
-        }
-        </style>
-        """, unsafe_allow_html=True)
+    theme = 'dark' if st.session_state.dark_mode else 'light'
+    st.markdown(f'<style>@import url("{build_theme_stylesheets()[theme]}");</style>', unsafe_allow_html=True)
 
 def add_theme_toggle_to_sidebar():
     """Add theme toggle to the top of sidebar using the fancy toggle component"""
-    # Create a custom container that puts toggle and button on same line
-    st.sidebar.markdown("""
-    <style>
-    .theme-row {
-        display: flex;
-        align-items: center;
-        justify-content: space-between;
-        margin: 10px 0 20px 0;
-        gap: 15px;
-    }
-    
-    .theme-toggle-wrapper {
-        flex: 0 0 auto;
-    }
-    
-    .theme-button-wrapper {
-        flex: 1;
-        display: flex;
-        justify-content: flex-end;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-    
     # Create columns for the toggle and button
     col1, col2 = st.sidebar.columns([1, 2])
     
@@ -1188,14 +4774,419 @@ def add_theme_toggle_to_sidebar():
     
     st.sidebar.markdown("---")
    
+def count_saved_cards(section, subsection):
+    """Return (words with a cached card, total words) for a subsection"""
+    words = get_sections_from_json().get(section, {}).get(subsection, [])
+    cache = get_card_cache()
+    saved = sum(1 for word in words if make_card_key(word, section, subsection) in cache)
+    return saved, len(words)
+
+def get_saved_learned_cards(section, subsection):
+    """This session's learned words in a subsection that have a cached card, as {word: card key}"""
+    cache = get_card_cache()
+    learned = st.session_state.subsection_progress.get(f"{section}_{subsection}", set())
+    return {
+        word: make_card_key(word, section, subsection)
+        for word in sorted(learned)
+        if make_card_key(word, section, subsection) in cache
+    }
+
+def make_quiz_question(section, subsection, saved_cards, word=None):
+    """Pick a learned word, unless given, and up to three distractors from cached cards in the subsection"""
+    cache = get_card_cache()
+    word = word or random.choice(list(saved_cards))
+    distractors = []
+    for other in random.sample(get_sections_from_json()[section][subsection], min(50, count_words_in_subsection(section, subsection))):
+        if len(distractors) == 3:
+            break
+        card = cache.get(make_card_key(other, section, subsection)) if other != word else None
+        if card is not None:
+            distractors.append(card.get('russian_word', other))
+    
+    answer = cache.get(saved_cards[word]).get('russian_word', word)
+    options = list(dict.fromkeys(distractors + [answer]))
+    random.shuffle(options)
+    return {'word': word, 'answer': answer, 'options': options}
+
+def display_review_and_quiz(section, subsection):
+    """Review and quiz on learned words, served entirely from cached cards"""
+    saved_cards = get_saved_learned_cards(section, subsection)
+    if not saved_cards:
+        return
+    
+    st.markdown("---")
+    with st.expander(f"📚 Review & Quiz ({len(saved_cards)} saved words)", expanded=False):
+        review_col, open_col = st.columns([3, 1])
+        with review_col:
+            review_word = st.selectbox("Review a learned word", list(saved_cards), key="review_word")
+        with open_col:
+            st.markdown("")
+            if st.button("📖 Open", use_container_width=True):
+                st.session_state.current_word_key = saved_cards[review_word]
+                st.rerun()
+        
+        quiz = st.session_state.get('quiz_question')
+        quiz_word = st.session_state.get('quiz_word')
+        if st.button("🧠 New Quiz Question") or (quiz_word and quiz_word not in saved_cards):
+            quiz = make_quiz_question(section, subsection, saved_cards)
+        elif quiz is None and quiz_word:
+            # The options were released with the session's memory; draw them again
+            quiz = make_quiz_question(section, subsection, saved_cards, quiz_word)
+        if quiz:
+            st.session_state.quiz_question = quiz
+            st.session_state.quiz_word = quiz['word']
+        
+        if quiz:
+            choice = st.radio(f"What is the Russian for **{quiz['word']}**?", quiz['options'], index=None, key=f"quiz_{quiz['word']}")
+            if choice is not None:
+                if choice == quiz['answer']:
+                    st.success("✅ Correct!")
+                else:
+                    st.error(f"❌ The answer is {quiz['answer']}")
+
+# Next-subsection recommendations: a users x subsections matrix of completion
+# fractions and its co-completion Gram matrix, both updated per change
+RECOMMENDER_INITIAL_USERS = 64
+RECOMMENDER_MAX_USERS = 20000
+RECOMMENDER_POPULARITY_WEIGHT = 0.3
+RECOMMENDER_WARM_WEIGHT = 0.5
+RECOMMENDER_SAME_SECTION_BONUS = 0.25
+# Recompute the incrementally updated aggregates exactly now and then to shed float drift
+RECOMMENDER_RESYNC_UPDATES = 10000
+
+class SubsectionRecommender:
+    """Scores subsections for a user by co-completion with what they finished, popularity and cache warmth"""
+    
+    def __init__(self):
+        self.columns = {}
+        self.subsections = []
+        self.goals = np.zeros(0, dtype=np.float32)
+        self.progress = np.zeros((RECOMMENDER_INITIAL_USERS, 0), dtype=np.float32)
+        self.co_completion = np.zeros((0, 0), dtype=np.float32)
+        self.popularity = np.zeros(0, dtype=np.float32)
+        self.cached = np.zeros(0, dtype=np.float32)
+        self.rows = OrderedDict()
+        self.index_version = None
+        self.updates = 0
+        self._cached_columns = {}
+        self._lock = threading.Lock()
+    
+    def sync_vocabulary(self, index):
+        """Re-map columns after the vocabulary changed, keeping existing progress"""
+        if self.index_version == index.version:
+            return
+        with self._lock:
+            subsections = list(index.word_counts)
+            columns = {subsection: column for column, subsection in enumerate(subsections)}
+            progress = np.zeros((self.progress.shape[0], len(subsections)), dtype=np.float32)
+            for subsection, old_column in self.columns.items():
+                if subsection in columns:
+                    progress[:, columns[subsection]] = self.progress[:, old_column]
+            
+            cached = np.zeros(len(subsections), dtype=np.float32)
+            for card_key in self._cached_columns:
+                _, section, subsection = parse_card_key(card_key)
+                column = columns.get((section, subsection))
+                self._cached_columns[card_key] = column
+                if column is not None:
+                    cached[column] += 1
+            
+            self.subsections = subsections
+            self.columns = columns
+            self.goals = np.array([index.subsection_goal(*subsection) for subsection in subsections], dtype=np.float32)
+            self.progress = progress
+            self.cached = cached
+            self.co_completion = progress.T @ progress
+            self.popularity = progress.sum(axis=0)
+            self.index_version = index.version
+    
+    def _row(self, user):
+        row = self.rows.get(user)
+        if row is not None:
+            self.rows.move_to_end(user)
+            return row
+        
+        if len(self.rows) >= RECOMMENDER_MAX_USERS:
+            # Recycle the least recently active user's row
+            _, row = self.rows.popitem(last=False)
+            self._set_row(row, np.zeros(len(self.subsections), dtype=np.float32))
+        else:
+            row = len(self.rows)
+            if row >= self.progress.shape[0]:
+                grown = np.zeros((self.progress.shape[0] * 2, len(self.subsections)), dtype=np.float32)
+                grown[:self.progress.shape[0]] = self.progress
+                self.progress = grown
+        self.rows[user] = row
+        return row
+    
+    def _set_row(self, row, values):
+        old = self.progress[row].copy()
+        self.progress[row] = values
+        # Gram matrix update: remove the old row's outer product, add the new one
+        self.co_completion += np.outer(values, values) - np.outer(old, old)
+        self.popularity += values - old
+        self.updates += 1
+        if self.updates % RECOMMENDER_RESYNC_UPDATES == 0:
+            self.co_completion = self.progress.T @ self.progress
+            self.popularity = self.progress.sum(axis=0)
+    
+    def update(self, user, section, subsection, learned):
+        """Record that a user has learned `learned` words of a subsection"""
+        column = self.columns.get((section, subsection))
+        if column is None or user is None:
+            return
+        with self._lock:
+            row = self._row(user)
+            goal = self.goals[column]
+            values = self.progress[row].copy()
+            values[column] = min(learned / goal, 1.0) if goal else 0.0
+            self._set_row(row, values)
+    
+    def on_card_change(self, card_key, card):
+        """CardCache listener keeping the per-subsection count of cached cards"""
+        with self._lock:
+            if card is None:
+                column = self._cached_columns.pop(card_key, None)
+                if column is not None:
+                    self.cached[column] -= 1
+            elif card_key not in self._cached_columns:
+                _, section, subsection = parse_card_key(card_key)
+                column = self.columns.get((section, subsection))
+                self._cached_columns[card_key] = column
+                if column is not None:
+                    self.cached[column] += 1
+    
+    def recommend(self, user, current=None):
+        """Best (section, subsection) for a user to study next, or None if everything is complete"""
+        with self._lock:
+            if not self.subsections:
+                return None
+            row = self.rows.get(user)
+            user_progress = self.progress[row] if row is not None else np.zeros(len(self.subsections), dtype=np.float32)
+            
+            # Item-item cosine similarity from co-completion, weighted by the user's progress
+            norms = np.sqrt(np.diag(self.co_completion))
+            similarity = self.co_completion / (np.outer(norms, norms) + 1e-6)
+            total_progress = user_progress.sum()
+            scores = similarity @ user_progress / total_progress if total_progress else np.zeros_like(user_progress)
+            
+            popularity_max = self.popularity.max()
+            if popularity_max > 0:
+                scores = scores + RECOMMENDER_POPULARITY_WEIGHT * self.popularity / popularity_max
+            scores = scores + RECOMMENDER_WARM_WEIGHT * np.minimum(self.cached / np.maximum(self.goals, 1), 1.0)
+            
+            if current is not None:
+                same_section = np.array([section == current[0] for section, _ in self.subsections])
+                scores = scores + RECOMMENDER_SAME_SECTION_BONUS * same_section
+                if current in self.columns:
+                    scores[self.columns[current]] = -np.inf
+            scores[(user_progress >= 1.0) | (self.goals == 0)] = -np.inf
+            
+            best = int(np.argmax(scores))
+            return self.subsections[best] if np.isfinite(scores[best]) else None
+
+@st.cache_resource
+def get_recommender():
+    """Shared subsection recommender, fed by progress updates and the card cache"""
+    recommender = SubsectionRecommender()
+    recommender.sync_vocabulary(get_vocabulary_index())
+    get_card_cache().add_listener(recommender.on_card_change)
+    return recommender
+
+def record_subsection_progress(section, subsection):
+    """Push this session's learned count for a subsection to the recommender"""
+    recommender = get_recommender()
+    recommender.sync_vocabulary(get_vocabulary_index())
+    learned = get_progress_tracker().learned.get((section, subsection), 0)
+    recommender.update(get_session_id(), section, subsection, learned)
+
+def record_word_view(section, subsection, word):
+    """Count a word the student has been shown as learned in their progress"""
+    get_progress_tracker().add(get_vocabulary_index(), section, subsection, word)
+    record_subsection_progress(section, subsection)
+
+def open_word_card(card_key):
+    """Navigate straight to a word's card, recording the view like a drawn word"""
+    word, section, subsection = parse_card_key(card_key)
+    st.session_state.selected_section = section
+    st.session_state.selected_subsection = subsection
+    st.session_state.current_word_key = card_key
+    record_word_view(section, subsection, word)
+
+def recommend_next_subsection(section, subsection):
+    """The recommended subsection after finishing one, as (section, subsection) or None"""
+    recommender = get_recommender()
+    recommender.sync_vocabulary(get_vocabulary_index())
+    return recommender.recommend(get_session_id(), current=(section, subsection))
+
+def is_admin_session():
+    """Admin tools are shown when the URL carries ?admin=<ADMIN_TOKEN>"""
+    admin_token = get_secret("ADMIN_TOKEN")
+    return bool(admin_token) and st.query_params.get("admin") == admin_token
+
+def display_trace_waterfall(trace):
+    """Draw one trace's spans as a waterfall, coloured by the thread that ran them"""
+    rows = []
+    for number, span in enumerate(trace['spans'], start=1):
+        details = ', '.join(f"{key}={value}" for key, value in span.items()
+                            if key not in ('name', 'start', 'duration', 'depth', 'thread'))
+        rows.append({
+            'span': f"{number}. {'· ' * span['depth']}{span['name']}",
+            'start_ms': round(span['start'] * 1000, 1),
+            'end_ms': round((span['start'] + span['duration']) * 1000, 1),
+            'duration_ms': round(span['duration'] * 1000, 1),
+            'thread': span['thread'],
+            'details': details
+        })
+    st.vega_lite_chart(rows, {
+        'mark': {'type': 'bar', 'cornerRadius': 2},
+        'encoding': {
+            'y': {'field': 'span', 'type': 'nominal', 'sort': None, 'title': None},
+            'x': {'field': 'start_ms', 'type': 'quantitative', 'title': 'ms since click'},
+            'x2': {'field': 'end_ms'},
+            'color': {'field': 'thread', 'type': 'nominal', 'legend': {'orient': 'bottom'}},
+            'tooltip': [{'field': 'span'}, {'field': 'duration_ms'}, {'field': 'thread'}, {'field': 'details'}]
+        }
+    })
+
+def display_admin_panel():
+    """Operational view of the shared cache, sessions and generation scheduler"""
+    with st.sidebar.expander("🛠️ Admin", expanded=False):
+        st.markdown("#### Generation Queue")
+        metrics = get_generation_scheduler().metrics()
+        for lane, lane_metrics in metrics.items():
+            started = lane_metrics['completed'] + lane_metrics['failed']
+            avg_wait = lane_metrics['wait_seconds'] / started if started else 0.0
+            st.write(f"**{lane.title()}:** {lane_metrics['queued']} queued, {lane_metrics['running']} running")
+            st.caption(f"{lane_metrics['completed']} done, {lane_metrics['failed']} failed, "
+                       f"{lane_metrics['cancelled']} cancelled · avg wait {avg_wait:.2f}s, "
+                       f"max {lane_metrics['max_wait_seconds']:.2f}s")
+        st.caption(f"Quota headroom: {get_generation_scheduler().rate_limiter.available():.1f} requests")
+        router = get_backend_router()
+        for backend in router.backends:
+            st.caption(f"Backend {backend.name}: circuit {backend.breaker.state}, {backend.requests} requests, "
+                       f"~{backend.latency:.1f}s and ${backend.cost:.5f} each, {backend.breaker.trips} trips")
+        if router.config_error:
+            st.caption(f"Backend configuration: {router.config_error}")
+        if router.routed:
+            routes = ', '.join(f"{section_name} → {backend_name} ({count})"
+                               for (backend_name, section_name), count in router.routed.most_common(6))
+            st.caption(f"Routing: {routes}")
+        hedge_stats = get_hedge_stats()
+        hedging = hedge_stats.summary()
+        hedge_delay = hedge_stats.delay()
+        delay_text = f"after {hedge_delay:.1f}s" if hedge_delay else f"warming up, {hedging['samples']} latencies seen"
+        st.caption(f"Hedging: {'on' if is_hedging_enabled() else 'off'} ({delay_text}) · "
+                   f"{hedging['hedged']} of {hedging['eligible']} clicks hedged, "
+                   f"hedge won {hedging['win_rate']:.0%}, {hedging['no_headroom']} skipped for quota, "
+                   f"extra cost ${hedging['extra_cost']:.4f}")
+        quality = get_card_quality_stats()
+        common_problems = ', '.join(f"{field} ({count})" for field, count in quality.fields.most_common(3))
+        st.caption(f"Card quality: {quality.rejected} of {quality.checked} generated cards failed checks, "
+                   f"{quality.repaired} repaired in place" + (f" · most often {common_problems}" if common_problems else ''))
+        
+        st.markdown("#### Slow Clicks")
+        recorder = get_trace_recorder()
+        st.caption(f"{recorder.sampled} of {recorder.finished} clicks took {recorder.slow_seconds:.1f}s or more")
+        traces = recorder.recent()
+        if traces:
+            labels = [
+                f"{time.strftime('%H:%M:%S', time.localtime(trace['started_at']))} · {trace['duration']:.1f}s · "
+                f"{trace.get('word') or 'no word'}"
+                for trace in traces
+            ]
+            choice = st.selectbox("Trace", range(len(traces)), format_func=labels.__getitem__)
+            st.caption(f"{traces[choice]['section']} / {traces[choice]['subsection']}")
+            display_trace_waterfall(traces[choice])
+        
+        st.markdown("#### Token Usage (last 24h)")
+        usage = get_usage_tracker().summary()
+        totals = usage['totals']
+        budget = get_daily_token_budget()
+        budget_share = totals['tokens'] / budget if budget else 0.0
+        if budget_share >= 1:
+            st.error(f"🚨 Daily token budget exceeded: {totals['tokens']:,} of {budget:,}")
+        elif budget_share >= BUDGET_WARNING_SHARE:
+            st.warning(f"⚠️ {budget_share:.0%} of the daily token budget used")
+        st.progress(min(budget_share, 1.0))
+        st.write(f"{totals['tokens']:,} tokens (${totals['cost']:.4f}) in {totals['calls']} calls, "
+                 f"{totals['tokens_per_card']:,.0f} tokens/card")
+        st.caption(f"{totals['prompt_tokens']:,} prompt / {totals['output_tokens']:,} output tokens"
+                   + (f", {totals['estimated']} calls estimated" if totals['estimated'] else ""))
+        trend = {time.strftime('%H:00', time.localtime(start)): value for start, value in usage['trend'] if value}
+        if len(trend) > 1:
+            st.caption("Tokens per card by hour")
+            st.line_chart(trend)
+        if usage['subsections']:
+            st.caption("Top subsections by tokens")
+            st.table([{'subsection': name, 'tokens': tokens} for name, tokens in usage['subsections'].most_common(5)])
+        if usage['users']:
+            st.caption("Top sessions by tokens")
+            st.table([{'session': name[:8], 'tokens': tokens} for name, tokens in usage['users'].most_common(5)])
+        
+        st.markdown("#### Card Cache")
+        cache_stats = get_card_cache().stats()
+        st.write(f"{cache_stats['entries']} cards, {cache_stats['bytes'] / 1024:.0f} KB, "
+                 f"hit rate {cache_stats['hit_rate']:.0%}")
+        st.caption(f"{cache_stats['codec']} compression {cache_stats['compression_ratio']:.1f}x "
+                   f"({cache_stats['raw_bytes'] / 1024:.0f} KB uncompressed)")
+        cache = get_card_cache()
+        if cache.snapshot is not None:
+            built = time.strftime('%Y-%m-%d %H:%M', time.localtime(cache.snapshot.header['created_at']))
+            st.caption(f"Snapshot: {cache_stats['snapshot_entries']} of {len(cache.snapshot)} cards served from "
+                       f"{cache.snapshot.path} ({cache_stats['snapshot_bytes'] / 2**20:.1f} MB, built {built})")
+        elif cache.snapshot_error:
+            st.caption(f"Snapshot not loaded: {cache.snapshot_error}")
+        if st.button("📦 Save cache snapshot"):
+            # Compressing every card takes a while, so it runs in the background instead of this rerun
+            st.session_state.snapshot_save = get_snapshot_writer().submit(
+                write_card_snapshot, get_snapshot_path(), cache.cards())
+        snapshot_save = st.session_state.get('snapshot_save')
+        if snapshot_save is not None:
+            if not snapshot_save.done():
+                st.caption("Writing snapshot in the background...")
+            elif snapshot_save.exception() is not None:
+                st.error(f"Snapshot not written: {snapshot_save.exception()}")
+            else:
+                st.success(f"Wrote {snapshot_save.result()['cards']} cards to {get_snapshot_path()}; "
+                           f"servers load it when they start")
+        st.caption(f"{len(get_session_registry())} sessions tracked")
+        order, cohort = get_word_order()
+        st.caption(f"Word order: {order}" + (f" (cohort '{cohort}')" if order != 'random' else ""))
+        
+        if st.session_state.get('selected_subsection'):
+            warm_count = st.number_input("Words to warm up", min_value=1, max_value=500, value=20)
+            if st.button("🔥 Warm up this subsection"):
+                queued = warm_up_subsection(st.session_state.selected_section, st.session_state.selected_subsection, warm_count)
+                st.success(f"Queued {queued} words")
+        
+        st.markdown("#### Prompt Templates")
+        st.caption(' · '.join(f"{section.name} v{section.version}" for section in active_prompt_sections()))
+        migration = get_prompt_migration()
+        if migration.scanned:
+            outdated = ', '.join(f"{name} ({count})" for name, count in migration.stale.most_common()) or 'none'
+            st.caption(f"Last scan: {migration.scanned} cards, outdated sections: {outdated} · "
+                       f"{migration.migrated} cards updated, {migration.failed} failed")
+        if st.button("🔁 Regenerate outdated card fields", disabled=is_cache_only()):
+            queued = migration.start()
+            st.success(f"Queued {queued} batches of up to {migration.batch_size} cards")
+
 def updated_main():
     """Updated main function using JSON database with direct subsection navigation and dark mode toggle"""
     
     # Apply theme first
     apply_theme()
     
+    # Keep per-session memory bounded
+    enforce_session_memory()
+    
     st.title("🏥 Russian Learning App for All Soon-to-Be Doctor")
     
+    if is_cache_only():
+        reason = get_backend_router().unavailable_reason()
+        st.warning(f"📴 Live generation is unavailable ({reason}). Saved cards, review and quizzes still work, "
+                   "and new words come back automatically once the service recovers.")
+    
     # Subtitle with heart button next to it
     subtitle_col, button_col = st.columns([3, 1])
     with subtitle_col:
@@ -1203,17 +5194,23 @@ def updated_main():
     
     # Load database and check if successful
     if not load_vocabulary_database():
-        st.error("❌ Failed to load vocabulary database. Please check your db.json file.")
+        st.error("❌ Failed to load vocabulary database. Please check db.json and run compile_vocabulary.py.")
         return
     
     # Initialize session state
-    if 'current_word_data' not in st.session_state:
-        st.session_state.current_word_data = None
+    if 'current_word_key' not in st.session_state:
+        st.session_state.current_word_key = None
     if 'selected_section' not in st.session_state:
         st.session_state.selected_section = None
     if 'selected_subsection' not in st.session_state:
         st.session_state.selected_subsection = None
     
+    if 'prefetched_word_key' not in st.session_state:
+        st.session_state.prefetched_word_key = None
+    
+    # Drop background work for a subsection the user has left
+    cancel_stale_prefetch()
+    
     # Initialize progress from JSON structure
     initialize_progress_from_json()
     
@@ -1341,16 +5338,14 @@ def updated_main():
         selected_section = st.session_state.selected_section
         selected_subsection = st.session_state.selected_subsection
         
-        # Show progress for current subsection
-        progress_key = f"{selected_section}_{selected_subsection}"
-        
-        # Ensure the progress key exists
-        if progress_key not in st.session_state.subsection_progress:
-            st.session_state.subsection_progress[progress_key] = set()
+        # Counts are kept up to date as words are learned, so nothing here scans the vocabulary
+        tracker = get_progress_tracker()
+        index = get_vocabulary_index()
         
-        used_count = len(st.session_state.subsection_progress[progress_key])
-        total_words = count_words_in_subsection(selected_section, selected_subsection)
-        max_words = min(total_words, 3)  # Cap at 3 or total available words
+        # Show progress for current subsection
+        used_count = tracker.learned.get((selected_section, selected_subsection), 0)
+        total_words = index.word_counts.get((selected_section, selected_subsection), 0)
+        max_words = index.subsection_goal(selected_section, selected_subsection)
         
         # Calculate progress (0 to 1)
         progress = min(used_count / max_words, 1.0) if max_words > 0 else 0
@@ -1370,15 +5365,8 @@ def updated_main():
         st.sidebar.markdown(f"### 📈 {selected_section} - All Progress")
         
         for subsection in sections[selected_section].keys():
-            progress_key = f"{selected_section}_{subsection}"
-            
-            # Ensure the progress key exists
-            if progress_key not in st.session_state.subsection_progress:
-                st.session_state.subsection_progress[progress_key] = set()
-            
-            used_count = len(st.session_state.subsection_progress[progress_key])
-            total_words = count_words_in_subsection(selected_section, subsection)
-            max_words = min(total_words, 3)
+            used_count = tracker.learned.get((selected_section, subsection), 0)
+            max_words = index.subsection_goal(selected_section, subsection)
             
             # Calculate progress (0 to 1)
             progress = min(used_count / max_words, 1.0) if max_words > 0 else 0
@@ -1388,7 +5376,7 @@ def updated_main():
                 # Create columns for GIF and text
                 gif_col, text_col = st.sidebar.columns([1, 3])
                 with gif_col:
-                    st.image(subsection_gifs[subsection], width=30)
+                    st.image(media_image(subsection_gifs[subsection], 30), width=30)
                 with text_col:
                     # Style current subsection differently
                     if subsection == st.session_state.selected_subsection:
@@ -1417,17 +5405,8 @@ def updated_main():
         st.sidebar.markdown("---")
         st.sidebar.markdown("### 🏆 Overall Section Progress")
         
-        total_learned = 0
-        total_possible = 0
-        
-        for subsection in sections[selected_section].keys():
-            progress_key = f"{selected_section}_{subsection}"
-            if progress_key in st.session_state.subsection_progress:
-                subsection_learned = len(st.session_state.subsection_progress[progress_key])
-                total_words = count_words_in_subsection(selected_section, subsection)
-                max_words = min(total_words, 3)
-                total_learned += min(subsection_learned, max_words)
-                total_possible += max_words
+        total_learned = tracker.section_learned.get(selected_section, 0)
+        total_possible = index.section_goals.get(selected_section, 0)
         
         overall_progress = total_learned / total_possible if total_possible > 0 else 0
         
@@ -1442,6 +5421,7 @@ def updated_main():
             st.sidebar.progress(overall_progress)
         
         st.sidebar.write(f"Section total: {total_learned}/{total_possible} words")
+        st.sidebar.caption(f"All sections: {tracker.overall_learned}/{index.overall_goal} words")
         
         # Achievement badges
         if overall_progress == 1.0:
@@ -1453,17 +5433,17 @@ def updated_main():
         col1, col2 = st.sidebar.columns(2)
         with col1:
             if st.button("🔄 Reset Current", help="Reset current subsection"):
-                progress_key = f"{selected_section}_{selected_subsection}"
-                st.session_state.subsection_progress[progress_key] = set()
-                st.session_state.current_word_data = None
+                tracker.reset(index, selected_section, selected_subsection)
+                record_subsection_progress(selected_section, selected_subsection)
+                st.session_state.current_word_key = None
                 st.rerun()
         
         with col2:
             if st.button("🗑️ Reset All", help="Reset entire section"):
                 for subsection in sections[selected_section].keys():
-                    progress_key = f"{selected_section}_{subsection}"
-                    st.session_state.subsection_progress[progress_key] = set()
-                st.session_state.current_word_data = None
+                    tracker.reset(index, selected_section, subsection)
+                    record_subsection_progress(selected_section, subsection)
+                st.session_state.current_word_key = None
                 st.rerun()
         
         # Add flip card functionality if it exists
@@ -1476,11 +5456,43 @@ def updated_main():
         # Empty sidebar when no subsection is selected
         pass
     
+    if is_admin_session():
+        display_admin_panel()
+    
     # ============ MAIN CONTENT AREA ============
     if not st.session_state.selected_subsection:
         # Welcome screen with direct subsection selection
         st.markdown("### 👋 Welcome to Your Russian Learning Journey!")
         st.markdown("Choose any topic below to start learning immediately:")
+
+        # Quick word search: English over the vocabulary, Russian over cached cards
+        search_query = st.text_input("🔎 Find a word", placeholder="e.g. lymph node, сердцем")
+        if search_query and CYRILLIC_WORD.search(normalize_russian(search_query)):
+            results = get_russian_index().search(search_query)
+            if results:
+                for card_key, kind in results:
+                    word, section, subsection = parse_card_key(card_key)
+                    result_col, open_col = st.columns([4, 1])
+                    with result_col:
+                        note = " (related word)" if kind == 'related' else ""
+                        st.markdown(f"**{word}** — {section} › {subsection}{note}")
+                    with open_col:
+                        if st.button("📖 Open", key=f"open_{card_key}", use_container_width=True):
+                            st.session_state.selected_section = section
+                            st.session_state.selected_subsection = subsection
+                            st.session_state.current_word_key = card_key
+                            st.rerun()
+            else:
+                st.caption("No saved card contains that Russian word yet.")
+        elif search_query:
+            results = get_vocabulary_index().search(search_query)
+            if results:
+                for word, locations in results:
+                    where = ", ".join(f"{section} › {subsection}" for section, subsection in locations)
+                    st.markdown(f"**{word}** — {where}")
+            else:
+                st.caption("No matching words found.")
+
         st.markdown("---")
         
         # Display sections with subsection buttons
@@ -1507,19 +5519,14 @@ def updated_main():
                                         # Center the image using columns
                                         _, center_col, _ = st.columns([1, 2, 1])
                                         with center_col:
-                                            st.image(subsection_gifs[subsection], width=100)
+                                            st.image(media_image(subsection_gifs[subsection], 100), width=100)
                                     else:
                                         # Display subsection name as header if no GIF (centered)
                                         st.markdown(f"<div style='text-align: center'><strong>{subsection}</strong></div>", unsafe_allow_html=True)
                                     
                                     # Get progress info for styling
-                                    progress_key = f"{section_name}_{subsection}"
-                                    if progress_key not in st.session_state.subsection_progress:
-                                        st.session_state.subsection_progress[progress_key] = set()
-                                    
-                                    used_count = len(st.session_state.subsection_progress[progress_key])
-                                    total_words = count_words_in_subsection(section_name, subsection)
-                                    max_words = min(total_words, 3)
+                                    used_count = get_progress_tracker().learned.get((section_name, subsection), 0)
+                                    max_words = get_vocabulary_index().subsection_goal(section_name, subsection)
                                     progress = min(used_count / max_words, 1.0) if max_words > 0 else 0
                                     
                                     # Create button text with shortened name and progress indication
@@ -1535,7 +5542,7 @@ def updated_main():
                                     if st.button(button_text, key=f"direct_select_{section_name}_{subsection}", use_container_width=True):
                                         st.session_state.selected_section = section_name
                                         st.session_state.selected_subsection = subsection
-                                        st.session_state.current_word_data = None
+                                        st.session_state.current_word_key = None
                                         st.rerun()
                         
                         # Second row - remaining subsections
@@ -1549,19 +5556,14 @@ def updated_main():
                                         # Center the image using columns
                                         _, center_col, _ = st.columns([1, 2, 1])
                                         with center_col:
-                                            st.image(subsection_gifs[subsection], width=100)
+                                            st.image(media_image(subsection_gifs[subsection], 100), width=100)
                                     else:
                                         # Display subsection name as header if no GIF (centered)
                                         st.markdown(f"<div style='text-align: center'><strong>{subsection}</strong></div>", unsafe_allow_html=True)
                                     
                                     # Get progress info for styling
-                                    progress_key = f"{section_name}_{subsection}"
-                                    if progress_key not in st.session_state.subsection_progress:
-                                        st.session_state.subsection_progress[progress_key] = set()
-                                    
-                                    used_count = len(st.session_state.subsection_progress[progress_key])
-                                    total_words = count_words_in_subsection(section_name, subsection)
-                                    max_words = min(total_words, 3)
+                                    used_count = get_progress_tracker().learned.get((section_name, subsection), 0)
+                                    max_words = get_vocabulary_index().subsection_goal(section_name, subsection)
                                     progress = min(used_count / max_words, 1.0) if max_words > 0 else 0
                                     
                                     # Create button text with shortened name and progress indication
@@ -1577,7 +5579,7 @@ def updated_main():
                                     if st.button(button_text, key=f"direct_select_{section_name}_{subsection}", use_container_width=True):
                                         st.session_state.selected_section = section_name
                                         st.session_state.selected_subsection = subsection
-                                        st.session_state.current_word_data = None
+                                        st.session_state.current_word_key = None
                                         st.rerun()
                     else:
                         # Default layout for other sections - single row
@@ -1594,19 +5596,14 @@ def updated_main():
                                     # Center the image using columns
                                     _, center_col, _ = st.columns([1, 2, 1])
                                     with center_col:
-                                        st.image(subsection_gifs[subsection], width=100)
+                                        st.image(media_image(subsection_gifs[subsection], 100), width=100)
                                 else:
                                     # Display subsection name as header if no GIF (centered)
                                     st.markdown(f"<div style='text-align: center'><strong>{subsection}</strong></div>", unsafe_allow_html=True)
                                 
                                 # Get progress info for styling
-                                progress_key = f"{section_name}_{subsection}"
-                                if progress_key not in st.session_state.subsection_progress:
-                                    st.session_state.subsection_progress[progress_key] = set()
-                                
-                                used_count = len(st.session_state.subsection_progress[progress_key])
-                                total_words = count_words_in_subsection(section_name, subsection)
-                                max_words = min(total_words, 3)
+                                used_count = get_progress_tracker().learned.get((section_name, subsection), 0)
+                                max_words = get_vocabulary_index().subsection_goal(section_name, subsection)
                                 progress = min(used_count / max_words, 1.0) if max_words > 0 else 0
                                 
                                 # Create button text with shortened name and progress indication
@@ -1622,7 +5619,7 @@ def updated_main():
                                 if st.button(button_text, key=f"direct_select_{section_name}_{subsection}", use_container_width=True):
                                     st.session_state.selected_section = section_name
                                     st.session_state.selected_subsection = subsection
-                                    st.session_state.current_word_data = None
+                                    st.session_state.current_word_key = None
                                     st.rerun()
                 
                 st.markdown("---")
@@ -1641,7 +5638,7 @@ def updated_main():
                 # Create a sub-column layout for GIF + text
                 gif_col, text_col = st.columns([1, 3])
                 with gif_col:
-                    st.image(subsection_gifs[selected_subsection], width=80)
+                    st.image(media_image(subsection_gifs[selected_subsection], 80), width=80)
                 with text_col:
                     st.markdown(f"### {selected_subsection}")
             else:
@@ -1654,12 +5651,17 @@ def updated_main():
             if st.button("🏠 Home", use_container_width=True):
                 st.session_state.selected_section = None
                 st.session_state.selected_subsection = None
-                st.session_state.current_word_data = None
+                st.session_state.current_word_key = None
                 st.rerun()
         
         st.markdown("---")
         
-        # Get next word button
+        if is_cache_only():
+            saved, total = count_saved_cards(selected_section, selected_subsection)
+            st.caption(f"📴 {saved} of {total} words in this subsection have saved cards; the rest are unavailable offline.")
+        
+        # Get next word button; a click is traced from word draw to render
+        trace = None
         if st.button("🎲 Get Next Word", use_container_width=True):
             progress_key = f"{selected_section}_{selected_subsection}"
             
@@ -1669,7 +5671,7 @@ def updated_main():
             
             used_words_for_subsection = st.session_state.subsection_progress[progress_key]
             total_words = count_words_in_subsection(selected_section, selected_subsection)
-            max_words = min(total_words, 3)
+            max_words = get_vocabulary_index().subsection_goal(selected_section, selected_subsection)
             
             # Check if we've reached the word limit for this subsection
             if len(used_words_for_subsection) >= max_words:
@@ -1688,42 +5690,58 @@ def updated_main():
                 
                 st.info("🚀 **Next Steps:**\n- Reset this subsection to practice again\n- Choose a different subsection to continue learning\n- Try a new section for broader vocabulary!")
                 
-                # Show recommended next subsection from same section
-                current_subsections = list(sections[selected_section].keys())
-                current_index = current_subsections.index(selected_subsection)
-                if current_index < len(current_subsections) - 1:
-                    next_subsection = current_subsections[current_index + 1]
+                # Show recommended next subsection, based on what similar students went on to finish
+                recommendation = recommend_next_subsection(selected_section, selected_subsection)
+                if recommendation:
+                    next_section, next_subsection = recommendation
                     next_icon = subsection_icons.get(next_subsection, '📌')
                     
                     # Quick access button to next subsection (using full name in navigation)
                     if st.button(f"🚀 Continue with {next_icon} {next_subsection}", type="secondary", use_container_width=True):
+                        st.session_state.selected_section = next_section
                         st.session_state.selected_subsection = next_subsection
-                        st.session_state.current_word_data = None
+                        st.session_state.current_word_key = None
                         st.rerun()
                 else:
                     st.info(f"🎊 You've completed all subsections in '{selected_section}'!")
             else:
                 # Get random unused word
+                trace = Trace('Get Next Word', section=selected_section, subsection=selected_subsection)
                 try:
-                    current_word = get_random_word_from_subsection(selected_section, selected_subsection)
+                    cache_only = is_cache_only()
+                    with use_trace(trace), trace_span('word draw') as span:
+                        current_word = take_prefetched_word(selected_section, selected_subsection)
+                        span['prefetched'] = bool(current_word)
+                        if not current_word:
+                            current_word = get_random_word_from_subsection(selected_section, selected_subsection, cached_only=cache_only)
+                    trace.attrs['word'] = current_word
                     
                     if current_word:
-                        st.session_state.subsection_progress[progress_key].add(current_word)
+                        record_word_view(selected_section, selected_subsection, current_word)
                         
                         # Show loading spinner while generating content
                         with st.spinner("Loading..."):
+                            card_key = make_card_key(current_word, selected_section, selected_subsection)
+                            cache_hit = card_key in get_card_cache()
+                            started = time.monotonic()
                             try:
-                                russian_content = get_enhanced_russian_content(current_word, selected_section, selected_subsection)
-                                
-                                st.session_state.current_word_data = {
-                                    'english_word': current_word,
-                                    'section': selected_section,
-                                    'subsection': selected_subsection,
-                                    **russian_content
-                                }
+                                with use_trace(trace):
+                                    get_word_card(current_word, selected_section, selected_subsection)
+                                st.session_state.current_word_key = card_key
+                            except ModelUnavailableError:
+                                st.warning(f"📴 '{current_word}' isn't saved yet and live generation is unavailable right now.")
+                                st.session_state.current_word_key = None
                             except Exception as e:
                                 st.error(f"Failed to generate content: {str(e)}")
-                                st.session_state.current_word_data = None
+                                st.session_state.current_word_key = None
+                            finally:
+                                log_card_access(current_word, selected_section, selected_subsection, cache_hit, started)
+                        
+                        # Generate the following word while the student reads this one
+                        if len(st.session_state.subsection_progress[progress_key]) < max_words:
+                            prefetch_next_word(selected_section, selected_subsection)
+                    elif cache_only:
+                        st.info(f"📴 No more saved cards in '{selected_subsection}'. New words will be available once live generation is back.")
                     else:
                         # No more words available
                         st.info(f"🔄 All words from '{selected_subsection}' have been used!")
@@ -1733,8 +5751,9 @@ def updated_main():
                     st.info("Please ensure all required functions are properly defined.")
         
         # Display current word data with enhanced presentation
-        if st.session_state.current_word_data:
-            data = st.session_state.current_word_data
+        render_started = time.monotonic()
+        data = load_current_card()
+        if data:
             
             st.markdown("---")
             
@@ -1797,6 +5816,17 @@ def updated_main():
                     st.markdown(f"**Russian:** {data['russian_word']}")
                     st.markdown(f"**Section:** {data['section']}")
                     st.markdown(f"**Subsection:** {data['subsection']}")
+            
+            # Neighbouring words from the word graph, one click away
+            display_word_neighbours(st.session_state.current_word_key)
+            display_example_search(st.session_state.current_word_key, data)
+        
+        if trace is not None:
+            with use_trace(trace):
+                record_span('render', render_started)
+            get_trace_recorder().finish(trace)
+        
+        display_review_and_quiz(selected_section, selected_subsection)
 
 if __name__ == "__main__":
     updated_main()
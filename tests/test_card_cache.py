@@ -0,0 +1,92 @@
+import pytest
+
+import streamlit_app as app
+
+
+def fixture_items(count):
+    cards = [app.make_fixture_card(f"word {number}", 'Anatomy', 'Organs') for number in range(count)]
+    return [(app.make_card_key(card['english_word'], 'Anatomy', 'Organs'), card) for card in cards]
+
+
+@pytest.fixture
+def snapshot_cache(tmp_path):
+    """A two-entry LRU over a snapshot of five fixture cards"""
+    items = fixture_items(5)
+    path = str(tmp_path / 'cards.snapshot')
+    app.write_card_snapshot(path, items)
+    cache = app.CardCache(2, 10 ** 9, app.default_card_codec(), app.CardSnapshot(path, verify=True))
+    return cache, items
+
+
+def test_snapshot_cards_are_served(snapshot_cache):
+    cache, items = snapshot_cache
+    card_key, card = items[0]
+    assert len(cache) == 5
+    assert card_key in cache
+    assert cache.get(card_key).to_dict() == card
+    assert cache.get('Anatomy|Organs|missing') is None
+
+
+def test_newer_card_shadows_the_snapshot(snapshot_cache):
+    cache, items = snapshot_cache
+    card_key, card = items[0]
+    cache.put(card_key, dict(card, russian_word='новое'))
+    assert cache.get(card_key)['russian_word'] == 'новое'
+    assert len(cache) == 5
+    assert [key for key, _ in cache.cards()].count(card_key) == 1
+
+
+def test_evicted_replacement_does_not_resurrect_the_snapshot_card(snapshot_cache):
+    cache, items = snapshot_cache
+    card_key, card = items[0]
+    cache.put(card_key, dict(card, russian_word='новое'))
+    cache.put('Anatomy|Other|a', card)
+    cache.put('Anatomy|Other|b', card)
+    assert card_key not in cache
+    assert cache.get(card_key) is None
+
+
+def test_invalidate_hides_a_snapshot_card(snapshot_cache):
+    cache, items = snapshot_cache
+    card_key, card = items[1]
+    assert cache.invalidate(card_key)
+    assert card_key not in cache
+    assert len(cache) == 4
+    assert not cache.invalidate(card_key)
+    cache.put(card_key, card)
+    assert cache.get(card_key).to_dict() == card
+
+
+def test_put_with_replaces_never_overwrites_a_newer_card(snapshot_cache):
+    cache, items = snapshot_cache
+    card_key, card = items[2]
+    read = cache.get(card_key)
+    cache.put(card_key, dict(card, russian_word='новое'))
+    assert not cache.put(card_key, dict(card, russian_word='старое'), replaces=read)
+    assert cache.get(card_key)['russian_word'] == 'новое'
+    assert cache.put(card_key, dict(card, russian_word='ещё новее'), replaces=cache.get(card_key))
+    assert cache.get(card_key)['russian_word'] == 'ещё новее'
+
+
+def test_listeners_see_stores_and_evictions():
+    cache = app.CardCache(1, 10 ** 9, app.default_card_codec())
+    seen = []
+    cache.add_listener(lambda card_key, card: seen.append((card_key, card is not None)))
+    (first_key, first), (second_key, second) = fixture_items(2)
+    cache.put(first_key, first)
+    cache.put(second_key, second)
+    assert seen == [(first_key, True), (second_key, True), (first_key, False)]
+
+
+def test_stale_prompt_sections():
+    card = app.make_fixture_card('heart', 'Anatomy', 'Organs')
+    versions = app.prompt_versions()
+    assert app.stale_prompt_sections(dict(card, prompt_versions=versions)) == []
+
+    section = app.active_prompt_sections()[0]
+    outdated = dict(versions, **{section.name: section.version - 1})
+    assert app.stale_prompt_sections(dict(card, prompt_versions=outdated)) == [section.name]
+
+    # Unstamped cards count as version 1 when the section's fields are all there
+    unstamped = {field: value for field, value in card.items() if field != section.fields[0]}
+    assert section.name in app.stale_prompt_sections(unstamped)
@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+import streamlit_app as app
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a": 1}', {'a': 1}),
+    ('Here:\n```json\n{"a": "x}`"}\n```\nthanks', {'a': 'x}`'}),
+    ('note {see below} then {"a": 2}', {'a': 2}),
+    ('x {"a": {"b": 1}} y', {'a': {'b': 1}}),
+    ('{ ] {"a": 3}', {'a': 3}),
+])
+def test_extracts_the_first_complete_object(text, expected):
+    assert app.extract_json_object(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a": 1, "b": {"c": [1, 2', {'a': 1, 'b': {'c': [1]}}),
+    ('{"a": 1, "b": "unterm', {'a': 1}),
+    ('use { braces. {"a": 1, "b": 2', {'a': 1}),
+])
+def test_salvages_truncated_objects(text, expected):
+    assert app.extract_json_object(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', 'no json here', '[1, 2, 3]', '{'])
+def test_raises_value_error_without_an_object(text):
+    with pytest.raises(ValueError):
+        app.extract_json_object(text)
+
+
+@pytest.mark.parametrize('text', [
+    'note {' * 8000,
+    '{"a":' * 2000 + '"x"',
+    '{"k":1,' * 4000,
+    '{x' * 2000 + '}' * 2000,
+    '{"a":{' * 3000,
+])
+def test_pathological_inputs_stay_linear(text):
+    started = time.perf_counter()
+    try:
+        app.extract_json_object(text)
+    except ValueError:
+        pass
+    assert time.perf_counter() - started < 1.0
@@ -0,0 +1,47 @@
+import pytest
+
+import streamlit_app as app
+
+
+@pytest.fixture(params=['rules', 'dictionary'])
+def morphology(request, monkeypatch):
+    """Run each test with the built-in rules and, when pymorphy is installed, with its dictionary"""
+    if request.param == 'rules':
+        monkeypatch.setattr(app, 'get_morph_analyzer', lambda: None)
+    elif app.pymorphy is None:
+        pytest.skip("pymorphy is not installed")
+    return request.param
+
+
+@pytest.mark.parametrize('lemma, gender, animate, singular, plural', [
+    ('книга', 'feminine', False,
+     ['книга', 'книги', 'книге', 'книгу', 'книгой', 'книге'],
+     ['книги', 'книг', 'книгам', 'книги', 'книгами', 'книгах']),
+    ('врач', 'masculine', True,
+     ['врач', 'врача', 'врачу', 'врача', 'врачом', 'враче'],
+     ['врачи', 'врачей', 'врачам', 'врачей', 'врачами', 'врачах']),
+    ('окно', 'neuter', False,
+     ['окно', 'окна', 'окну', 'окно', 'окном', 'окне'],
+     ['окна', 'окон', 'окнам', 'окна', 'окнами', 'окнах']),
+    ('кофе', 'masculine', False, ['кофе'] * 6, ['кофе'] * 6),
+])
+def test_decline_noun(morphology, lemma, gender, animate, singular, plural):
+    assert app.decline_phrase(lemma, gender, animate) == (singular, plural)
+
+
+def test_decline_phrase_agrees_the_adjective(morphology):
+    singular, plural = app.decline_phrase('лимфатический узел', 'masculine')
+    assert singular[1] == 'лимфатического узла'
+    assert plural[4] == 'лимфатическими узлами'
+
+
+def test_conjugate_imperfective_verb(morphology):
+    conjugation, mood = app.conjugate_verb('читать', 'imperfective')
+    assert list(conjugation['present'].values()) == ['читаю', 'читаешь', 'читает', 'читаем', 'читаете', 'читают']
+    assert conjugation['past'] == {'masculine': 'читал', 'feminine': 'читала', 'neuter': 'читало', 'plural': 'читали'}
+    assert conjugation['future']['я'] == 'буду читать'
+    assert mood['imperative'].startswith('читай!')
+
+
+def test_word_roots_link_related_words():
+    assert app.word_roots('сердце') & app.word_roots('сердечный')
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+import streamlit_app as app
+
+LANE_CAPS = {app.LANE_INTERACTIVE: 1, app.LANE_PREFETCH: 1, app.LANE_WARMUP: 1}
+
+
+def make_blocked_scheduler(requests_per_minute=600):
+    """A one-worker scheduler whose worker is held until the returned event is set"""
+    scheduler = app.GenerationScheduler(LANE_CAPS, 1, app.RateLimiter(requests_per_minute))
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(10)
+
+    scheduler.submit(app.LANE_INTERACTIVE, 'hold', hold)
+    assert started.wait(10)
+    return scheduler, release
+
+
+def test_rate_limiter_keeps_the_reserve():
+    limiter = app.RateLimiter(6)
+    assert [limiter.try_acquire(reserve=3) for _ in range(4)] == [True, True, True, False]
+    assert limiter.available() == pytest.approx(3, abs=0.1)
+    assert limiter.seconds_until(reserve=3) > 0
+    assert limiter.try_acquire()
+
+
+def test_lanes_run_in_priority_order():
+    scheduler, release = make_blocked_scheduler()
+    ran = []
+    futures = [scheduler.submit(lane, lane, ran.append, lane)
+               for lane in (app.LANE_WARMUP, app.LANE_PREFETCH, app.LANE_INTERACTIVE)]
+    release.set()
+    for future in futures:
+        future.result(10)
+    assert ran == [app.LANE_INTERACTIVE, app.LANE_PREFETCH, app.LANE_WARMUP]
+
+
+def test_identical_work_shares_a_future():
+    scheduler, release = make_blocked_scheduler()
+    first = scheduler.submit(app.LANE_PREFETCH, 'card', lambda: 'done')
+    second = scheduler.submit(app.LANE_INTERACTIVE, 'card', lambda: 'other')
+    assert first is second
+    release.set()
+    assert first.result(10) == 'done'
+    assert scheduler.metrics()[app.LANE_INTERACTIVE]['queued'] == 0
+
+
+def test_cancel_keeps_jobs_other_sessions_wait_on():
+    scheduler, release = make_blocked_scheduler()
+    future = scheduler.submit(app.LANE_PREFETCH, 'card', lambda: 'done', tag='a')
+    scheduler.submit(app.LANE_PREFETCH, 'card', lambda: 'done', tag='b')
+    assert scheduler.cancel('a') == 0
+    assert not future.cancelled()
+    assert scheduler.cancel('b') == 1
+    assert future.cancelled()
+    release.set()
+
+
+def test_cancel_never_drops_untagged_waiters():
+    scheduler, release = make_blocked_scheduler()
+    future = scheduler.submit(app.LANE_WARMUP, 'card', lambda: 'done', tag='warmup')
+    scheduler.submit(app.LANE_WARMUP, 'card', lambda: 'done')
+    assert scheduler.cancel('warmup') == 0
+    release.set()
+    assert future.result(10) == 'done'
+
+
+def test_background_calls_are_charged_above_the_reserve():
+    scheduler = app.GenerationScheduler(LANE_CAPS, 1, app.RateLimiter(6))
+
+    def calls():
+        return [scheduler.acquire_request(scheduler.current_lane()) for _ in range(4)]
+
+    # The job's own start token pays for its first call
+    assert scheduler.submit(app.LANE_WARMUP, 'warmup', calls).result(10) == [True, True, True, False]
+    assert scheduler.rate_limiter.available() == pytest.approx(app.INTERACTIVE_RESERVED_REQUESTS, abs=0.1)
+
+
+def test_interactive_calls_wait_for_quota():
+    scheduler = app.GenerationScheduler(LANE_CAPS, 1, app.RateLimiter(6))
+    assert scheduler.submit(app.LANE_INTERACTIVE, 'click', scheduler.acquire_request, app.LANE_INTERACTIVE).result(10)
+    assert scheduler.acquire_request(None)
+    assert scheduler.rate_limiter.available() == pytest.approx(4, abs=0.1)
@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+
+import streamlit_app as app
+
+
+def vocabulary_source(subsections):
+    """A raw vocabulary file with one Anatomy section holding {key: (name, words)}"""
+    return {'vocabulary_database': {'anatomy': {
+        'name': 'Anatomy',
+        'description': 'The body',
+        'subsections': {key: {'name': name, 'description': name, 'words': words}
+                        for key, (name, words) in subsections.items()}
+    }}}
+
+
+@pytest.fixture
+def reload(tmp_path):
+    """Write a source vocabulary and refresh one index from it, returning the changes"""
+    index = app.VocabularyIndex()
+    path = tmp_path / 'vocabulary.json'
+
+    def reload(subsections):
+        path.write_text(json.dumps(vocabulary_source(subsections)))
+        # Make every write visible to the mtime check, however quickly they follow each other
+        os.utime(path, ns=(index.version + 1, index.version + 1))
+        return index.refresh(str(path))
+
+    reload.index = index
+    return reload
+
+
+def test_first_load_adds_everything(reload):
+    changes = reload({'organs': ('Organs', ['heart', 'liver']), 'lungs': ('Lungs', ['lung'])})
+    assert sorted(changes['added_subsections']) == [('Anatomy', 'Lungs'), ('Anatomy', 'Organs')]
+    assert len(changes['added_words']) == 3
+    assert reload.index.word_counts == {('Anatomy', 'Organs'): 2, ('Anatomy', 'Lungs'): 1}
+    assert reload.index.locations('heart') == [('Anatomy', 'Organs')]
+
+
+def test_reload_applies_only_the_differences(reload):
+    reload({'organs': ('Organs', ['heart', 'liver']), 'lungs': ('Lungs', ['lung'])})
+    heart_id = reload.index.word_ids['heart']
+    changes = reload({'organs': ('Organs', ['heart', 'kidney']), 'bones': ('Bones', ['bone'])})
+
+    assert changes['changed_subsections'] == [('Anatomy', 'Organs')]
+    assert changes['removed_subsections'] == [('Anatomy', 'Lungs')]
+    assert changes['added_subsections'] == [('Anatomy', 'Bones')]
+    assert sorted(changes['removed_words']) == [('liver', 'Anatomy', 'Organs'), ('lung', 'Anatomy', 'Lungs')]
+    assert sorted(changes['added_words']) == [('bone', 'Anatomy', 'Bones'), ('kidney', 'Anatomy', 'Organs')]
+
+    index = reload.index
+    assert index.word_ids['heart'] == heart_id
+    assert index.search('liv') == []
+    assert index.search('kid') == [('kidney', [('Anatomy', 'Organs')])]
+    assert index.locations('lung') == []
+    assert index.sections == {'Anatomy': {'Organs': ['heart', 'kidney'], 'Bones': ['bone']}}
+
+
+def test_renaming_a_subsection_moves_its_words(reload):
+    reload({'organs': ('Organs', ['heart'])})
+    changes = reload({'organs': ('Internal Organs', ['heart'])})
+    assert changes['removed_subsections'] == [('Anatomy', 'Organs')]
+    assert changes['added_subsections'] == [('Anatomy', 'Internal Organs')]
+    assert reload.index.locations('heart') == [('Anatomy', 'Internal Organs')]
+
+
+def test_unchanged_file_is_not_reloaded(reload):
+    reload({'organs': ('Organs', ['heart'])})
+    assert reload.index.refresh(reload.index.mtime[0]) is None
+
+
+def test_word_orders_are_stable_per_seed(reload):
+    words = [f"word {number}" for number in range(30)]
+    reload({'organs': ('Organs', words)})
+    index = reload.index
+    order = index.ordered_words('Anatomy', 'Organs', 'random', 'seed')
+    assert sorted(order) == sorted(words)
+    assert index.ordered_words('Anatomy', 'Organs', 'random', 'seed') == order
+    assert index.ordered_words('Anatomy', 'Organs', 'random', 'other seed') != order
+
+
+def test_compile_deduplicates_and_flattens():
+    source = vocabulary_source({'organs': ('Organs', ['Heart', ' heart ', 'lymph  node', 'liver'])})
+    source['vocabulary_database']['anatomy']['subsections']['nested'] = {
+        'bones': {'name': 'Bones', 'description': 'Bones', 'words': ['rib']}
+    }
+    artifact, issues = app.compile_vocabulary(source, 'checksum')
+
+    subsections = artifact['vocabulary_database']['anatomy']['subsections']
+    assert subsections['organs']['words'] == ['Heart', 'lymph node', 'liver']
+    assert subsections['bones']['words'] == ['rib']
+    assert (artifact['subsection_count'], artifact['word_count']) == (2, 4)
+    assert not [message for level, message in issues if level == 'error']
+    app.validate_vocabulary_artifact(artifact)
+
+
+@pytest.mark.parametrize('subsections', [{}, {'organs': ('Organs', ['heart', 7])}])
+def test_compile_reports_errors(subsections):
+    _, issues = app.compile_vocabulary(vocabulary_source(subsections), 'checksum')
+    assert [level for level, _ in issues if level == 'error']